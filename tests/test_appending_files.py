@@ -0,0 +1,71 @@
+import os
+import pytest
+import wavepostprocessing.appending_files as appending
+from wavepostprocessing.telemetry import reading_spans
+
+
+@pytest.fixture
+def individual_files(tmp_path, monkeypatch):
+    config = {'root_folder': str(tmp_path), 'results_folder': 'results', 'summary_folder': 'summary', 'filelist_folder': 'filelists',
+              'log_folder': 'logs', 'record_telemetry': 'Yes', 'remove_thresholds': 'No', 'variables_to_drop': [], 'processing': 'wave'}
+    monkeypatch.setattr(appending, 'config', config, raising=False)
+    folder = tmp_path / 'individual'
+    folder.mkdir()
+    # B has no value for enmo_30plus and no pwear column
+    (folder / 'A_summary.csv').write_text("id,file_id,enmo_30plus,pwear\nA,A,12,5\n")
+    (folder / 'B_summary.csv').write_text("id,file_id,enmo_30plus\nB,B,\n")
+    (folder / 'C_summary.csv').write_text("id,file_id,enmo_30plus,pwear\nC,C,7,3\n")
+    return config, str(folder), ['A_summary.csv', 'B_summary.csv', 'C_summary.csv']
+
+
+def streaming(config, folder, files_list, name):
+    appending.streaming_append(files_list, file_path=folder, append_level='summary', file_name=name)
+    with open(os.path.join(config['root_folder'], 'results', 'summary', f"{name}.csv")) as file:
+        return file.read()
+
+
+def test_output_does_not_depend_on_the_batches(individual_files, monkeypatch):
+    config, folder, files_list = individual_files
+    whole = streaming(config, folder, files_list, 'whole')
+    monkeypatch.setattr(appending, 'STREAMING_BATCH_ROWS', 1)
+    assert streaming(config, folder, files_list, 'batched') == whole
+    assert whole == "id,file_id,enmo_30plus,pwear\nA,A,12.0,5.0\nB,B,,\nC,C,7.0,3.0\n"
+
+
+def test_one_telemetry_span_per_append(individual_files):
+    config, folder, files_list = individual_files
+    streaming(config, folder, files_list, 'whole')
+    assert [span['function'] for span in reading_spans(config)] == ['streaming_append']
+
+
+def test_patching_keeps_the_rows_of_the_other_file_ids(tmp_path, monkeypatch):
+    config = {'root_folder': str(tmp_path), 'results_folder': 'results', 'summary_folder': 'summary', 'filelist_folder': 'filelists',
+              'time_res_folder': '1h', 'log_folder': 'logs', 'remove_thresholds': 'No', 'variables_to_drop': [], 'processing': 'wave',
+              'compact_dtypes': 'Yes'}
+    monkeypatch.setattr(appending, 'config', config, raising=False)
+    summary_folder = tmp_path / 'results' / 'summary'
+    (summary_folder / 'sum' / '1h').mkdir(parents=True)
+    (summary_folder / 'sum' / '1h' / 'B_summary_means.csv').write_text("id,file_id,device,enmo_30plus\nB,B,ax3,8\n")
+    # Values that would change if read with compact_dtypes or type inference: float32 thresholds, leading zeros, integers with empty cells
+    rows = ["id,file_id,device,enmo_30plus,subject_code,count", "A,A,ax3,0.123456789012345,007,12", "B,B,ax3,1.5,008,", "C,C,,30,009,"]
+    (summary_folder / 'all_summary.csv').write_text('\n'.join(rows) + '\n')
+
+    assert appending.patching_output('B', 'sum', 'B_summary_means.csv', 'all_summary', 'summary') == (1, 1)
+    lines = (summary_folder / 'all_summary.csv').read_text().splitlines()
+    assert lines[:3] == [rows[0], rows[1], rows[3]]
+    assert lines[3] == "B,B,ax3,8.0,,"
+
+
+def test_every_batch_is_written_with_the_dtypes_of_all_files(individual_files, monkeypatch):
+    config, folder, files_list = individual_files
+    # hours is a whole number in A and B and has decimals in C, code is a number in A and text in C
+    with open(os.path.join(folder, 'A_summary.csv'), 'w') as file:
+        file.write("id,file_id,hours,code\nA,A,12,1\n")
+    with open(os.path.join(folder, 'B_summary.csv'), 'w') as file:
+        file.write("id,file_id,hours,code\nB,B,10,2\n")
+    with open(os.path.join(folder, 'C_summary.csv'), 'w') as file:
+        file.write("id,file_id,hours,code\nC,C,7.5,X\n")
+    whole = streaming(config, folder, files_list, 'whole')
+    monkeypatch.setattr(appending, 'STREAMING_BATCH_ROWS', 1)
+    assert streaming(config, folder, files_list, 'batched') == whole
+    assert whole == "id,file_id,hours,code\nA,A,12.0,1\nB,B,10.0,2\nC,C,7.5,X\n"
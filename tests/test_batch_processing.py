@@ -0,0 +1,47 @@
+import os
+import sys
+import pytest
+from wavepostprocessing import batch_processing
+
+STAGE_SCRIPT = '''
+import os
+import sys
+
+if __name__ == '__main__':
+    folder = os.path.dirname(sys.argv[1])
+    task_id = os.environ['SLURM_ARRAY_TASK_ID']
+    with open(os.path.join(folder, f"task{task_id}.txt"), 'w') as file:
+        file.write(f"{os.environ['SLURM_ARRAY_TASK_COUNT']} {os.environ.get('WAVEPP_LEVEL')} {sys.argv[2]}")
+    if task_id == os.environ.get('FAILING_TASK'):
+        sys.exit(1)
+'''
+
+
+@pytest.fixture
+def stage(tmp_path, monkeypatch):
+    (tmp_path / 'local_stage.py').write_text(STAGE_SCRIPT)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    config_path = tmp_path / 'config.json'
+    config_path.write_text('{}')
+    return str(config_path)
+
+
+def test_every_array_task_runs_with_its_environment(stage, tmp_path):
+    job_id = batch_processing.submit_jobs('local_stage', stage, arrsize=3, executor='local', workers=2, environment={'WAVEPP_LEVEL': 'summary'})
+    assert job_id.startswith('local-local_stage-')
+    assert sorted(os.listdir(tmp_path)) == ['config.json', 'local_stage.py', 'task1.txt', 'task2.txt', 'task3.txt']
+    assert (tmp_path / 'task2.txt').read_text() == '3 summary 2'
+
+
+def test_a_failed_task_fails_the_job(stage):
+    assert batch_processing.run_local_jobs('local_stage', stage, arrsize=3, workers=1, environment={'FAILING_TASK': '2'}) is None
+
+
+def test_the_environment_is_restored_after_a_task(stage, monkeypatch):
+    monkeypatch.delenv('WAVEPP_LEVEL', raising=False)
+    monkeypatch.delenv('SLURM_ARRAY_TASK_ID', raising=False)
+    # run_array_task sets sys.argv for the stage script, as on a compute node
+    monkeypatch.setattr(sys, 'argv', list(sys.argv))
+    assert batch_processing.run_array_task('local_stage', stage, 1, 1, environment={'WAVEPP_LEVEL': 'daily'}) == (1, True, "")
+    assert 'WAVEPP_LEVEL' not in os.environ
+    assert 'SLURM_ARRAY_TASK_ID' not in os.environ
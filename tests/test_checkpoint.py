@@ -0,0 +1,25 @@
+import os
+from wavepostprocessing import checkpoint
+
+
+def test_finished_files_are_skipped_whatever_task_finished_them(tmp_path):
+    config = {'root_folder': str(tmp_path), 'log_folder': 'logs'}
+    checkpoint.mark_completed(config, 'collapse_summary', 1, 'A')
+    checkpoint.mark_completed(config, 'collapse_summary', 2, 'C')
+    checkpoint.mark_completed(config, 'generic_exh_postprocessing', 1, 'B')
+    assert list(checkpoint.remaining(config, 'collapse_summary', ['A', 'B', 'C', 'D'])) == ['B', 'D']
+
+
+def test_line_cut_off_by_a_killed_task_is_ignored(tmp_path):
+    config = {'root_folder': str(tmp_path), 'log_folder': 'logs'}
+    checkpoint.mark_completed(config, 'collapse_summary', 1, 'A')
+    with open(checkpoint.journal_path(config, 'collapse_summary', 1), 'a') as file:
+        file.write('B')
+    assert checkpoint.completed_files(config, 'collapse_summary') == {'A'}
+
+    # The cut off line is dropped, not completed
+    checkpoint.mark_completed(config, 'collapse_summary', 1, 'C')
+    assert checkpoint.completed_files(config, 'collapse_summary') == {'A', 'C'}
+
+    checkpoint.clear_progress(config)
+    assert not os.path.exists(checkpoint.progress_folder(config))
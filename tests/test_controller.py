@@ -0,0 +1,84 @@
+import asyncio
+import subprocess
+import pytest
+from wavepostprocessing import controller
+from wavepostprocessing.controller import SlurmBackend, run_controller
+
+
+class FakeBackend:
+    '''
+    Runs nothing: each submitted task ends in the next state given for it, then in 'done'.
+    '''
+    def __init__(self, outcomes=None, failed_submissions=0):
+        self.outcomes = {index: list(states) for index, states in (outcomes or {}).items()}
+        self.failed_submissions = failed_submissions
+        self.submitted = []
+        self.jobs = {}
+
+    def submit(self, stage, arrsize, indices, config, environment=None):
+        if self.failed_submissions:
+            self.failed_submissions -= 1
+            return None
+        job_id = f"{stage['name']}-{len(self.submitted) + 1}"
+        self.submitted.append((stage['name'], list(indices)))
+        self.jobs[job_id] = {index: (self.outcomes.get(index) or ['done']).pop(0) for index in indices}
+        return job_id
+
+    def poll(self, job_id, indices):
+        return {index: self.jobs[job_id][index] for index in indices}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {'root_folder': str(tmp_path), 'results_folder': 'results', 'filelist_folder': 'filelists', 'use_work_queue': 'No'}
+
+
+def running(config, backend, stages=('exhaustive',), max_retries=2):
+    plan = {'stages': list(stages), 'num_filelist': 3}
+    return asyncio.run(run_controller(config, plan, backend, poll_interval=0, max_retries=max_retries))
+
+
+def test_all_tasks_succeed(config):
+    backend = FakeBackend()
+    progress = running(config, backend, stages=('exhaustive', 'collapse'))
+    assert progress['exhaustive']['succeeded'] and progress['collapse']['succeeded']
+    assert backend.submitted == [('exhaustive', [1, 2, 3]), ('collapse', [1, 2, 3])]
+
+
+def test_failed_task_is_submitted_again_once(config, capsys):
+    backend = FakeBackend(outcomes={2: ['failed', 'done']})
+    progress = running(config, backend)
+    assert progress['exhaustive']['succeeded']
+    assert backend.submitted == [('exhaustive', [1, 2, 3]), ('exhaustive', [2])]
+    # The first job is no longer polled for task 2 once it has been submitted again
+    assert capsys.readouterr().out.count("Task 2 of exhaustive failed") == 1
+
+
+def test_task_fails_once_the_retries_are_used(config):
+    backend = FakeBackend(outcomes={2: ['failed'] * 3})
+    progress = running(config, backend, stages=('exhaustive', 'collapse'))
+    assert not progress['exhaustive']['succeeded'] and progress['exhaustive']['failed'] == 1
+    assert [indices for name, indices in backend.submitted if name == 'exhaustive'] == [[1, 2, 3], [2], [2]]
+    # Chunk 2 of the collapse is not run, the other chunks are
+    assert progress['collapse']['cancelled'] == 1 and progress['collapse']['done'] == 2
+
+
+def test_failed_submission_uses_an_attempt(config):
+    backend = FakeBackend(failed_submissions=1)
+    progress = running(config, backend)
+    assert progress['exhaustive']['succeeded']
+
+    backend = FakeBackend(failed_submissions=3)
+    assert not running(config, backend)['exhaustive']['succeeded']
+
+
+def test_tasks_that_left_the_queue_without_sacct_have_failed(monkeypatch):
+    def check_output(command, **kwargs):
+        if command[0] == 'sacct':
+            raise FileNotFoundError('sacct')
+        return b"1234_1|RUNNING\n"
+    monkeypatch.setattr(controller.subprocess, 'check_output', check_output)
+    assert SlurmBackend('.').poll('1234', [1, 2]) == {1: 'running', 2: 'failed'}
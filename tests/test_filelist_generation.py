@@ -0,0 +1,16 @@
+import pandas as pd
+import wavepostprocessing.filelist_generation as filelist_generation
+
+
+def test_size_balanced_split_keeps_the_files_of_an_id_together():
+    file_ids = ['A', 'B', 'C', 'D', 'E']
+    filelist_df = pd.DataFrame({'filename': [f"{prefix}_{file_id}.csv" for file_id in file_ids for prefix in ('1h', 'metadata')],
+                                'filename_temp': [file_id for file_id in file_ids for _ in range(2)]})
+    sizes = {'A': 500, 'B': 100, 'C': 300, 'D': 200, 'E': 400}
+    chunks = filelist_generation.size_balanced_split(filelist_df, sizes, 2)
+
+    ids_of_chunks = [sorted(set(chunk['filename_temp'])) for chunk in chunks]
+    # Largest first, each into the chunk holding the least data so far
+    assert ids_of_chunks == [['A', 'B', 'D'], ['C', 'E']]
+    assert [len(chunk) for chunk in chunks] == [6, 4]
+    assert [sum(sizes[file_id] for file_id in ids) for ids in ids_of_chunks] == [800, 700]
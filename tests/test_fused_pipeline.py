@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+import wavepostprocessing.fused_pipeline as fused
+
+
+@pytest.fixture(params=['No', 'Yes'], ids=['default_dtypes', 'compact_dtypes'])
+def config(tmp_path, request):
+    config = {'root_folder': str(tmp_path), 'results_folder': 'results', 'summary_folder': 'summary', 'individual_partpro_f': 'part_proc',
+              'individual_trimmed_f': 'trimmed', 'individual_sum_f': 'sum', 'individual_daily_f': 'daily', 'time_res_folder': '1h',
+              'output_file_ext': 'part_proc', 'intermediate_format': 'csv', 'compact_dtypes': request.param, 'fused_write_part_proc': 'No',
+              'run_create_trimmed_file': 'Yes', 'run_collapse_results_to_summary': 'Yes', 'run_collapse_results_to_daily': 'No'}
+    fused.binding_config(config)
+    return config
+
+
+def exhaustive_output():
+    # As the exhaustive postprocessing leaves a file, out of order, with dates and times as datetimes and numbers to round
+    times = pd.to_datetime(['2024-01-01 02:00:00', '2024-01-01 00:00:00', '2024-01-01 01:00:00'])
+    return pd.DataFrame({
+        'file_id': ['007'] * 3, 'subject_code': ['00123'] * 3, 'device': ['ax3'] * 3,
+        'DATETIME': times, 'DATETIME_ORIG': times, 'DATE': times.normalize(), 'timestamp': times,
+        'ENMO_mean': [1 / 3, 2.5, np.nan], 'ENMO_30plus': [0.1234567, 0.0, 1.0], 'Pwear': [1.0, 0.5, 0.0], 'hourofday': [2, 0, 1],
+        'valid': [True, np.nan, False], 'FLAG_MECH_NOISE': [0, 0, 1],
+    })
+
+
+def test_collapse_gets_the_same_frame_as_from_the_part_processed_file(config, monkeypatch):
+    prepared = []
+    monkeypatch.setattr(fused.exh, 'processing_files', lambda files_list, anomalies_df: [exhaustive_output()])
+    monkeypatch.setattr(fused.collapse, 'preparing_file', lambda df, file_id, time_resolution, output_trimmed_df, part_proc_df=None: prepared.append((time_resolution, df)) or df)
+    monkeypatch.setattr(fused.collapse, 'collapse_to_summary', lambda df, file_id, time_resolution: None)
+    fused.fused_file('007', None)
+
+    # The two-stage path: the exhaustive postprocessing writes the part processed file, collapse_results reads it back
+    fused.exh.outputting_dataframe([exhaustive_output()], ['007'])
+    time_resolution, two_stage_df = fused.collapse.reading_part_proc('007', date_orig='DATETIME_ORIG')
+
+    [(fused_resolution, fused_df)] = prepared
+    assert fused_resolution == time_resolution
+    pd.testing.assert_frame_equal(fused_df, two_stage_df)
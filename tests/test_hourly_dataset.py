@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from wavepostprocessing import hourly_dataset
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {'root_folder': str(tmp_path), 'results_folder': 'results', 'summary_folder': 'summary', 'hour_output_file': 'all_hourly',
+            'hourly_output_format': 'parquet_dataset'}
+
+
+def test_partitions_with_an_empty_text_column_are_unified(config):
+    # In B, the device and note columns have no values, they are read from the trimmed file as float
+    hourly_dataset.writing_partition(config, pd.DataFrame({'id': ['A'], 'file_id': ['A'], 'device': ['ax3'], 'note': ['worn'], 'ENMO_mean': [12]}), 'A.parquet')
+    hourly_dataset.writing_partition(config, pd.DataFrame({'id': ['B'], 'file_id': ['B'], 'device': [np.nan], 'note': [np.nan], 'ENMO_mean': [7.5]}), 'B.parquet')
+    schema = hourly_dataset.updating_metadata(config)
+    assert [str(schema.field(name).type) for name in ['id', 'device', 'note', 'ENMO_mean']] == ['string', 'string', 'string', 'double']
+
+    df = hourly_dataset.reading_dataset(config)
+    assert df['device'].tolist()[0] == 'ax3' and pd.isna(df['device'].tolist()[1])
+    assert df['note'].tolist()[0] == 'worn' and pd.isna(df['note'].tolist()[1])
+    assert df['ENMO_mean'].tolist() == [12.0, 7.5]
+
+
+def test_ids_that_look_like_numbers_are_written_as_text(config):
+    hourly_dataset.writing_partition(config, pd.DataFrame({'id': [12], 'file_id': [12], 'Pwear': [1]}), '12.parquet')
+    hourly_dataset.writing_partition(config, pd.DataFrame({'id': ['X1'], 'file_id': [np.nan], 'Pwear': [np.nan]}), hourly_dataset.NO_ANALYSIS_PARTITION)
+    hourly_dataset.updating_metadata(config)
+    df = hourly_dataset.reading_dataset(config)
+    assert df['id'].tolist() == ['12', 'X1']
+
+
+def test_partition_up_to_date_follows_the_trimmed_file(config, tmp_path):
+    trimmed = tmp_path / 'A_TRIMMED_1h.csv'
+    trimmed.write_text("id,file_id\nA,A\n")
+    assert not hourly_dataset.partition_up_to_date(config, str(trimmed), 'A')
+    hourly_dataset.writing_partition(config, pd.DataFrame({'id': ['A'], 'file_id': ['A']}), 'A.parquet', hourly_dataset.source_state(config, str(trimmed)))
+    assert hourly_dataset.partition_up_to_date(config, str(trimmed), 'A')
+    trimmed.write_text("id,file_id\nA,A\nA,A\n")
+    assert not hourly_dataset.partition_up_to_date(config, str(trimmed), 'A')
+
+
+def test_only_changed_partitions_are_written(config, tmp_path, monkeypatch):
+    import wavepostprocessing.appending_files as appending
+    config.update({'filelist_folder': 'filelists', 'remove_thresholds': 'No', 'variables_to_drop': [], 'processing': 'wave', 'log_folder': 'logs'})
+    monkeypatch.setattr(appending, 'config', config, raising=False)
+    folder = tmp_path / 'trimmed'
+    folder.mkdir()
+    (folder / 'A_TRIMMED_1h.csv').write_text("file_id,ENMO_mean\nA,1.5\nA,2.5\n")
+    (folder / 'B_TRIMMED_1h.csv').write_text("file_id,ENMO_mean\nB,3.5\n")
+    appending.appending_dataset(['A_TRIMMED_1h.csv', 'B_TRIMMED_1h.csv'], str(folder))
+    assert hourly_dataset.partition_names(config) == ['A.parquet', 'B.parquet']
+
+    # B has been processed again and A's trimmed file is gone
+    (folder / 'B_TRIMMED_1h.csv').write_text("file_id,ENMO_mean\nB,4.5\nB,5.5\n")
+    appending.appending_dataset(['B_TRIMMED_1h.csv'], str(folder))
+    assert hourly_dataset.partition_names(config) == ['B.parquet']
+    df = hourly_dataset.reading_dataset(config)
+    assert df['ENMO_mean'].tolist() == [4.5, 5.5]
+    assert df['id'].tolist() == ['B', 'B']
+
+    # Nothing changed: the partition is not written again
+    written = os.path.getmtime(os.path.join(hourly_dataset.dataset_path(config), 'B.parquet'))
+    appending.appending_dataset(['B_TRIMMED_1h.csv'], str(folder))
+    assert os.path.getmtime(os.path.join(hourly_dataset.dataset_path(config), 'B.parquet')) == written
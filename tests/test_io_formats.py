@@ -0,0 +1,67 @@
+import os
+import pandas as pd
+import pytest
+from wavepostprocessing import io_formats
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def part_proc_df():
+    return pd.DataFrame({'file_id': ['A', 'A'], 'DATETIME': ['2024-01-01 00:00:00', '2024-01-01 01:00:00'], 'ENMO_mean': [1.5, 2.5], 'hourofday': [0, 1]})
+
+
+def touching(path, mtime):
+    with open(path, 'w') as file:
+        file.write('file_id\nA\n')
+    os.utime(path, (mtime, mtime))
+
+
+def test_resolving_path_finds_the_file_in_any_format(tmp_path):
+    csv_path = str(tmp_path / 'A_part_proc.csv')
+    # Not written yet: the path in the configured format
+    assert io_formats.resolving_path({'intermediate_format': 'parquet'}, csv_path) == str(tmp_path / 'A_part_proc.parquet')
+    assert io_formats.resolving_path({}, csv_path) == csv_path
+
+    # Written as feather, whatever the format is now
+    touching(str(tmp_path / 'A_part_proc.feather'), 1000)
+    assert io_formats.resolving_path({'intermediate_format': 'parquet'}, csv_path) == str(tmp_path / 'A_part_proc.feather')
+    # With copies in two formats, the most recently written one
+    touching(csv_path, 2000)
+    assert io_formats.resolving_path({'intermediate_format': 'parquet'}, csv_path) == csv_path
+
+
+def test_intermediate_format_must_be_known():
+    with pytest.raises(ValueError):
+        io_formats.intermediate_format({'intermediate_format': 'xlsx'})
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'feather'])
+def test_writing_replaces_the_other_formats(tmp_path, part_proc_df, file_format):
+    csv_path = str(tmp_path / 'A_part_proc.csv')
+    part_proc_df.to_csv(csv_path, index=False)
+    written = io_formats.writing_intermediate({'intermediate_format': file_format}, part_proc_df, csv_path)
+    assert written == str(tmp_path / f"A_part_proc.{file_format}")
+    assert os.listdir(tmp_path) == [f"A_part_proc.{file_format}"]
+    pd.testing.assert_frame_equal(io_formats.reading_table(written), part_proc_df)
+    assert io_formats.table_columns(written) == list(part_proc_df.columns)
+
+
+def test_npy_round_trip_keeps_the_columns_and_types(tmp_path):
+    df = pd.DataFrame({'file_id': ['A', 'A', None], 'ENMO_mean': [1.5, float('nan'), 2.5], 'hourofday': [0, 1, 2],
+                       'valid': [True, False, True]})
+    written = io_formats.writing_intermediate({'intermediate_format': 'npy'}, df, str(tmp_path / 'A_part_proc.csv'))
+    assert written == str(tmp_path / 'A_part_proc.npy')
+    assert io_formats.table_columns(written) == list(df.columns)
+    read = io_formats.reading_npy(written)
+    pd.testing.assert_frame_equal(read, df)
+
+    # The float columns are copy-on-write: changing them does not change the file
+    read.loc[0, 'ENMO_mean'] = 99.0
+    assert io_formats.reading_npy(written)['ENMO_mean'].iloc[0] == 1.5
+
+
+def test_empty_npy_file_can_be_read(tmp_path):
+    df = pd.DataFrame({'file_id': pd.Series([], dtype=object), 'ENMO_mean': pd.Series([], dtype='float64')})
+    written = io_formats.writing_intermediate({'intermediate_format': 'npy'}, df, str(tmp_path / 'A_part_proc.csv'))
+    pd.testing.assert_frame_equal(io_formats.reading_npy(written), df)
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+import wavepostprocessing.filelist_generation as filelist_generation
+from wavepostprocessing import job_sizing
+
+
+@pytest.fixture
+def config(tmp_path):
+    results = tmp_path / 'results'
+    (results / 'filelists').mkdir(parents=True)
+    for file_id, size in [('A', 500), ('B', 100), ('C', 300), ('D', 200), ('E', 400)]:
+        (results / f"1h_{file_id}.csv").write_bytes(b'x' * size)
+    # A filelist left by an earlier run, with other IDs
+    (results / 'filelists' / 'filelist0.txt').write_text("filename\tfilename_temp\n1h_A.csv\tA\n")
+    return {'root_folder': str(tmp_path), 'results_folder': 'results', 'filelist_folder': 'filelists', 'count_prefixes': '1h'}
+
+
+def test_planned_ids_are_split_in_order(config):
+    chunks = job_sizing.chunk_file_sizes(config, 2, file_ids=['A', 'B', 'C', 'D', 'E'])
+    assert chunks == [[500, 100, 300], [200, 400]]
+
+
+def test_planned_ids_are_split_as_filelist_generation_does(config):
+    config['balance_filelists_by_size'] = 'Yes'
+    file_ids = ['A', 'B', 'C', 'D', 'E']
+    chunks = job_sizing.chunk_file_sizes(config, 2, file_ids=file_ids)
+
+    filelist_generation.config = config
+    filelist_df = pd.DataFrame({'filename_temp': file_ids})
+    sizes = filelist_generation.data_file_sizes(filelist_df)
+    written = filelist_generation.size_balanced_split(filelist_df, sizes, 2)
+    assert [sorted(chunk) for chunk in chunks] == [sorted(sizes[file_id] for file_id in chunk['filename_temp']) for chunk in written]
+
+
+def test_wall_time_is_not_below_the_floor(config):
+    time, _ = job_sizing.estimate_resources('wavepostprocessing.generic_exh_postprocessing', config, 2, file_ids=['A'])
+    assert time == '00:40:00'
+    config['min_task_minutes'] = 15
+    time, _ = job_sizing.estimate_resources('wavepostprocessing.generic_exh_postprocessing', config, 2, file_ids=['A'])
+    assert time == '00:15:00'
+
+
+def test_auto_num_filelist_follows_the_data_volume(config):
+    # 1000 small files take the collapse 6000 s, in tasks of 1160 s
+    assert job_sizing.auto_num_filelist(config, [0] * 1000) == 6
+    assert job_sizing.auto_num_filelist(config, [0] * 3) == 1
+    # Never more chunks than files, or than max_num_filelist
+    assert job_sizing.auto_num_filelist(config, [10e9] * 3) == 3
+    config['max_num_filelist'] = 4
+    assert job_sizing.auto_num_filelist(config, [0] * 1000) == 4
+
+
+def test_auto_num_filelist_uses_the_last_filelist_generation(config, tmp_path):
+    config['num_filelist'] = 'auto'
+    assert job_sizing.number_of_filelists(config) == 1
+    (tmp_path / 'results' / 'filelists' / 'num_filelist.txt').write_text("7\n")
+    assert job_sizing.number_of_filelists(config) == 7
+    config['run_filelist_generation'] = 'Yes'
+    assert job_sizing.number_of_filelists(config) == 1
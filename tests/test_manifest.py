@@ -0,0 +1,56 @@
+import os
+import pytest
+from wavepostprocessing import manifest
+
+
+@pytest.fixture
+def config(tmp_path):
+    config = {'root_folder': str(tmp_path), 'results_folder': 'results', 'summary_folder': 'summary', 'log_folder': 'logs',
+              'individual_partpro_f': 'part_proc', 'individual_trimmed_f': 'trimmed', 'individual_sum_f': 'sum', 'individual_daily_f': 'daily',
+              'time_res_folder': '1h', 'output_file_ext': 'part_proc', 'count_prefixes': '1h', 'sum_overall_means': 'summary_means',
+              'day_overall_mean': 'daily_means', 'processing': 'wave', 'incremental_rebuild': 'Yes', 'min_day_hours': 16}
+    writing(manifest.part_proc_path(config, 'A'), 'file_id,ENMO_mean\nA,1.5\n')
+    return config
+
+
+def writing(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+def summarising(config, file_id):
+    # What collapse_summary writes for a file ID
+    for path in manifest.stage_outputs(config, 'collapse_summary', file_id):
+        writing(path, 'file_id\nA\n')
+    manifest.record_file(config, 'collapse_summary', file_id)
+
+
+def test_unchanged_file_is_skipped(config):
+    assert not manifest.skip_file(config, 'collapse_summary', 'A')
+    summarising(config, 'A')
+    assert manifest.skip_file(config, 'collapse_summary', 'A')
+
+
+def test_changed_input_is_processed_again(config):
+    summarising(config, 'A')
+    writing(manifest.part_proc_path(config, 'A'), 'file_id,ENMO_mean\nA,2.5\n')
+    assert not manifest.skip_file(config, 'collapse_summary', 'A')
+
+
+def test_only_the_config_keys_of_the_stage_count(config):
+    summarising(config, 'A')
+    # A release setting does not change the collapsed files, the minimum hours of a valid day does
+    assert manifest.skip_file(dict(config, sum_pwear=10), 'collapse_summary', 'A')
+    assert not manifest.skip_file(dict(config, min_day_hours=10), 'collapse_summary', 'A')
+
+
+def test_missing_output_is_processed_again(config):
+    summarising(config, 'A')
+    os.remove(manifest.stage_outputs(config, 'collapse_summary', 'A')[1])
+    assert not manifest.skip_file(config, 'collapse_summary', 'A')
+
+
+def test_nothing_is_skipped_without_incremental_rebuild(config):
+    summarising(config, 'A')
+    assert not manifest.skip_file(dict(config, incremental_rebuild='No'), 'collapse_summary', 'A')
@@ -0,0 +1,51 @@
+import json
+import os
+import pytest
+from wavepostprocessing import multi_project
+from wavepostprocessing.pipeline import STAGES
+
+
+def stage(name):
+    return next(stage for stage in STAGES if stage['name'] == name)
+
+
+@pytest.fixture
+def projects():
+    return [('/projects/one', {'project': 'one'}, {'stages': ['collapse', 'append_daily'], 'num_filelist': 2, 'file_ids': ['A', 'B']}),
+            ('/projects/two', {'project': 'two'}, {'stages': ['collapse'], 'num_filelist': 3, 'file_ids': ['C', 'D', 'E']})]
+
+
+def test_time_and_memory_requests_are_compared():
+    assert multi_project.time_seconds('1-02:00:00') == 26 * 3600
+    assert multi_project.time_seconds('45:00') == 45 * 60
+    assert multi_project.memory_mb('2G') == 2048
+    assert multi_project.memory_mb('1500') == 1500
+
+
+def test_tasks_of_all_projects_share_one_array_job(projects):
+    entries = multi_project.packing_tasks(projects, stage('collapse'))
+    assert [(entry['directory'], entry['task_id'], entry['task_count']) for entry in entries] == \
+           [('/projects/one', 1, 2), ('/projects/one', 2, 2), ('/projects/two', 1, 3), ('/projects/two', 2, 3), ('/projects/two', 3, 3)]
+    entries = multi_project.packing_tasks(projects, stage('append_daily'))
+    assert entries == [{'module': 'wavepostprocessing.appending_files', 'directory': '/projects/one', 'task_id': 1, 'task_count': 1,
+                        'environment': {'WAVEPP_LEVEL': 'daily'}}]
+
+
+def test_shared_job_requests_the_most_demanding_project(projects, monkeypatch):
+    resources = {'one': ('02:00:00', '3G'), 'two': ('00:50:00', '8000M')}
+    monkeypatch.setattr(multi_project, 'job_resources', lambda module, config, arrsize, **options: resources[config['project']])
+    assert multi_project.shared_resources(projects, stage('collapse')) == ('02:00:00', '8000M')
+
+
+def test_task_runs_its_entry_of_the_mapping_file(tmp_path, monkeypatch):
+    mapping_file = tmp_path / 'collapse.json'
+    mapping_file.write_text(json.dumps([{'module': 'one', 'directory': '/projects/one', 'task_id': 1, 'task_count': 1, 'environment': {}},
+                                        {'module': 'two', 'directory': '/projects/two', 'task_id': 3, 'task_count': 3, 'environment': {'WAVEPP_LEVEL': 'daily'}}]))
+    runs = []
+    monkeypatch.setattr(multi_project.runpy, 'run_module', lambda module, **options: runs.append((module, list(multi_project.sys.argv))))
+    for name in ['SLURM_ARRAY_TASK_ID', 'SLURM_ARRAY_TASK_COUNT', 'WAVEPP_LEVEL']:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(multi_project.sys, 'argv', [])
+    multi_project.dispatching_task(str(mapping_file), '2')
+    assert runs == [('two', ['two', '/projects/two', '3', '3'])]
+    assert (os.environ['SLURM_ARRAY_TASK_ID'], os.environ['WAVEPP_LEVEL']) == ('3', 'daily')
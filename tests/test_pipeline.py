@@ -0,0 +1,62 @@
+import pytest
+from wavepostprocessing import pipeline
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    calls = []
+
+    def submit_jobs(module, directory, arrsize, num_cpu, jid, config, dependency, environment, **submit_options):
+        calls.append({'module': module, 'arrsize': arrsize, 'jid': jid, 'dependency': dependency, 'environment': environment})
+        return f"{len(calls)}"
+
+    monkeypatch.setattr(pipeline, 'submit_jobs', submit_jobs)
+    return calls
+
+
+@pytest.fixture
+def config():
+    return {'processing': 'wave', 'run_filelist_generation': 'Yes', 'run_generic_exh_postprocessing': 'Yes', 'run_collapse_results_to_summary': 'Yes',
+            'run_append_summary_files': 'Yes', 'run_append_daily_files': 'Yes', 'run_verification_checks': 'Yes', 'run_prepare_summary_release': 'Yes'}
+
+
+def test_independent_stages_share_their_upstream_job(config, submitted):
+    job_ids = pipeline.submit_pipeline(config, 'directory', 4)
+    assert list(job_ids) == ['filelist_generation', 'exhaustive', 'collapse', 'append_summary', 'append_daily', 'verification', 'release_summary']
+    # The pampro stages are not run, filelist generation does not wait for anything
+    assert submitted[0]['jid'] is None
+    assert submitted[1]['arrsize'] == 4 and submitted[1]['jid'] == [job_ids['filelist_generation']]
+    # Both appends wait for the collapse, and for the filelist generation the fused stage (not run) would have waited for
+    assert submitted[3]['jid'] == submitted[4]['jid'] == [job_ids['collapse'], job_ids['filelist_generation']]
+    assert [call['environment'] for call in submitted[3:5]] == [{'WAVEPP_LEVEL': 'summary'}, {'WAVEPP_LEVEL': 'daily'}]
+    # The hourly append is not run, so the verification waits for the other two appends and for what the hourly append waits for
+    assert submitted[5]['jid'] == [job_ids['append_summary'], job_ids['append_daily'], job_ids['collapse'], job_ids['filelist_generation']]
+    assert submitted[6]['jid'] == [job_ids['append_summary']]
+
+
+def test_stages_after_a_failed_submission_are_not_submitted(config, monkeypatch):
+    def submit_jobs(module, directory, **options):
+        return None if module == 'wavepostprocessing.collapse_results' else 'job'
+
+    monkeypatch.setattr(pipeline, 'submit_jobs', submit_jobs)
+    job_ids = pipeline.submit_pipeline(config, 'directory', 4)
+    assert list(job_ids) == ['filelist_generation', 'exhaustive', 'collapse']
+
+
+def test_fused_stage_replaces_the_two_per_file_stages(config, submitted):
+    config['run_fused_pipeline'] = 'Yes'
+    job_ids = pipeline.submit_pipeline(config, 'directory', 4)
+    assert 'exhaustive' not in job_ids and 'collapse' not in job_ids
+    assert submitted[1]['jid'] == [job_ids['filelist_generation']]
+    assert submitted[2]['jid'] == [job_ids['filelist_generation'], job_ids['fused']]
+
+
+def test_collapse_chunks_follow_the_exhaustive_chunks(config, submitted):
+    pipeline.submit_pipeline(config, 'directory', 4, pipeline_chunks=True)
+    assert [call['dependency'] for call in submitted[:3]] == ['afterok', 'afterok', 'aftercorr']
+
+    # Chunks are not fixed with the work queue
+    submitted.clear()
+    config['use_work_queue'] = 'Yes'
+    pipeline.submit_pipeline(config, 'directory', 4, pipeline_chunks=True)
+    assert submitted[2]['dependency'] == 'afterok'
@@ -0,0 +1,45 @@
+import os
+import pytest
+from wavepostprocessing import planning
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {'root_folder': str(tmp_path), 'results_folder': 'results', 'filelist_folder': 'filelists', 'processing': 'wave', 'num_filelist': 10,
+            'run_generic_exh_postprocessing': 'Yes', 'run_collapse_results_to_summary': 'Yes', 'run_append_summary_files': 'Yes',
+            'run_prepare_summary_release': 'Yes'}
+
+
+def writing_filelist(config, file_ids):
+    folder = os.path.join(config['root_folder'], 'results', 'filelists')
+    os.makedirs(folder)
+    with open(os.path.join(folder, 'filelist.txt'), 'w') as file:
+        file.write('filename_temp\n' + ''.join(f"{file_id}\n" for file_id in file_ids))
+
+
+def test_stages_with_files_are_planned(config):
+    writing_filelist(config, ['A', 'B', 'A'])
+    plan = planning.plan_pipeline(config)
+    assert plan['file_ids'] == ['A', 'B']
+    assert plan['stages'] == ['exhaustive', 'collapse', 'append_summary', 'release_summary']
+    assert plan['skipped'] == []
+
+
+def test_stages_after_an_empty_filelist_are_skipped(config):
+    writing_filelist(config, [])
+    plan = planning.plan_pipeline(config)
+    assert plan['stages'] == []
+    assert plan['skipped'] == ['exhaustive', 'collapse', 'append_summary', 'release_summary']
+
+
+def test_stages_are_run_when_the_files_are_not_known(config):
+    # No filelist yet and no filelist generation: the per-file stages find out for themselves
+    plan = planning.plan_pipeline(config)
+    assert plan['file_ids'] is None
+    assert plan['stages'] == ['exhaustive', 'collapse', 'append_summary', 'release_summary']
+
+
+def test_number_of_chunks_is_not_above_the_number_of_files(config):
+    config['run_filelist_generation'] = 'Yes'
+    assert planning.planned_num_filelist(config, ['A', 'B', 'C']) == 3
+    assert planning.planned_num_filelist(config, []) == 1
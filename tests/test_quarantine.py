@@ -0,0 +1,66 @@
+import os
+import pytest
+from wavepostprocessing import manifest
+from wavepostprocessing.quarantine import processing_with_quarantine, reading_quarantine, quarantine_files, quarantine_file, writing_retry_filelists, archiving_quarantine
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    monkeypatch.delenv('SLURM_ARRAY_JOB_ID', raising=False)
+    monkeypatch.delenv('SLURM_ARRAY_TASK_ID', raising=False)
+    return {'root_folder': str(tmp_path), 'results_folder': 'results', 'log_folder': 'logs', 'summary_folder': 'summary',
+            'individual_partpro_f': 'part_proc', 'individual_trimmed_f': 'trimmed', 'individual_sum_f': 'sum', 'individual_daily_f': 'daily',
+            'time_res_folder': '1h', 'output_file_ext': 'part_proc', 'count_prefixes': '1h', 'sum_overall_means': 'summary_means',
+            'day_overall_mean': 'daily_means', 'run_collapse_results_to_summary': 'Yes'}
+
+
+def writing(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write('file_id\nA\n')
+
+
+def failing_on(failing_id):
+    def step(file_id):
+        if file_id == failing_id:
+            raise ValueError(f"cannot process {file_id}")
+        return file_id
+    return step
+
+
+def test_failed_file_is_quarantined_and_the_rest_processed(config):
+    assert list(processing_with_quarantine(config, 'generic_exh_postprocessing', 1, ['A', 'B', 'C'], failing_on('B'))) == ['A', 'C']
+    assert [(record['stage'], record['file_id']) for record in reading_quarantine(config)] == [('generic_exh_postprocessing', 'B')]
+
+
+def test_outputs_of_a_quarantined_file_are_removed(config):
+    # Outputs left by an earlier run
+    outputs = manifest.stage_outputs(config, 'fused_pipeline', 'B')
+    for path in outputs:
+        writing(path)
+    list(processing_with_quarantine(config, 'generic_exh_postprocessing', 1, ['B'], failing_on('B')))
+    assert not any(os.path.exists(path) for path in outputs)
+
+
+def test_collapse_skips_files_quarantined_upstream(config):
+    list(processing_with_quarantine(config, 'generic_exh_postprocessing', 1, ['A', 'B'], failing_on('B')))
+    writing(manifest.part_proc_path(config, 'A'))
+    processed = list(processing_with_quarantine(config, 'collapse_summary', 1, ['A', 'B'], lambda file_id: file_id))
+    assert processed == ['A']
+    # Not quarantined again in the collapse
+    assert [record['stage'] for record in reading_quarantine(config)] == ['generic_exh_postprocessing']
+
+
+def test_records_are_kept_until_the_retry_is_submitted(config, monkeypatch):
+    config.update({'filelist_folder': 'filelists'})
+    os.makedirs(os.path.join(config['root_folder'], 'results', 'filelists'))
+    quarantine_file(config, 'generic_exh_postprocessing', 'B', ValueError('bad file'))
+    resubmitted = quarantine_files(config)
+    assert writing_retry_filelists(config) == 1
+    assert [record['file_id'] for record in reading_quarantine(config)] == ['B']
+
+    # A record written by the retry job before the archiving is kept
+    monkeypatch.setenv('SLURM_ARRAY_JOB_ID', 'retry')
+    quarantine_file(config, 'generic_exh_postprocessing', 'C', ValueError('bad file'))
+    archiving_quarantine(config, resubmitted)
+    assert [record['file_id'] for record in reading_quarantine(config)] == ['C']
@@ -0,0 +1,72 @@
+import os
+import pytest
+import wavepostprocessing.run_one as run_one_module
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    config = {'root_folder': str(tmp_path), 'results_folder': 'results', 'summary_folder': 'summary', 'log_folder': 'logs', 'processing': 'wave',
+              'individual_partpro_f': 'part_proc', 'individual_trimmed_f': 'trimmed', 'individual_sum_f': 'sum', 'individual_daily_f': 'daily',
+              'time_res_folder': '1h', 'output_file_ext': 'part_proc', 'count_prefixes': '1h', 'sum_overall_means': 'summary_means',
+              'day_overall_mean': 'daily_means', 'run_create_trimmed_file': 'Yes', 'run_collapse_results_to_summary': 'Yes',
+              'run_collapse_results_to_daily': 'Yes'}
+    monkeypatch.setattr(run_one_module, 'load_config', lambda directory: config)
+    return config
+
+
+def writing(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+def reading(path):
+    with open(path, 'r') as file:
+        return file.read()
+
+
+def individual_files(config):
+    run_one_module.config = config
+    return run_one_module.individual_files('A')
+
+
+def test_previous_outputs_are_kept_when_processing_fails(config, monkeypatch):
+    trimmed, summary, daily = individual_files(config)
+    for path in (trimmed, summary, daily):
+        writing(path, 'previous\n')
+
+    def failing(file_id, anomalies_df):
+        # Fails after writing part of the new outputs
+        writing(trimmed, 'new\n')
+        raise ValueError("cannot process A")
+
+    monkeypatch.setattr(run_one_module.fused, 'fused_file', failing)
+    with pytest.raises(ValueError):
+        run_one_module.run_one('directory', 'A')
+    assert [reading(path) for path in (trimmed, summary, daily)] == ['previous\n'] * 3
+    assert not any(name.endswith('.previous') for folder, _, names in os.walk(config['root_folder']) for name in names)
+
+
+def test_outputs_no_longer_written_are_removed(config, monkeypatch):
+    trimmed, summary, daily = individual_files(config)
+    for path in (trimmed, summary, daily):
+        writing(path, 'previous\n')
+
+    # The file ID no longer has valid days: only the summary file is written
+    monkeypatch.setattr(run_one_module.fused, 'fused_file', lambda file_id, anomalies_df: writing(summary, 'new\n'))
+    assert run_one_module.run_one('directory', 'A') == {}
+    assert reading(summary) == 'new\n'
+    assert not os.path.exists(trimmed) and not os.path.exists(daily)
+    assert not any(name.endswith('.previous') for folder, _, names in os.walk(config['root_folder']) for name in names)
+
+
+def test_rows_are_patched_in_the_appended_files_switched_on(config, monkeypatch):
+    config.update({'run_append_summary_files': 'Yes', 'sum_output_file': 'all_summary'})
+    patched = []
+    monkeypatch.setattr(run_one_module.fused, 'fused_file', lambda file_id, anomalies_df: None)
+    monkeypatch.setattr(run_one_module.appending, 'patching_output', lambda *args: patched.append(args) or (1, 1))
+    assert run_one_module.run_one('directory', 'A') == {'all_summary': (1, 1)}
+    assert patched == [('A', 'sum', 'A_summary_means.csv', 'all_summary', 'summary')]
+    # Without patching, e.g. when the watch appends all individual files afterwards
+    assert run_one_module.run_one('directory', 'A', patch=False) == {}
+    assert len(patched) == 1
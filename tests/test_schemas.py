@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from wavepostprocessing import schemas
+
+
+@pytest.fixture
+def part_proc_df():
+    # As finalising_dataframe leaves it: dates and times as datetimes, IDs as text, thresholds and Pwear as numbers
+    return pd.DataFrame({
+        'file_id': ['007', '007', '007'],
+        'subject_code': ['00123', '00123', '00123'],
+        'device': ['ax3', 'ax3', 'ax3'],
+        'DATETIME': pd.to_datetime(['2024-01-01 00:00:00', '2024-01-01 01:00:00', '2024-01-01 02:00:00']),
+        'DATETIME_ORIG': pd.to_datetime(['2024-01-01 00:00:00', '2024-01-01 01:00:00', '2024-01-01 02:00:00']),
+        'DATE': pd.to_datetime(['2024-01-01', '2024-01-01', '2024-01-01']),
+        'timestamp': pd.to_datetime(['2024-01-01 00:00:00', pd.NaT, '2024-01-01 02:00:00']),
+        'ENMO_30plus': [0.1, 1 / 3, np.nan],
+        'Pwear': [1.0, 0.5, 0.0],
+        'hourofday': [0, 1, 2],
+        'valid': [True, np.nan, False],
+        'FLAG_MECH_NOISE': [0, 0, 1],
+    }, index=[5, 3, 9])
+
+
+@pytest.mark.parametrize('compact', ['No', 'Yes'])
+def test_reading_back_is_the_same_as_a_csv_round_trip(part_proc_df, tmp_path, compact):
+    config = {'compact_dtypes': compact}
+    path = tmp_path / 'A_part_proc.csv'
+    part_proc_df.to_csv(path, index=False)
+    pd.testing.assert_frame_equal(schemas.reading_back(config, part_proc_df, 'part_proc'), schemas.reading_csv(config, str(path), 'part_proc'))
+
+
+
+def test_long_integer_ids_are_kept_as_text(tmp_path):
+    path = tmp_path / 'metadata.csv'
+    path.write_text("file_id,subject_code,frequency\n12345678901234567890,0042,100\n")
+    df = schemas.reading_csv({}, str(path), 'metadata', text=['file_id', 'subject_code'])
+    assert df['file_id'].tolist() == ['12345678901234567890']
+    assert df['subject_code'].tolist() == ['0042']
+    assert df['frequency'].tolist() == [100]
+
+
+def test_long_integers_are_read_exactly(tmp_path):
+    path = tmp_path / 'metadata.csv'
+    path.write_text("file_id,frequency\n12345678901234567890,100\n")
+    df = schemas.reading_csv({}, str(path), 'metadata')
+    assert df['file_id'].tolist() == [12345678901234567890]
+
+
+def test_columns_not_used_by_the_stage_are_not_read(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_text("timestamp,ENMO_mean,HPFVM_mean,pitch_mean\n2024-01-01 00:00:00,1.5,2.5,3.5\n")
+    df = schemas.reading_csv({'variables_to_drop': ['HPFVM']}, str(path), 'data', stage='generic_exh_postprocessing')
+    assert list(df.columns) == ['timestamp', 'ENMO_mean', 'pitch_mean']
+    # Dates and times are kept as text, for the stages to parse with their own formats
+    assert df['timestamp'].tolist() == ['2024-01-01 00:00:00']
+
+
+def test_compact_dtypes(tmp_path):
+    path = tmp_path / 'summary.csv'
+    path.write_text("file_id,device,ENMO_30plus,Pwear\nA,ax3,0.1,1.5\n")
+    df = schemas.reading_csv({'compact_dtypes': 'Yes'}, str(path), 'summary')
+    assert str(df['ENMO_30plus'].dtype) == 'float32'
+    assert str(df['device'].dtype) == 'category'
+    assert str(df['Pwear'].dtype) == 'float64'
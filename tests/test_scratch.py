@@ -0,0 +1,51 @@
+import os
+import pytest
+from wavepostprocessing import scratch, checkpoint
+
+
+@pytest.fixture
+def config(tmp_path):
+    results = tmp_path / 'results'
+    results.mkdir()
+    for file_id in ['A', 'B']:
+        (results / f"metadata_{file_id}.csv").write_text(f"id\n{file_id}\n")
+        (results / f"1h_{file_id}.csv").write_text("ENMO\n1.5\n")
+    (tmp_path / 'scratch').mkdir()
+    return {'root_folder': str(tmp_path), 'results_folder': 'results', 'log_folder': 'logs', 'count_prefixes': '1h',
+            'use_local_scratch': 'Yes', 'local_scratch_folder': str(tmp_path / 'scratch')}
+
+
+def test_inputs_are_read_and_outputs_written_on_scratch(config, tmp_path):
+    scratch.starting_staging(config, 'generic_exh_postprocessing', 1, ['A', 'B'])
+    try:
+        data_path = str(tmp_path / 'results' / '1h_A.csv')
+        local = scratch.input_path(data_path)
+        assert local.startswith(str(tmp_path / 'scratch')) and open(local).read() == "ENMO\n1.5\n"
+
+        output = str(tmp_path / 'results' / 'summary' / 'A_part_proc.csv')
+        with open(scratch.output_path(output), 'w') as file:
+            file.write('file_id\nA\n')
+        assert not os.path.exists(output)
+        scratch.finishing_file(config, 'generic_exh_postprocessing', 1, 'A')
+
+        # A failed file ID leaves nothing behind
+        failed = str(tmp_path / 'results' / 'summary' / 'B_part_proc.csv')
+        with open(scratch.output_path(failed), 'w') as file:
+            file.write('file_id\nB\n')
+        scratch.discarding_file()
+    finally:
+        scratch.finishing_staging()
+
+    assert open(output).read() == 'file_id\nA\n'
+    assert not os.path.exists(failed)
+    assert checkpoint.completed_files(config, 'generic_exh_postprocessing') == {'A'}
+    assert os.listdir(tmp_path / 'scratch') == []
+
+
+def test_paths_are_unchanged_without_staging(config, tmp_path):
+    config['use_work_queue'] = 'Yes'
+    scratch.starting_staging(config, 'generic_exh_postprocessing', 1, ['A'])
+    path = str(tmp_path / 'results' / '1h_A.csv')
+    assert scratch.input_path(path) == path and scratch.output_path(path) == path
+    scratch.finishing_file(config, 'generic_exh_postprocessing', 1, 'A')
+    assert checkpoint.completed_files(config, 'generic_exh_postprocessing') == {'A'}
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+import pytest
+from wavepostprocessing import startup_benchmark
+
+
+@pytest.mark.parametrize('module', ['wavepostprocessing.cli', 'wavepostprocessing.multi_project'])
+def test_submission_does_not_import_pandas(module):
+    result = subprocess.run([sys.executable, '-c', f"import sys, {module}; print(sorted({{'pandas', 'numpy', 'pyarrow'}} & set(sys.modules)))"],
+                            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.stdout.strip() == '[]'
+
+
+def test_import_time_of_a_module():
+    assert startup_benchmark.import_time('json', repeats=1) >= 0
+    assert startup_benchmark.import_time('wavepostprocessing.no_such_module', repeats=1) is None
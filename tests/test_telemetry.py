@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+from wavepostprocessing import telemetry
+
+# timed reads the config from the module the step is defined in
+config = None
+
+
+@telemetry.timed
+def processing_step(files_list, df):
+    return df.head(2)
+
+
+@pytest.fixture
+def telemetry_config(tmp_path, monkeypatch):
+    monkeypatch.delenv('SLURM_ARRAY_JOB_ID', raising=False)
+    monkeypatch.delenv('SLURM_JOB_ID', raising=False)
+    monkeypatch.setitem(globals(), 'config', {'root_folder': str(tmp_path), 'log_folder': 'logs', 'record_telemetry': 'Yes'})
+    return config
+
+
+def test_spans_are_written_and_summarised(telemetry_config, capsys):
+    df = pd.DataFrame({'file_id': ['A'] * 3, 'ENMO_mean': [1.0, 2.0, 3.0]})
+    processing_step(['A'], df)
+    processing_step(['B'], df)
+    spans = telemetry.reading_spans(telemetry_config)
+    assert [(span['stage'], span['function'], span['file_id'], span['rows']) for span in spans] == \
+           [('test_telemetry', 'processing_step', 'A', 2), ('test_telemetry', 'processing_step', 'B', 2)]
+
+    report = telemetry.profile_report(telemetry_config)
+    assert report['functions'][('test_telemetry', 'processing_step')]['calls'] == 2
+    assert sorted(file_id for file_id, _ in report['slowest_files']) == ['A', 'B']
+    assert 'processing_step' in capsys.readouterr().out
+
+
+def test_nothing_is_written_unless_switched_on(telemetry_config):
+    telemetry_config['record_telemetry'] = 'No'
+    processing_step(['A'], pd.DataFrame({'file_id': ['A']}))
+    assert telemetry.reading_spans(telemetry_config) == []
+    assert telemetry.profile_report(telemetry_config) == {'functions': {}, 'slowest_files': []}
+
+
+def test_file_id_is_taken_from_the_dataframe_for_cohort_steps():
+    df = pd.DataFrame({'file_id': ['C', 'C']})
+    assert telemetry.describing_call([df, 'all'], None) == ('C', 2)
+    assert telemetry.describing_call([], None) == (None, None)
@@ -0,0 +1,64 @@
+import os
+import pytest
+import wavepostprocessing.watch as watch
+from wavepostprocessing.quarantine import reading_quarantine
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    monkeypatch.delenv('SLURM_ARRAY_JOB_ID', raising=False)
+    monkeypatch.delenv('SLURM_ARRAY_TASK_ID', raising=False)
+    return {'root_folder': str(tmp_path), 'results_folder': 'results', 'log_folder': 'logs', 'summary_folder': 'summary',
+            'individual_sum_f': 'sum', 'individual_daily_f': 'daily', 'sum_overall_means': 'summary_means', 'day_overall_mean': 'daily_means',
+            'sum_output_file': 'all_summary', 'day_output_file': 'all_daily', 'run_append_summary_files': 'Yes', 'run_append_daily_files': 'Yes'}
+
+
+def writing_output(config, output_file):
+    path = os.path.join(config['root_folder'], 'results', 'summary', f"{output_file}.csv")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write('file_id\nA\n')
+
+
+def test_outputs_appended_only_when_every_output_exists(config):
+    assert not watch.outputs_appended(config)
+    writing_output(config, 'all_summary')
+    assert not watch.outputs_appended(config)
+    writing_output(config, 'all_daily')
+    assert watch.outputs_appended(config)
+
+
+def test_missing_outputs_are_appended_in_full(config, monkeypatch):
+    runs = []
+    appended = []
+
+    def run_one(directory, file_id, patch=True):
+        if file_id == 'B':
+            raise ValueError(f"cannot process {file_id}")
+        runs.append((file_id, patch))
+
+    monkeypatch.setattr(watch, 'run_one', run_one)
+    monkeypatch.setattr(watch.appending, 'appending_outputs', lambda: appended.append(True))
+    assert watch.appending_in_full('directory', config, ['A', 'B', 'C']) == ['A', 'C']
+    # The rows are not patched one by one, all individual files are appended once
+    assert runs == [('A', False), ('C', False)]
+    assert appended == [True]
+    assert [record['file_id'] for record in reading_quarantine(config)] == ['B']
+
+
+def test_ids_are_quarantined_when_the_full_append_fails(config, monkeypatch):
+    def failing_append():
+        raise ValueError("cannot append")
+
+    monkeypatch.setattr(watch, 'run_one', lambda directory, file_id, patch=True: None)
+    monkeypatch.setattr(watch.appending, 'appending_outputs', failing_append)
+    assert watch.appending_in_full('directory', config, ['A', 'C']) == []
+    assert sorted(record['file_id'] for record in reading_quarantine(config)) == ['A', 'C']
+
+
+def test_signature_only_holds_the_files_of_the_id():
+    states = {'data_12.csv': (10, 1.0), 'metadata_12.csv': (5, 1.0), 'data_112.csv': (10, 2.0), 'metadata_112.csv': (5, 2.0),
+              'analysis_meta_12.csv': (3, 1.0), 'qcmeta_112.csv': (3, 2.0)}
+    signatures = watch.id_signatures(states)
+    assert [name for name, _ in signatures['12']] == ['analysis_meta_12.csv', 'data_12.csv', 'metadata_12.csv']
+    assert [name for name, _ in signatures['112']] == ['data_112.csv', 'metadata_112.csv', 'qcmeta_112.csv']
@@ -0,0 +1,85 @@
+import os
+import pytest
+from wavepostprocessing import work_queue
+from wavepostprocessing.checkpoint import mark_completed
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    monkeypatch.setenv('SLURM_ARRAY_JOB_ID', '1234')
+    monkeypatch.delenv('WAVEPP_FILELIST_PREFIX', raising=False)
+    config = {'root_folder': str(tmp_path), 'results_folder': 'results', 'filelist_folder': 'filelists', 'log_folder': 'logs'}
+    filelist_folder = tmp_path / 'results' / 'filelists'
+    filelist_folder.mkdir(parents=True)
+    rows = ''.join(f"{file_id}\t{file_id}.csv\n" for file_id in ['A', 'B', 'C', 'B', 'D'])
+    (filelist_folder / 'filelist.txt').write_text(f"filename_temp\tfilename\n{rows}")
+    return config
+
+
+def test_reading_queue_keeps_first_occurrence(config):
+    assert work_queue.reading_queue(config) == ['A', 'B', 'C', 'D']
+
+
+def test_each_id_is_claimed_once(config, monkeypatch):
+    first = work_queue.claim_files(config, 'collapse_summary', 1)
+    second = work_queue.claim_files(config, 'collapse_summary', 2)
+    claimed = {1: [], 2: []}
+    # Interleaving the two tasks
+    for task_id, tasks_queue in [(1, first), (2, second), (1, first), (2, second)]:
+        claimed[task_id].append(next(tasks_queue))
+    # The first task waits for the ID the second is processing, which then moves on
+    monkeypatch.setattr(work_queue.time, 'sleep', lambda seconds: claimed[2].extend(second))
+    claimed[1].extend(first)
+    claimed[2].extend(second)
+    assert sorted(claimed[1] + claimed[2]) == ['A', 'B', 'C', 'D']
+    assert not set(claimed[1]) & set(claimed[2])
+
+
+def test_claims_of_a_dead_task_are_taken_over(config):
+    dead = work_queue.claim_files(config, 'collapse_summary', 1)
+    assert next(dead) == 'A'
+    assert next(dead) == 'B'
+    # The task died while processing B, and its heartbeat is now older than the lease
+    folder = os.path.join(work_queue.claims_folder(config), 'collapse_summary_1234')
+    owner = work_queue.owner_name(1)
+    old = os.path.getmtime(work_queue.heartbeat_path(folder, owner)) - 2 * work_queue.CLAIM_LEASE_SECONDS
+    os.utime(work_queue.heartbeat_path(folder, owner), (old, old))
+
+    assert list(work_queue.claim_files(config, 'collapse_summary', 2)) == ['C', 'D', 'B']
+    # Once taken over, the claim is not taken over again
+    assert list(work_queue.claim_files(config, 'collapse_summary', 3)) == []
+
+
+def test_waits_for_a_dead_task_whose_lease_has_not_expired(config, monkeypatch):
+    dead = work_queue.claim_files(config, 'collapse_summary', 1)
+    assert next(dead) == 'A'
+    # The task dies while processing A, the others drain the queue before its lease expires
+    folder = os.path.join(work_queue.claims_folder(config), 'collapse_summary_1234')
+    heartbeat = work_queue.heartbeat_path(folder, work_queue.owner_name(1))
+    waits = []
+
+    def lease_expiring(seconds):
+        waits.append(seconds)
+        os.utime(heartbeat, (0, 0))
+
+    monkeypatch.setattr(work_queue.time, 'sleep', lease_expiring)
+    assert list(work_queue.claim_files(config, 'collapse_summary', 2)) == ['B', 'C', 'D', 'A']
+    assert waits == [work_queue.CLAIM_POLL_SECONDS]
+
+
+def test_claims_of_a_running_task_or_finished_ids_are_kept(config, monkeypatch):
+    running = work_queue.claim_files(config, 'collapse_summary', 1)
+    assert next(running) == 'A'
+    # The running task moves on from A while the other task waits for it
+    monkeypatch.setattr(work_queue.time, 'sleep', lambda seconds: next(running, None))
+    assert list(work_queue.claim_files(config, 'collapse_summary', 2)) == ['B', 'C', 'D']
+
+
+def test_ids_finished_by_a_dead_task_are_not_taken_over(config):
+    dead = work_queue.claim_files(config, 'collapse_summary', 1)
+    assert next(dead) == 'A'
+    # The task journalled A and died before moving on from it
+    folder = os.path.join(work_queue.claims_folder(config), 'collapse_summary_1234')
+    mark_completed(config, 'collapse_summary', 1, 'A')
+    os.utime(work_queue.heartbeat_path(folder, work_queue.owner_name(1)), (0, 0))
+    assert list(work_queue.claim_files(config, 'collapse_summary', 2)) == ['B', 'C', 'D']
@@ -0,0 +1,39 @@
+import os
+import time
+import pytest
+from wavepostprocessing import worker
+
+
+@pytest.fixture
+def config(tmp_path):
+    config = {'root_folder': str(tmp_path), 'log_folder': 'logs'}
+    worker.setting_up_queue(config)
+    return config
+
+
+def claimed_batch(config, name, owner, age):
+    path = os.path.join(worker.queue_folder(config, 'working'), f"{name}@{owner}")
+    with open(path, 'w') as file:
+        file.write('A\n')
+    touched = time.time() - age
+    os.utime(path, (touched, touched))
+    return path
+
+
+def test_expired_batch_of_a_worker_on_another_node_is_returned(config):
+    claimed_batch(config, 'expired.txt', 'othernode_123', worker.BATCH_LEASE_SECONDS + 1)
+    claimed_batch(config, 'leased.txt', 'othernode_124', 0)
+    assert worker.releasing_stale_batches(config) == 1
+    assert os.listdir(worker.queue_folder(config, 'incoming')) == ['expired.txt']
+    assert os.listdir(worker.queue_folder(config, 'working')) == ['leased.txt@othernode_124']
+
+
+def test_claimed_batch_starts_a_new_lease(config):
+    worker.enqueue_files(config, ['A', 'B'])
+    name = os.listdir(worker.queue_folder(config, 'incoming'))[0]
+    old = time.time() - worker.BATCH_LEASE_SECONDS - 1
+    os.utime(os.path.join(worker.queue_folder(config, 'incoming'), name), (old, old))
+    batch_path = worker.claiming_batch(config)
+    # A batch that waited in the queue for longer than the lease is not taken back from the worker that just claimed it
+    assert worker.releasing_stale_batches(config) == 0
+    assert os.path.exists(batch_path)
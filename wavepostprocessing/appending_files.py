@@ -10,9 +10,16 @@ import os
 import pandas as pd
 import numpy as np
 from wavepostprocessing.config import load_config, print_message
+from wavepostprocessing.telemetry import timed
+from wavepostprocessing.io_formats import reading_table, existing_path, table_columns, FORMATS
+from wavepostprocessing.schemas import THRESHOLD_COLUMN
+from wavepostprocessing import hourly_dataset
 #from config import load_config, print_message
 import sys
 
+# Rows written to the output file at a time by streaming_append
+STREAMING_BATCH_ROWS = 100000
+
 ############################################################################################################
 # PART A: This do file will append together all individual Summary files as well as join the files which have not produced an individual summary file
 ############################################################################################################
@@ -48,11 +55,14 @@ def remove_files(output_file):
     filelist_df = filelist_df[~filelist_df['file_name'].str.contains(data_dictionary, case=False, na=False)]
     filelist_df = filelist_df[~filelist_df['file_name'].str.contains(output_file, case=False, na=False)]
 
-    # Creating list with all filenames
+    # Creating list with all filenames, including trimmed files written as parquet, feather or npy (see intermediate_format)
     files_list = filelist_df['file_name'].tolist()
+    other_formats = tuple(extension for extension in FORMATS.values() if extension != FORMATS['csv'])
+    files_list += sorted(name for name in os.listdir('.') if name.endswith(other_formats))
     return files_list
 
 # Appending summary files
+@timed
 def appending_files(files_list, file_path, append_level):
     dataframes = []
 
@@ -62,7 +72,7 @@ def appending_files(files_list, file_path, append_level):
             full_file_path = os.path.join(file_path, f"{file_name}")
 
             if os.path.exists(full_file_path):
-                dataframe = pd.read_csv(full_file_path)
+                dataframe = reading_table(full_file_path, config, append_level)
                 dataframes.append(dataframe)
 
     if dataframes:
@@ -78,20 +88,23 @@ def appending_files(files_list, file_path, append_level):
 
     # REMOVING THRESHOLDS FROM THE MAIN OUTPUT FILE IF THIS IS SPECIFIED IN CONFIG FILE
     if config.get('remove_thresholds').lower() == 'yes':
-        variable_prefixes = 'enmo_'
-        if not any(item.lower() == "hpfvm" for item in config.get('variables_to_drop')):
-            variable_prefixes += 'HPFVM_'
-        variable_suffix = 'plus'
-
-        columns_to_drop = []
-        for variable_prefix in variable_prefixes:
-            for column_name in appended_df.columns:
-                if column_name.startswith(variable_prefix) and column_name.endswith(variable_suffix):
-                    columns_to_drop.append(column_name)
-
-        appended_df = appended_df.drop(columns=columns_to_drop)
+        appended_df = appended_df.drop(columns=threshold_columns(appended_df.columns))
     return appended_df
 
+# Threshold columns removed from the main output file when remove_thresholds is set in the config file
+def threshold_columns(columns):
+    variable_prefixes = 'enmo_'
+    if not any(item.lower() == "hpfvm" for item in config.get('variables_to_drop')):
+        variable_prefixes += 'HPFVM_'
+    variable_suffix = 'plus'
+
+    columns_to_drop = []
+    for variable_prefix in variable_prefixes:
+        for column_name in columns:
+            if column_name.startswith(variable_prefix) and column_name.endswith(variable_suffix):
+                columns_to_drop.append(column_name)
+    return columns_to_drop
+
 # Creating filelist of any IDS that have not had an analysis file produced from post processing
 def no_analysis_filelist():
     no_analysis_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder'), 'No_Analysis_Files.txt')
@@ -107,6 +120,50 @@ def no_analysis_filelist():
         return []
 
 
+# Reading the metadata of an ID that has not had an analysis file produced, keeping the variables that go into the appended dataset
+def reading_no_analysis_metadata(file_id):
+    metadata_file_path = os.path.join(config.get('root_folder'), config.get('results_folder'), f"metadata_{file_id}.csv")
+    if not os.path.exists(metadata_file_path):
+        return None
+    no_analysis_metadata_df = pd.read_csv(metadata_file_path)
+
+    # Specifying what variables to keep
+    variables_to_keep = [
+    #    '.*start_error*.', '.*end_error*.', 'calibration_method', 'noise_cutoff_mg',
+    #    'generic_first_timestamp', 'generic_last_timestamp', 'device', 'processing_epoch'
+
+        '.*start_error*.', '.*end_error*.', '^calibration_method$', '^noise_cutoff_mg$',
+        '^generic_first_timestamp$', '^generic_last_timestamp$', '^device$', '^processing_epoch$', '^frequency$'
+    ]
+    # Variables to keep if processed through Wave
+    if config.get('processing').lower() == 'wave':
+        variables_to_keep.extend(['.*anom*.', '.*batt*.'])
+    # Variables to keep if processed through Pampro
+    if config.get('processing').lower() == 'pampro':
+        #variables_to_keep.extend(['calibration_type', 'QC_axis_anomaly'])
+        variables_to_keep.extend(['^calibration_type$', '^QC_axis_anomaly$'])
+    # Joining the variables to be able to use regular expression
+    combined_variables = '|'.join(variables_to_keep)
+    no_analysis_metadata_df = no_analysis_metadata_df.filter(regex=combined_variables)
+    no_analysis_metadata_df['id'] = file_id
+
+    # Renaming variables
+    no_analysis_metadata_df = no_analysis_metadata_df.rename(columns={'end_error': 'file_end_error', 'start_error': 'file_start_error', 'noise_cutoff_mg': 'noise_cutoff'})
+    variables_to_lower_case = [col for col in no_analysis_metadata_df.columns if col.startswith('QC_') and col != 'QC_axis_anomaly']
+    lower_case_mapping = {col: col.lower() for col in variables_to_lower_case}
+    no_analysis_metadata_df = no_analysis_metadata_df.rename(columns=lower_case_mapping)
+
+    # Dropping variables:
+    if config.get('processing').lower() == 'wave':
+        no_analysis_metadata_df.drop(columns=['first_battery', 'last_battery'], inplace=True)
+
+    # Formatting time stamp variables:
+    generic_timestamps = ['generic_first_timestamp', 'generic_last_timestamp']
+    no_analysis_metadata_df[generic_timestamps] = no_analysis_metadata_df[generic_timestamps].apply(lambda x: x.str[:19])
+
+    return no_analysis_metadata_df
+
+
 # Appending any IDS that have not had an analysis file produced from post processing and outputting the dataset
 def appending_no_analysis_files(no_analysis_files, appended_df, file_name):
     no_analysis_dataframes = []
@@ -121,44 +178,8 @@ def appending_no_analysis_files(no_analysis_files, appended_df, file_name):
 
     for file_id in no_analysis_files: #??? what if there is more than one ?
 
-        metadata_file_path = os.path.join(config.get('root_folder'), config.get('results_folder'), f"metadata_{file_id}.csv")
-        if os.path.exists(metadata_file_path):
-            no_analysis_metadata_df = pd.read_csv(metadata_file_path)
-
-            # Specifying what variables to keep
-            variables_to_keep = [
-            #    '.*start_error*.', '.*end_error*.', 'calibration_method', 'noise_cutoff_mg',
-            #    'generic_first_timestamp', 'generic_last_timestamp', 'device', 'processing_epoch'
-
-                '.*start_error*.', '.*end_error*.', '^calibration_method$', '^noise_cutoff_mg$',
-                '^generic_first_timestamp$', '^generic_last_timestamp$', '^device$', '^processing_epoch$', '^frequency$'
-            ]
-            # Variables to keep if processed through Wave
-            if config.get('processing').lower() == 'wave':
-                variables_to_keep.extend(['.*anom*.', '.*batt*.'])
-            # Variables to keep if processed through Pampro
-            if config.get('processing').lower() == 'pampro':
-                #variables_to_keep.extend(['calibration_type', 'QC_axis_anomaly'])
-                variables_to_keep.extend(['^calibration_type$', '^QC_axis_anomaly$'])
-            # Joining the variables to be able to use regular expression
-            combined_variables = '|'.join(variables_to_keep)
-            no_analysis_metadata_df = no_analysis_metadata_df.filter(regex=combined_variables)
-            no_analysis_metadata_df['id'] = file_id
-
-            # Renaming variables
-            no_analysis_metadata_df = no_analysis_metadata_df.rename(columns={'end_error': 'file_end_error', 'start_error': 'file_start_error', 'noise_cutoff_mg': 'noise_cutoff'})
-            variables_to_lower_case = [col for col in no_analysis_metadata_df.columns if col.startswith('QC_') and col != 'QC_axis_anomaly']
-            lower_case_mapping = {col: col.lower() for col in variables_to_lower_case}
-            no_analysis_metadata_df = no_analysis_metadata_df.rename(columns=lower_case_mapping)
-
-            # Dropping variables:
-            if config.get('processing').lower() == 'wave':
-                no_analysis_metadata_df.drop(columns=['first_battery', 'last_battery'], inplace=True)
-
-            # Formatting time stamp variables:
-            generic_timestamps = ['generic_first_timestamp', 'generic_last_timestamp']
-            no_analysis_metadata_df[generic_timestamps] = no_analysis_metadata_df[generic_timestamps].apply(lambda x: x.str[:19])
-
+        no_analysis_metadata_df = reading_no_analysis_metadata(file_id)
+        if no_analysis_metadata_df is not None:
             no_analysis_dataframes.append(no_analysis_metadata_df)
 
         # Appending dataframes if there are any
@@ -185,30 +206,236 @@ def appending_no_analysis_files(no_analysis_files, appended_df, file_name):
     merged_df.to_csv(file_name, index=False)
 
 
+# Appending the individual files to the output file one batch at a time, instead of holding all of them in memory, if
+# streaming_append is set in the config file. The columns of the output file are worked out from the headers first,
+# in the order pd.concat would give them, so every batch is written with the same columns.
+# The dtype of every column is also worked out first, from all the files, as pd.concat of all of them would give it
+# (e.g. float if a column has whole numbers in some files and missing values or decimals in others, or is missing from
+# some files), and every batch is written with these dtypes, so the output does not depend on where the batches start
+# and end. This reads the files twice, but only one batch is held in memory at a time.
+@timed
+def streaming_append(files_list, file_path, append_level, file_name):
+    files_list = [name for name in files_list if os.path.exists(os.path.join(file_path, name))]
+    no_analysis_files = no_analysis_filelist()
+    no_analysis_dataframes = [df for df in (reading_no_analysis_metadata(file_id) for file_id in no_analysis_files) if df is not None]
+
+    # Columns of the output file
+    headers = [table_columns(os.path.join(file_path, name)) for name in files_list]
+    columns = list(dict.fromkeys(column for header in headers for column in header))
+    if append_level == 'hourly':
+        # appending_files sets the id of the hourly rows from their file_id
+        headers = [header + ['id'] for header in headers]
+        if 'id' not in columns:
+            columns.append('id')
+    if config.get('remove_thresholds').lower() == 'yes':
+        dropped = set(threshold_columns(columns))
+        columns = [column for column in columns if column not in dropped]
+    for no_analysis_df in no_analysis_dataframes:
+        headers.append(list(no_analysis_df.columns))
+        columns.extend(column for column in no_analysis_df.columns if column not in columns)
+
+    # Columns missing from some of the files, which pd.concat turns into floats
+    column_counts = {}
+    for header in headers:
+        for column in set(header):
+            column_counts[column] = column_counts.get(column, 0) + 1
+    float_columns = {column for column in columns if column_counts[column] < len(headers) or THRESHOLD_COLUMN.match(column)}
+
+    # Dtypes of the columns over all the files, keeping one row of each file so that only the dtypes are combined
+    common_df = None
+    for name in files_list:
+        common_df = combining_dtypes(common_df, appending_files.__wrapped__([name], file_path=file_path, append_level=append_level))
+    for no_analysis_df in no_analysis_dataframes:
+        common_df = combining_dtypes(common_df, no_analysis_df)
+    dtypes = {} if common_df is None else {column: dtype for column, dtype in common_df.dtypes.items() if column in columns}
 
-if __name__ == '__main__':
+    output_file_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'))
+    os.makedirs(output_file_path, exist_ok=True)
+    file_name = os.path.join(output_file_path, f"{file_name}.csv")
+    temp_file_path = f"{file_name}.tmp"
+    pd.DataFrame(columns=columns).to_csv(temp_file_path, index=False)
+
+    # Appending the files in batches of about STREAMING_BATCH_ROWS rows, then the IDs without an analysis file
+    batch = []
+    batch_rows = 0
+    for name in files_list:
+        # Without the timing decorator, streaming_append is timed as a whole rather than once per file
+        df = appending_files.__wrapped__([name], file_path=file_path, append_level=append_level)
+        batch.append(df)
+        batch_rows += len(df)
+        if batch_rows >= STREAMING_BATCH_ROWS:
+            writing_batch(batch, columns, dtypes, float_columns, temp_file_path, no_analysis_files)
+            batch = []
+            batch_rows = 0
+    writing_batch(batch + no_analysis_dataframes, columns, dtypes, float_columns, temp_file_path, no_analysis_files)
+
+    os.replace(temp_file_path, file_name)
+
+
+def combining_dtypes(common_df, df):
+    '''
+    :return: One row with the dtypes pd.concat gives the columns of common_df and df (files without rows do not change them)
+    '''
+    if df.empty:
+        return common_df
+    if common_df is None:
+        return df.head(1)
+    return pd.concat([common_df, df.head(1)], ignore_index=True).tail(1)
+
+
+def writing_batch(dataframes, columns, dtypes, float_columns, temp_file_path, no_analysis_files):
+    if not dataframes:
+        return
+    batch_df = pd.concat(dataframes, ignore_index=True).reindex(columns=columns)
+    for column, dtype in dtypes.items():
+        if batch_df[column].dtype != dtype:
+            batch_df[column] = batch_df[column].astype(dtype)
+    for column in float_columns:
+        if pd.api.types.is_integer_dtype(batch_df[column]):
+            batch_df[column] = batch_df[column].astype('float64')
+    # As in appending_no_analysis_files
+    if no_analysis_files and 'valid' in batch_df.columns:
+        batch_df['valid'] = batch_df['valid'].replace('', np.nan)
+        batch_df['valid'] = batch_df['valid'].astype('bool', errors='ignore')
+    batch_df.to_csv(temp_file_path, mode='a', header=False, index=False)
+
+
+# Checking if an appended output file has been written, so the rows of one file ID can be replaced in it
+def output_exists(output_file, append_level):
+    if append_level == 'hourly' and hourly_dataset.use_dataset(config):
+        return os.path.exists(hourly_dataset.metadata_path(config))
+    return os.path.exists(os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'), f"{output_file}.csv"))
+
+
+# Replacing the rows of one file ID in an appended output file, instead of appending all individual files again
+def patching_output(file_id, folder, individual_file_name, output_file, append_level):
+    '''
+    :param file_id: The file ID that has been processed again
+    :param folder: Folder of the individual files (e.g. config['individual_sum_f'])
+    :param individual_file_name: Name of the individual file of this file ID in that folder
+    :param output_file: Name of the appended output file (e.g. config['sum_output_file'])
+    :param append_level: summary, daily or hourly
+    :return: Number of rows removed and number of rows added
+    '''
+    if append_level == 'hourly' and hourly_dataset.use_dataset(config):
+        return patching_dataset(file_id, folder, individual_file_name)
+
+    output_file_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'), f"{output_file}.csv")
+    if not os.path.exists(output_file_path):
+        raise FileNotFoundError(f"{output_file_path} does not exist yet, the individual files have to be appended first.")
+    # Read as text, so the rows of the other file IDs are written back exactly as they were
+    output_df = pd.read_csv(output_file_path, dtype=str, keep_default_na=False)
+
+    # Rows with analysis data have a file_id, rows appended from the No_Analysis_Files list only have an id
+    matching_rows = pd.Series(False, index=output_df.index)
+    if 'file_id' in output_df.columns:
+        matching_rows |= output_df['file_id'] == str(file_id)
+        if 'id' in output_df.columns:
+            matching_rows |= (output_df['file_id'] == '') & (output_df['id'] == str(file_id))
+    output_df = output_df[~matching_rows]
+
+    individual_file_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'), folder, config.get('time_res_folder'))
+    # The trimmed file may have been written as parquet, feather or npy
+    individual_file = existing_path(os.path.join(individual_file_path, individual_file_name))
+    if individual_file is not None:
+        new_df = appending_files([os.path.basename(individual_file)], file_path=individual_file_path, append_level=append_level)
+    elif file_id in no_analysis_filelist():
+        new_df = reading_no_analysis_metadata(file_id)
+    else:
+        new_df = None
+
+    if new_df is not None and not new_df.empty:
+        if 'valid' in new_df.columns:
+            new_df['valid'] = new_df['valid'].replace('', np.nan)
+            new_df['valid'] = new_df['valid'].astype('bool', errors='ignore')
+        output_df = pd.concat([output_df, new_df], ignore_index=True)
+
+    # Writing next to the output file first, so the output file is never left half written
+    temp_file_path = f"{output_file_path}.tmp"
+    output_df.to_csv(temp_file_path, index=False)
+    os.replace(temp_file_path, output_file_path)
+    return int(matching_rows.sum()), 0 if new_df is None else len(new_df)
+
+
+# Appending the individual hourly/minute level files as partitions of a Parquet dataset (see hourly_dataset.py)
+def appending_dataset(files_list, file_path):
+    written = 0
+    unchanged = 0
+    wanted = set()
+    for file_name in files_list:
+        file_id = hourly_dataset.file_id_of(file_name)
+        source_path = os.path.join(file_path, file_name)
+        wanted.add(hourly_dataset.partition_name(file_id))
+        # Only the partitions whose trimmed file has changed are written again
+        if hourly_dataset.partition_up_to_date(config, source_path, file_id):
+            unchanged += 1
+            continue
+        written_from = hourly_dataset.source_state(config, source_path)
+        hourly_dataset.writing_partition(config, appending_files([file_name], file_path=file_path, append_level='hourly'), hourly_dataset.partition_name(file_id), written_from)
+        written += 1
+
+    # Removing the partitions of file IDs whose trimmed file is gone
+    removed = 0
+    for name in hourly_dataset.partition_names(config):
+        if name not in wanted and name != hourly_dataset.NO_ANALYSIS_PARTITION:
+            removed += hourly_dataset.removing_partition(config, name)
+
+    writing_no_analysis_partition()
+    hourly_dataset.updating_metadata(config)
+    print(f"{hourly_dataset.dataset_path(config)}: {written} partitions written, {unchanged} unchanged, {removed} removed")
+
+
+def writing_no_analysis_partition():
+    no_analysis_dataframes = [df for df in (reading_no_analysis_metadata(file_id) for file_id in no_analysis_filelist()) if df is not None]
+    if no_analysis_dataframes:
+        hourly_dataset.writing_partition(config, pd.concat(no_analysis_dataframes, ignore_index=True), hourly_dataset.NO_ANALYSIS_PARTITION)
+    else:
+        hourly_dataset.removing_partition(config, hourly_dataset.NO_ANALYSIS_PARTITION)
+
+
+# Replacing the partition of one file ID in the hourly/minute level dataset
+def patching_dataset(file_id, folder, individual_file_name):
+    if not os.path.exists(hourly_dataset.metadata_path(config)):
+        raise FileNotFoundError(f"{hourly_dataset.dataset_path(config)} does not exist yet, the individual files have to be appended first.")
+    name = hourly_dataset.partition_name(file_id)
+    removed = hourly_dataset.partition_rows(config, name)
+
+    individual_file_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'), folder, config.get('time_res_folder'))
+    individual_file = existing_path(os.path.join(individual_file_path, individual_file_name))
+    added = 0
+    if individual_file is not None:
+        new_df = appending_files([os.path.basename(individual_file)], file_path=individual_file_path, append_level='hourly')
+        hourly_dataset.writing_partition(config, new_df, name, hourly_dataset.source_state(config, individual_file))
+        added = len(new_df)
+    else:
+        hourly_dataset.removing_partition(config, name)
+    if file_id in no_analysis_filelist():
+        writing_no_analysis_partition()
+        added += 1
 
-    if len(sys.argv) < 2:
-        print("Error: No config file provided.")
-        sys.exit(1)
+    hourly_dataset.updating_metadata(config)
+    return removed, added
 
-    config_path = sys.argv[1]
-    config = load_config(config_path)
 
-    print("Loaded config:", config)
-    # Now you can use config values inside your script
-    
+# Appending the individual files of every level switched on in the config file (or only of the given level)
+def appending_outputs(level=None):
+    # Appending one batch of files at a time, so the memory used does not grow with the number of files
+    streaming = config.get('streaming_append', 'No').lower() == 'yes'
+
     # Appending summary files
-    if config.get('run_append_summary_files').lower() == 'yes':
+    if config.get('run_append_summary_files').lower() == 'yes' and level in (None, 'summary'):
         print_message("APPENDING ALL INDIVIDUAL SUMMARY FILES TOGETHER")
         summary_file_path = create_filelist(folder=config.get('individual_sum_f'))
         summary_files_list = remove_files(output_file=config.get('sum_output_file'))
-        summary_appended_df = appending_files(summary_files_list, file_path=summary_file_path, append_level='summary')
-        no_analysis_files = no_analysis_filelist()
-        appending_no_analysis_files(no_analysis_files, summary_appended_df, file_name=config.get('sum_output_file'))
+        if streaming:
+            streaming_append(summary_files_list, file_path=summary_file_path, append_level='summary', file_name=config.get('sum_output_file'))
+        else:
+            summary_appended_df = appending_files(summary_files_list, file_path=summary_file_path, append_level='summary')
+            no_analysis_files = no_analysis_filelist()
+            appending_no_analysis_files(no_analysis_files, summary_appended_df, file_name=config.get('sum_output_file'))
 
     # Appending hourly trimmed files
-    if config.get('run_append_hourly_files').lower() == 'yes' or config.get('run_append_minute_level_files').lower() == 'yes':
+    if (config.get('run_append_hourly_files').lower() == 'yes' or config.get('run_append_minute_level_files').lower() == 'yes') and level in (None, 'hourly'):
         if config.get('count_prefixes').lower() == '1h':
            print_message("APPENDING ALL INDIVIDUAL HOURLY FILES TOGETHER")
         if config.get('count_prefixes').lower() == '1m':
@@ -216,15 +443,39 @@ if __name__ == '__main__':
 
         hourly_file_path = create_filelist(folder=config.get('individual_trimmed_f'))
         hourly_files_list = remove_files(output_file=config.get('hour_output_file'))
-        hourly_appended_df = appending_files(hourly_files_list, file_path=hourly_file_path, append_level='hourly')
-        no_analysis_files = no_analysis_filelist()
-        appending_no_analysis_files(no_analysis_files, hourly_appended_df, file_name=config.get('hour_output_file'))
+        if hourly_dataset.use_dataset(config):
+            appending_dataset(hourly_files_list, file_path=hourly_file_path)
+        elif streaming:
+            streaming_append(hourly_files_list, file_path=hourly_file_path, append_level='hourly', file_name=config.get('hour_output_file'))
+        else:
+            hourly_appended_df = appending_files(hourly_files_list, file_path=hourly_file_path, append_level='hourly')
+            no_analysis_files = no_analysis_filelist()
+            appending_no_analysis_files(no_analysis_files, hourly_appended_df, file_name=config.get('hour_output_file'))
 
     # Appending daily files
-    if config.get('run_append_daily_files').lower() == 'yes':
+    if config.get('run_append_daily_files').lower() == 'yes' and level in (None, 'daily'):
         print_message("APPENDING ALL INDIVIDUAL DAILY FILES TOGETHER")
         daily_file_path = create_filelist(folder=config.get('individual_daily_f'))
         daily_files_list = remove_files(output_file=config.get('day_output_file'))
-        daily_appended_df = appending_files(daily_files_list, file_path=daily_file_path, append_level='daily')
-        no_analysis_files = no_analysis_filelist()
-        appending_no_analysis_files(no_analysis_files, daily_appended_df, file_name=config.get('day_output_file'))
+        if streaming:
+            streaming_append(daily_files_list, file_path=daily_file_path, append_level='daily', file_name=config.get('day_output_file'))
+        else:
+            daily_appended_df = appending_files(daily_files_list, file_path=daily_file_path, append_level='daily')
+            no_analysis_files = no_analysis_filelist()
+            appending_no_analysis_files(no_analysis_files, daily_appended_df, file_name=config.get('day_output_file'))
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print("Error: No config file provided.")
+        sys.exit(1)
+
+    config_path = sys.argv[1]
+    config = load_config(config_path)
+
+    print("Loaded config:", config)
+    # Now you can use config values inside your script
+    
+    # When submitted as one branch of the stage graph, only the level given in WAVEPP_LEVEL is appended
+    appending_outputs(os.environ.get('WAVEPP_LEVEL'))
@@ -1,21 +1,41 @@
 import subprocess
 import os
+import sys
+import runpy
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from wavepostprocessing.job_sizing import job_resources
 
-def submit_jobs(script_name, config_path, arrsize=10, num_cpu=1, jid=None, budgacc="BRAGE-SL3-CPU"):
+def submit_jobs(script_name, config_path, arrsize=10, num_cpu=1, jid=None, budgacc="BRAGE-SL3-CPU", executor="slurm", workers=None, config=None, time=None, mem=None, dependency="afterany", environment=None, array_indices=None, file_ids=None):
     """
     Submits a batch job to the HPC system.
     :param script_name: The script name (e.g., "collapse_results.py")
     :param arrsize: Number of array jobs
     :param num_cpu: Number of CPUs per task
-    :param jid: Job dependency (if any)
+    :param jid: Job dependency (if any), a job id or a list of job ids
     :param budgacc: Budget account for SLURM
     :param config_path: Path to config file
+    :param executor: "slurm" submits the job with sbatch, "local" runs the array tasks in a process pool on this machine
+    :param workers: Number of worker processes used by the local executor (defaults to the number of CPUs)
+    :param config: The loaded config. If given, wall time and memory are estimated from the input data of each task
+    :param time: Wall time per task (HH:MM:SS), overrides the estimate
+    :param mem: Memory per task (e.g. 8G), overrides the estimate
+    :param dependency: Type of dependency on jid. "afterany" waits for the whole job, "afterok" only starts if jid succeeded, "aftercorr" lets task i start as soon as task i of jid has succeeded
+    :param environment: Extra environment variables for the job (e.g. {"WAVEPP_LEVEL": "summary"})
+    :param array_indices: Only submit these array task ids (e.g. [2, 5] to rerun two chunks), defaults to 1 to arrsize
+    :param file_ids: File IDs planned for the submission, used to estimate the data of each task
     """
 
+    if executor == "local":
+        return run_local_jobs(script_name, config_path, arrsize=arrsize, workers=workers, environment=environment)
+
+    if isinstance(jid, (list, tuple)):
+        jid = ":".join(str(job) for job in jid)
+
     venv_path = os.environ.get('VIRTUAL_ENV')
-    activate_path = os.path.join(venv_path, "bin", "activate")
     if not venv_path:
        raise RuntimeError("No virtual environment detected. Please activate one before running.")
+    activate_path = os.path.join(venv_path, "bin", "activate")
 
     # Get the absolute path to the script inside 'scripts/' directory
     #script_path = os.path.join(os.path.dirname(__file__), "scripts", script_name)
@@ -29,11 +49,22 @@ def submit_jobs(script_name, config_path, arrsize=10, num_cpu=1, jid=None, budga
     #    raise FileNotFoundError(f"Error: The script {script_path} does not exist.")
 
     #cmdargs = [f"--account={budgacc}", f"--array=1-{arrsize}", f"--cpus-per-task={num_cpu}", "--time=00:20:00"]
-    cmdargs = [f"--account={budgacc}", f"--array=1-{arrsize}", f"--cpus-per-task={num_cpu}", "--time=00:40:00"]
+    if config is not None:
+        # The retry filelists when resubmitting quarantined files
+        filelist_prefix = (environment or {}).get('WAVEPP_FILELIST_PREFIX', 'filelist')
+        time, mem = job_resources(script_name, config, arrsize, time=time, mem=mem, filelist_prefix=filelist_prefix, file_ids=file_ids)
+    array_spec = ",".join(str(index) for index in array_indices) if array_indices else f"1-{arrsize}"
+    cmdargs = [f"--account={budgacc}", f"--array={array_spec}", f"--cpus-per-task={num_cpu}", f"--time={time or '00:40:00'}"] + ([f"--mem={mem}"] if mem else [])
 
 
     #sbatch_command = ["sbatch"] + cmdargs + (["--depend=afterany:" + jid] if jid else []) + ["submit_wavejobs.sh", script_path, config_path]
-    sbatch_command = ["sbatch"] + cmdargs + (["--depend=afterany:" + jid] if jid else []) + [script_submit, script_path, config_path, activate_path]
+    if environment:
+        cmdargs.append("--export=" + ",".join(["ALL"] + [f"{key}={value}" for key, value in environment.items()]))
+    if jid and dependency == "aftercorr":
+        # Tasks whose corresponding task failed are cancelled, so jobs depending on this one are not held forever
+        cmdargs.append("--kill-on-invalid-dep=yes")
+
+    sbatch_command = ["sbatch"] + cmdargs + ([f"--depend={dependency}:{jid}"] if jid else []) + [script_submit, script_path, config_path, activate_path]
 
     try:
         output = subprocess.check_output(sbatch_command).decode().strip()
@@ -44,6 +75,69 @@ def submit_jobs(script_name, config_path, arrsize=10, num_cpu=1, jid=None, budga
         print(f"Error submitting job: {e}")
         return None
 
+def run_array_task(script_name, config_path, task_id, arrsize, job_id="interactive", environment=None):
+    """
+    Runs one element of an array job in the current process, the same way submit_wavejobs.sh does on a compute node.
+    :param script_name: The module name (e.g., "wavepostprocessing.collapse_results")
+    :param config_path: Path to config file
+    :param task_id: Array task id (1-based, as SLURM_ARRAY_TASK_ID)
+    :param arrsize: Number of array jobs
+    :param job_id: Id shared by all tasks of the array job (as SLURM_ARRAY_JOB_ID)
+    :param environment: Extra environment variables for the task
+    :return: task_id, a flag indicating if the task succeeded and an error message
+    """
+    # The environment is restored afterwards, as a worker process may run tasks of other stages next
+    saved_environment = dict(os.environ)
+    os.environ.update(environment or {})
+    os.environ['SLURM_ARRAY_JOB_ID'] = str(job_id)
+    os.environ['SLURM_ARRAY_TASK_ID'] = str(task_id)
+    os.environ['SLURM_ARRAY_TASK_COUNT'] = str(arrsize)
+    sys.argv = [script_name, config_path, str(task_id), str(arrsize)]
+    try:
+        runpy.run_module(script_name, run_name='__main__', alter_sys=True)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            return task_id, False, f"exited with status {e.code}"
+    except Exception as e:
+        return task_id, False, repr(e)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environment)
+    return task_id, True, ""
+
+def run_local_jobs(script_name, config_path, arrsize=10, workers=None, environment=None):
+    """
+    Runs all elements of an array job in a local process pool and waits for them to finish.
+    As every stage waits for the previous one, the dependency chain between stages is kept.
+    :param script_name: The module name (e.g., "wavepostprocessing.collapse_results")
+    :param config_path: Path to config file
+    :param arrsize: Number of array jobs
+    :param workers: Number of worker processes (defaults to the number of CPUs)
+    :param environment: Extra environment variables for the tasks
+    :return: A local job id, or None if any of the tasks failed
+    """
+    # The stage scripts change directory, so the config path has to be absolute
+    config_path = os.path.abspath(config_path)
+    workers = max(1, min(workers or os.cpu_count() or 1, arrsize))
+    job_id = f"local-{script_name.split('.')[-1]}-{int(time.time())}"
+
+    failed_tasks = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_array_task, script_name, config_path, task_id, arrsize, job_id, environment): task_id for task_id in range(1, arrsize + 1)}
+        for future in as_completed(futures):
+            try:
+                task_id, succeeded, error = future.result()
+            except Exception as e:
+                task_id, succeeded, error = futures[future], False, repr(e)
+            if not succeeded:
+                print(f"Task {task_id} of {script_name} failed: {error}")
+                failed_tasks.append(task_id)
+
+    print(f"Local job {job_id} finished: {arrsize - len(failed_tasks)} of {arrsize} tasks succeeded")
+    if failed_tasks:
+        return None
+    return job_id
+
 def run_script(script):
     # Get the absolute path to the script inside 'scripts/' directory
     script_path = os.path.join(os.path.dirname(__file__), "scripts", script)
@@ -0,0 +1,70 @@
+############################################################################################################
+# This file keeps a progress journal for the per-file stages, so that an array task that is requeued or resubmitted
+# (e.g. after hitting its time limit) only processes the files it had not finished yet.
+# Each task appends the ID of every file it has finished to <log_folder>/progress/<stage>_task<i>.txt. A file ID is
+# written with a single append followed by fsync, so a task that is killed part way leaves at most an incomplete last
+# line, which is ignored and dropped by the next append. The journals are cleared when new filelists are generated and
+# when the pipeline is submitted without --resume.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import glob
+import shutil
+
+
+# --- PATH TO THE PROGRESS FOLDER AND TO THE JOURNAL OF ONE TASK --- #
+def progress_folder(config):
+    return os.path.join(config.get('root_folder'), config.get('log_folder'), 'progress')
+
+
+def journal_path(config, stage, task_id):
+    return os.path.join(progress_folder(config), f"{stage}_task{task_id if task_id is not None else 'interactive'}.txt")
+
+
+# --- READING THE FILE IDS ALREADY FINISHED BY A STAGE --- #
+def completed_files(config, stage):
+    '''
+    Reads the journals of all tasks of a stage. With the work queue, a file may have been finished by any task.
+    :param config: The loaded config
+    :param stage: Stage name (e.g. 'generic_exh_postprocessing', 'collapse_summary')
+    :return: Set of finished file IDs
+    '''
+    completed = set()
+    for path in glob.glob(os.path.join(progress_folder(config), f"{stage}_task*.txt")):
+        with open(path, 'r') as file:
+            # Only complete lines count, a line without newline was being written when the task was killed
+            completed.update(line[:-1] for line in file if line.endswith('\n'))
+    return completed
+
+
+# --- SKIPPING FILE IDS THAT ARE ALREADY FINISHED --- #
+def remaining(config, stage, files_list):
+    '''
+    Generator yielding the file IDs from files_list (a list or the work queue) that the stage has not finished yet.
+    '''
+    completed = completed_files(config, stage)
+    for file_id in files_list:
+        if file_id in completed:
+            print(f"{file_id} was already finished by an earlier run of this task, skipping.")
+            continue
+        yield file_id
+
+
+# --- RECORDING A FINISHED FILE ID --- #
+def mark_completed(config, stage, task_id, file_id):
+    os.makedirs(progress_folder(config), exist_ok=True)
+    fd = os.open(journal_path(config, stage, task_id), os.O_RDWR | os.O_CREAT | os.O_APPEND)
+    try:
+        # Dropping the last line if its write was cut off, ending it with a newline would record a file that is not finished
+        size = os.fstat(fd).st_size
+        if size > 0 and os.pread(fd, 1, size - 1) != b'\n':
+            os.ftruncate(fd, os.pread(fd, size, 0).rfind(b'\n') + 1)
+        os.write(fd, f"{file_id}\n".encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# --- REMOVING THE JOURNALS OF PREVIOUS RUNS --- #
+def clear_progress(config):
+    shutil.rmtree(progress_folder(config), ignore_errors=True)
@@ -1,8 +1,14 @@
 import os
+import sys
+import asyncio
 import argparse
 from colorama import Fore
 from wavepostprocessing.config import load_config, print_message
 from wavepostprocessing.batch_processing import submit_jobs, run_script
+from wavepostprocessing.planning import plan_pipeline
+from wavepostprocessing.pipeline import STAGES, submit_pipeline
+from wavepostprocessing.quarantine import RETRY_PREFIX, writing_retry_filelists, quarantine_files, archiving_quarantine
+from wavepostprocessing.checkpoint import clear_progress
 #from config import load_config, print_message
 #from batch_processing import submit_jobs, run_script
 #import sys
@@ -10,62 +16,214 @@ from wavepostprocessing.batch_processing import submit_jobs, run_script
 def print_message(message):
     print(Fore.GREEN + message + Fore.RESET)
 
-def main():
+# Submitting the pipeline for the config in the given directory (the default when no command is given)
+def submit_command(argv):
     parser = argparse.ArgumentParser(description="WaveProcessing CLI")
     parser.add_argument("directory", nargs="?", default=".", help="This is a required positional argument to locate the directory containing config.yaml")
     parser.add_argument('--budget', default=None, help='Optional argument, defaults to None')
-    args = parser.parse_args()
+    parser.add_argument('--executor', default='slurm', choices=['slurm', 'local'], help='Run the stages through sbatch (slurm) or in a process pool on this machine (local), defaults to slurm')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes for the local executor, defaults to the number of CPUs')
+    parser.add_argument('--time', default=None, help='Wall time per array task (HH:MM:SS) for all stages, defaults to an estimate from the input data')
+    parser.add_argument('--mem', default=None, help='Memory per array task (e.g. 8G) for all stages, defaults to an estimate from the input data')
+    parser.add_argument('--pipeline-chunks', action='store_true', help='Let chunk i of collapse_results start as soon as chunk i of the exhaustive postprocessing has finished (aftercorr), instead of waiting for all chunks')
+    parser.add_argument('--resume', action='store_true', help='Keep the progress journals of the previous submission, so the per-file stages skip the files they already finished')
+    parser.add_argument('--controller', action='store_true', help='Keep running and submit each stage (and each chunk) as soon as its inputs are ready, resubmitting failed array tasks, instead of submitting everything up front')
+    parser.add_argument('--poll-interval', type=int, default=30, help='Seconds between two polls of the job states with --controller, defaults to 30')
+    parser.add_argument('--max-retries', type=int, default=2, help='Number of times a failed array task is submitted again with --controller, defaults to 2')
+    args = parser.parse_args(argv)
 
     config = load_config(args.directory)
     print(config)
     #print(config['run_pampro_merge_metafiles'])
     #sys.exit(1)
-    jid = None
 
     if args.budget is None: 
        mybudgacc='BRAGE-SL3-CPU'
     else:
        mybudgacc=args.budget
 
-    if config.get("processing").lower() == "pampro":
-        if config.get("run_pampro_merge_metafiles").lower() == 'yes':
-            print_message("Merging Metafiles")
-            jid = submit_jobs("wavepostprocessing.pampro_merge_metafiles", args.directory, arrsize=1,num_cpu=1, jid=jid, budgacc=mybudgacc)
-        if config.get("run_pampro_collate_anomalies").lower()  == 'yes':
-            print_message("Collating Anomalies")
-            jid = submit_jobs("wavepostprocessing.pampro_collate_anomalies", args.directory,  arrsize=1,num_cpu=1, jid=jid, budgacc=mybudgacc)
-
-    if config.get("run_filelist_generation").lower()  == 'yes':
-        print_message("Creating Filelist")
-        jid = submit_jobs("wavepostprocessing.filelist_generation", args.directory,  arrsize=1,num_cpu=1, jid=jid, budgacc=mybudgacc)
-
-    if config.get("run_generic_exh_postprocessing").lower()  == 'yes':
-        print_message("Running Generic Exhaustive Postprocessing")
-        #jid = submit_jobs("generic_exh_postprocessing.py", args.directory, arrsize=10,num_cpu=1, jid=jid, budgacc=mybudgacc)
-        jid = submit_jobs("wavepostprocessing.generic_exh_postprocessing", args.directory, arrsize=config['num_filelist'],num_cpu=1, jid=jid, budgacc=mybudgacc)
-
-    if config.get("run_collapse_results_to_summary").lower() == 'yes' or config.get("run_collapse_results_to_daily").lower() == 'yes':
-        print_message("Collapsing Results")
-        #jid = submit_jobs("collapse_results.py", args.directory, arrsize=10,num_cpu=1, jid=jid, budgacc=mybudgacc)
-        jid = submit_jobs("wavepostprocessing.collapse_results", args.directory, arrsize=config['num_filelist'],num_cpu=1, jid=jid, budgacc=mybudgacc)
-
-    if config.get("run_append_summary_files").lower() == 'yes' or config.get("run_append_daily_files").lower() == 'yes' or config.get("run_append_hourly_files").lower() == 'yes':
-        print_message("Appending Files")
-        #jid = submit_jobs("appending_files.py", args.directory, arrsize=1,num_cpu=1, jid=jid, budgacc=mybudgacc)
-        jid = submit_jobs("wavepostprocessing.appending_files", args.directory, arrsize=1,num_cpu=1, jid=jid, budgacc=mybudgacc)
-
-    if config.get("run_verification_checks").lower() == 'yes':
-        print_message("Running Verification Checks")
-        #jid = submit_jobs("verification_checks.py", args.directory, arrsize=1,num_cpu=1, jid=jid, budgacc=mybudgacc)
-        jid = submit_jobs("wavepostprocessing.verification_checks", args.directory, arrsize=1,num_cpu=1, jid=jid, budgacc=mybudgacc)
-
-    if config.get("run_prepare_summary_release").lower() == 'yes' or config.get("run_prepare_daily_release").lower() == 'yes' or config.get("run_prepare_hourly_release").lower() == 'yes' or  config.get("run_prepare_minute_level_release").lower() == 'yes':
-        print_message("Preparing Release Files")
-        #jid = submit_jobs("prepare_releases.py", args.directory,  arrsize=1,num_cpu=1, jid=jid, budgacc=mybudgacc)
-        jid = submit_jobs("wavepostprocessing.prepare_releases", args.directory,  arrsize=1,num_cpu=3, jid=jid, budgacc=mybudgacc)
+    # Starting the per-file stages from scratch, unless resuming a submission that did not finish
+    if not args.resume:
+        clear_progress(config)
+
+    # Working out which files are to be processed, how many array tasks the per-file stages need and which stages have any work
+    plan = plan_pipeline(config)
+    if plan['file_ids'] is not None:
+        print_message(f"{len(plan['file_ids'])} files to process in {plan['num_filelist']} chunks.")
+    if plan['skipped']:
+        print_message(f"Not submitting stages without work: {', '.join(plan['skipped'])}")
+    if not plan['stages']:
+        print_message(Fore.BLUE + "Nothing to submit.")
+        return
+
+    if args.controller:
+        from wavepostprocessing.controller import SlurmBackend, LocalBackend, run_controller
+        if args.executor == 'local':
+            backend = LocalBackend(args.directory, workers=args.workers)
+        else:
+            backend = SlurmBackend(args.directory, budgacc=mybudgacc, time=args.time, mem=args.mem, file_ids=plan['file_ids'])
+        progress = asyncio.run(run_controller(config, plan, backend, poll_interval=args.poll_interval, max_retries=args.max_retries))
+        if not all(counts['succeeded'] for counts in progress.values()):
+            print(Fore.RED + "WaveProcessing finished with failed array tasks." + Fore.RESET)
+            sys.exit(1)
+        print_message(Fore.BLUE + "WaveProcessing completed all stages successfully.")
+        return
+
+    # Submitting all stages with work; independent stages run in parallel after their common upstream stage
+    submit_pipeline(config, args.directory, plan['num_filelist'], pipeline_chunks=args.pipeline_chunks, stages=plan['stages'], budgacc=mybudgacc,
+                    executor=args.executor, workers=args.workers, time=args.time, mem=args.mem, file_ids=plan['file_ids'])
 
     print_message(Fore.BLUE + "WaveProcessing completed the job submission successfully.")
 
+# Reporting how long each stage module takes to import, i.e. the start up cost of every array task
+def benchmark_startup_command(argv):
+    parser = argparse.ArgumentParser(prog="wavepostprocessing.cli benchmark-startup", description="Time the import of each stage module in a fresh interpreter")
+    parser.add_argument('--repeats', type=int, default=5, help='Number of fresh interpreters to time per module, defaults to 5')
+    args = parser.parse_args(argv)
+
+    from wavepostprocessing.startup_benchmark import benchmark_startup
+    benchmark_startup(args.repeats)
+
+# Summarising the timing spans written by the stages
+def profile_command(argv):
+    parser = argparse.ArgumentParser(prog="wavepostprocessing.cli profile", description="Show where the processing time went, per stage and per file")
+    parser.add_argument("directory", nargs="?", default=".", help="Directory containing config.json")
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest files to list, defaults to 10')
+    args = parser.parse_args(argv)
+
+    from wavepostprocessing.telemetry import profile_report
+    profile_report(load_config(args.directory), top=args.top)
+
+# Submitting the quarantined files again, as a small array job, followed by the stages that consolidate the results
+def resubmit_command(argv):
+    parser = argparse.ArgumentParser(prog="wavepostprocessing.cli resubmit", description="Process the files in the quarantine list again")
+    parser.add_argument("directory", nargs="?", default=".", help="Directory containing config.json")
+    parser.add_argument('--budget', default='BRAGE-SL3-CPU', help='Budget account, defaults to BRAGE-SL3-CPU')
+    parser.add_argument('--executor', default='slurm', choices=['slurm', 'local'], help='Run the stages through sbatch (slurm) or in a process pool on this machine (local), defaults to slurm')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes for the local executor, defaults to the number of CPUs')
+    parser.add_argument('--max-tasks', type=int, default=10, help='Largest number of array tasks to spread the files over, defaults to 10')
+    parser.add_argument('--time', default=None, help='Wall time per array task (HH:MM:SS) for all stages, defaults to an estimate from the input data')
+    parser.add_argument('--mem', default=None, help='Memory per array task (e.g. 8G) for all stages, defaults to an estimate from the input data')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.directory)
+    resubmitted = quarantine_files(config)
+    num_tasks = writing_retry_filelists(config, max_tasks=args.max_tasks)
+    if num_tasks == 0:
+        print_message("No quarantined files to resubmit.")
+        return
+
+    # Everything after filelist generation, with the per-file stages reading the retry filelists
+    stages = [stage['name'] for stage in STAGES if stage['name'] not in ('merge_metafiles', 'collate_anomalies', 'filelist_generation')]
+    submitted = submit_pipeline(config, args.directory, num_tasks, stages=stages, environment={'WAVEPP_FILELIST_PREFIX': RETRY_PREFIX},
+                                budgacc=args.budget, executor=args.executor, workers=args.workers, time=args.time, mem=args.mem)
+    if not submitted or None in submitted.values():
+        # The quarantine list is kept, so the files can be resubmitted again
+        print(Fore.RED + "The resubmission failed, the quarantine list has been kept." + Fore.RESET)
+        sys.exit(1)
+    archiving_quarantine(config, resubmitted)
+    print_message(Fore.BLUE + f"Resubmitted the quarantined files as {num_tasks} array tasks.")
+
+# Running a long-lived worker that processes the batches of file IDs put in the worker queue
+def worker_command(argv):
+    parser = argparse.ArgumentParser(prog="wavepostprocessing.cli worker", description="Process batches of file IDs from the worker queue, keeping the modules imported and the config loaded")
+    parser.add_argument("directory", nargs="?", default=".", help="Directory containing config.json")
+    parser.add_argument('--poll-interval', type=float, default=2, help='Seconds between two looks at an empty queue, defaults to 2')
+    parser.add_argument('--idle-timeout', type=float, default=600, help='Stop after this many seconds without a batch (0 to run until stopped), defaults to 600')
+    args = parser.parse_args(argv)
+
+    from wavepostprocessing.worker import run_worker
+    batches = run_worker(args.directory, poll_interval=args.poll_interval, idle_timeout=args.idle_timeout)
+    print_message(Fore.BLUE + f"Worker finished after {batches} batches.")
+
+# Adding file IDs to the worker queue
+def enqueue_command(argv):
+    parser = argparse.ArgumentParser(prog="wavepostprocessing.cli enqueue", description="Add file IDs to the queue of the workers")
+    parser.add_argument("directory", help="Directory containing config.json")
+    parser.add_argument("file_ids", nargs="*", help="File IDs to process")
+    parser.add_argument('--from-filelist', action='store_true', help='Add all file IDs in the filelist written by filelist generation')
+    parser.add_argument('--batch-size', type=int, default=20, help='Number of file IDs per batch, defaults to 20')
+    parser.add_argument('--stop', action='store_true', help='Tell the workers to stop once the queue is empty')
+    args = parser.parse_args(argv)
+
+    from wavepostprocessing.worker import enqueue_files, stopping_workers
+    from wavepostprocessing.work_queue import reading_queue
+    config = load_config(args.directory)
+    file_ids = list(args.file_ids) + (reading_queue(config) if args.from_filelist else [])
+    if file_ids:
+        batches = enqueue_files(config, file_ids, batch_size=args.batch_size)
+        print_message(f"Added {len(file_ids)} file IDs to the worker queue in {batches} batches.")
+    if args.stop:
+        stopping_workers(config)
+        print_message("The workers will stop once the queue is empty.")
+
+# Processing one file ID again in this process and replacing its rows in the appended output files
+def run_one_command(argv):
+    parser = argparse.ArgumentParser(prog="wavepostprocessing.cli run-one", description="Process one file ID again without submitting any jobs")
+    parser.add_argument("directory", help="Directory containing config.json")
+    parser.add_argument("file_id", help="The file ID to process")
+    args = parser.parse_args(argv)
+
+    from wavepostprocessing.run_one import run_one
+    run_one(args.directory, args.file_id)
+
+# Submitting several projects together, sharing one array job per stage
+def multi_command(argv):
+    parser = argparse.ArgumentParser(prog="wavepostprocessing.cli multi", description="Plan several projects together and submit their tasks in shared array jobs")
+    parser.add_argument("directories", nargs="+", help="Directories containing the config.json of each project")
+    parser.add_argument('--budget', default='BRAGE-SL3-CPU', help='Budget account, defaults to BRAGE-SL3-CPU')
+    parser.add_argument('--executor', default='slurm', choices=['slurm', 'local'], help='Run the stages through sbatch (slurm) or in a process pool on this machine (local), defaults to slurm')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes for the local executor, defaults to the number of CPUs')
+    parser.add_argument('--time', default=None, help='Wall time per array task (HH:MM:SS) for all stages, defaults to the largest estimate over the projects')
+    parser.add_argument('--mem', default=None, help='Memory per array task (e.g. 8G) for all stages, defaults to the largest estimate over the projects')
+    parser.add_argument('--mapping-folder', default=None, help='Folder for the files mapping the shared array tasks to the projects, defaults to wavepp_multi/<date_time>')
+    parser.add_argument('--resume', action='store_true', help='Keep the progress journals of the previous submission of each project')
+    args = parser.parse_args(argv)
+
+    from wavepostprocessing.multi_project import submit_projects
+    if not args.resume:
+        for directory in args.directories:
+            clear_progress(load_config(directory))
+    submitted = submit_projects(args.directories, mapping_folder=args.mapping_folder, time=args.time, mem=args.mem,
+                                budgacc=args.budget, executor=args.executor, workers=args.workers)
+    if not submitted:
+        print_message(Fore.BLUE + "Nothing to submit.")
+        return
+    print_message(Fore.BLUE + f"WaveProcessing submitted {len(submitted)} shared stages for {len(args.directories)} projects.")
+
+# Watching the results folder and processing new file IDs as they arrive
+def watch_command(argv):
+    parser = argparse.ArgumentParser(prog="wavepostprocessing.cli watch", description="Process new files in the results folder as they arrive, through to the appended output files")
+    parser.add_argument("directory", nargs="?", default=".", help="Directory containing config.json")
+    parser.add_argument('--poll-interval', type=float, default=60, help='Seconds between two looks at the results folder, defaults to 60')
+    parser.add_argument('--settle-seconds', type=float, default=60, help='Seconds the files of a file ID must be unchanged before it is processed, defaults to 60')
+    parser.add_argument('--process-existing', action='store_true', help='On the first start, also process the file IDs already in the results folder')
+    parser.add_argument('--once', action='store_true', help='Look at the results folder once and stop')
+    args = parser.parse_args(argv)
+
+    from wavepostprocessing.watch import watch
+    processed = watch(args.directory, poll_interval=args.poll_interval, settle_seconds=args.settle_seconds,
+                      process_existing=args.process_existing, once=args.once)
+    print_message(Fore.BLUE + f"Watch processed {processed} new file IDs.")
+
+# Commands given as the first argument. Anything else is taken as the config directory, as before.
+COMMANDS = {
+    'benchmark-startup': benchmark_startup_command,
+    'profile': profile_command,
+    'resubmit': resubmit_command,
+    'worker': worker_command,
+    'enqueue': enqueue_command,
+    'run-one': run_one_command,
+    'multi': multi_command,
+    'watch': watch_command,
+}
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+    else:
+        submit_command(sys.argv[1:])
+
 if __name__ == "__main__":
     main()
 
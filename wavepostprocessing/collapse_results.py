@@ -11,8 +11,13 @@ import pandas as pd
 #import config
 from datetime import timedelta
 import numpy as np
-import statsmodels.api as sm
 from wavepostprocessing.config import load_config, print_message
+from wavepostprocessing.work_queue import claim_files
+from wavepostprocessing import scratch
+from wavepostprocessing.scratch import input_path, output_path
+from wavepostprocessing.io_formats import reading_table, is_csv, resolving_path, writing_intermediate
+from wavepostprocessing.telemetry import timed
+from wavepostprocessing.quarantine import processing_with_quarantine, filelist_prefix
 #from config import load_config, print_message
 import sys
 
@@ -35,24 +40,44 @@ def create_folders(folder_path):
 # READING IN FILELIST
 def reading_filelist(id=''):
     os.chdir(os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder')))
+    # retry_filelist{id}.txt when resubmitting quarantined files
+    prefix = filelist_prefix()
+    if not os.path.exists(prefix + id + '.txt'):
+        # More array tasks than filelists (e.g. when num_filelist is auto): nothing to do for this task
+        print(f"No {prefix}{id}.txt found. There are no files for this task.")
+        return []
     #filelist_df = pd.read_csv('filelist.txt', delimiter='\t')  # Reading in the filelist
-    filelist_df = pd.read_csv('filelist' + id + '.txt', delimiter='\t')  # Reading in the filelist
+    filelist_df = pd.read_csv(prefix + id + '.txt', delimiter='\t')  # Reading in the filelist
     filelist_df = filelist_df.drop_duplicates(subset=['filename_temp'])
     file_list = filelist_df['filename_temp'].tolist()
     return file_list
 
 # LOOPING THROUGH EACH FILE FOR COLLAPSING
-def reading_part_proc(date_orig):
-    part_proc_file_path = os.path.join(partPro_path, f"{file_id}_{config.get('output_file_ext')}.csv")
-    if os.path.exists(part_proc_file_path):
-        df = pd.read_csv(part_proc_file_path)
-        df.sort_values(by=['file_id', 'DATETIME'], inplace=True)
-        df[date_orig] = pd.to_datetime(df[date_orig], format='%Y-%m-%d %H:%M:%S')
-        time_difference = df[date_orig].iloc[1] - df[date_orig].iloc[0]
-        time_resolution = time_difference.total_seconds() / 60
+def reading_part_proc(file_id, date_orig):
+    part_proc_file_path = input_path(resolving_path(config, os.path.join(partPro_path, f"{file_id}_{config.get('output_file_ext')}.csv")))
+    if not os.path.exists(part_proc_file_path):
+        raise FileNotFoundError(f"Part processed file for ID: {file_id} not found ({part_proc_file_path})")
+    df = reading_part_proc_file(part_proc_file_path)
+    time_resolution, df = formatting_part_proc(df, date_orig)
 
     return time_resolution, df
 
+# READING A PART PROCESSED FILE IN ANY OF THE INTERMEDIATE FORMATS
+def reading_part_proc_file(part_proc_file_path):
+    df = reading_table(part_proc_file_path, config, 'part_proc')
+    if not is_csv(part_proc_file_path):
+        # Giving the date the same form it has when read in from a csv file
+        df['DATE'] = pd.to_datetime(df['DATE']).dt.strftime('%Y-%m-%d')
+    return df
+
+# SORTING THE PART PROCESSED DATA AND WORKING OUT ITS TIME RESOLUTION
+def formatting_part_proc(df, date_orig):
+    df.sort_values(by=['file_id', 'DATETIME'], inplace=True)
+    df[date_orig] = pd.to_datetime(df[date_orig], format='%Y-%m-%d %H:%M:%S')
+    time_difference = df[date_orig].iloc[1] - df[date_orig].iloc[0]
+    time_resolution = time_difference.total_seconds() / 60
+    return time_resolution, df
+
 # REMOVING NON VALID HOURS
 def remove_data(df):
     # If a wear log is provided with date and time for wear times the days will have been flagged as either valid or not
@@ -86,7 +111,7 @@ def remove_data(df):
     return df
 
 # CREATING "DUMMY" DATASET (EMPTY) IF ALL TIMES FALL OUTSIDE WEAR LOG TIMES OR LESS THAN 1 HOUR DATA
-def creating_dummy(df, file_id, time_resolution):
+def creating_dummy(df, file_id, time_resolution, part_proc_df=None):
     row_count = len(df)
     flag_valid_total = df['temp_flag_no_valid_days'].min()
 
@@ -95,9 +120,12 @@ def creating_dummy(df, file_id, time_resolution):
             'file_id': file_id,
             'FLAG_NO_VALID_DAYS': [1]
         })
-        part_proc_file_path = os.path.join(partPro_path, f"{file_id}_{config.get('output_file_ext')}.csv")
-        if os.path.exists(part_proc_file_path):
-            part_proc_merge_df = pd.read_csv(part_proc_file_path)
+        # The part processed data is only read in again if it is not already held in memory
+        part_proc_file_path = input_path(resolving_path(config, os.path.join(partPro_path, f"{file_id}_{config.get('output_file_ext')}.csv")))
+        if part_proc_df is not None:
+            part_proc_merge_df = part_proc_df
+        elif os.path.exists(part_proc_file_path):
+            part_proc_merge_df = reading_part_proc_file(part_proc_file_path)
         new_dummy_df = pd.merge(dummy_df, part_proc_merge_df, on='file_id', how='outer', validate='1:m', indicator=True)
         columns_to_keep = ['file_id', 'FLAG_NO_VALID_DAYS', 'device', 'calibration_method', 'noise_cutoff_mg', 'processing_epoch',
                            'generic_first_timestamp', 'generic_last_timestamp', 'QC_first_battery_pct', 'QC_last_battery_pct', 'frequency']
@@ -121,7 +149,7 @@ def creating_dummy(df, file_id, time_resolution):
 
         # Outputting dummy dataset
         file_name = os.path.join(summary_files_path, f"{file_id}_{config.get('sum_overall_means')}.csv")
-        new_dummy_df.to_csv(file_name, index=False)
+        new_dummy_df.to_csv(output_path(file_name), index=False)
 
     return row_count, flag_valid_total
 
@@ -135,7 +163,7 @@ def trimmed_dataset(df, file_id, time_resolution, output_trimmed_df):
             # Outputting dataset
             os.makedirs(trimmed_path, exist_ok=True)
             file_name = os.path.join(trimmed_path, f"{file_id}_TRIMMED_{config.get('count_prefixes')}.csv")
-            df.to_csv(file_name, index=False)
+            writing_intermediate(config, df, file_name)
         else:
             pass
 
@@ -279,7 +307,7 @@ def creating_headers(file_id, collapse_level, file_path, file_name):
     # Outputting empty dataframe
     os.makedirs(summary_files_path, exist_ok=True)
     file_name = os.path.join(file_path, f"{file_id}_{file_name}.csv")
-    headers_df.to_csv(file_name, index=False)
+    headers_df.to_csv(output_path(file_name), index=False)
 
     return headers_df
 
@@ -541,7 +569,10 @@ def input_hourly_daily(df, dictionary):
 
 
 # SUMMARISING OUTPUT VARIABLES
+@timed
 def input_output_variables(df, dictionary, time_resolution, inclusion_criteria):
+    # statsmodels is slow to import, so it is only imported when the regressions are run
+    import statsmodels.api as sm
     if df is not None and not df.empty:
 
         # ENMO MEAN
@@ -603,7 +634,9 @@ def input_output_variables(df, dictionary, time_resolution, inclusion_criteria):
         return dictionary
 
 # IMPUTING SLEEP DATA
+@timed
 def impute_data(df, time_resolution, dictionary, collapse_level, inclusion_criteria):
+    import statsmodels.api as sm
     if df is not None and not df.empty:
 
         if collapse_level == 'summary':
@@ -770,7 +803,7 @@ def impute_data(df, time_resolution, dictionary, collapse_level, inclusion_crite
         return dictionary
 
 # Inputting data into headers dataframe and outputting summary_means dataset
-def output_summary_means(dictionary, headers_df):
+def output_summary_means(dictionary, headers_df, df, file_id):
     if df is not None and not df.empty:
 
         # Adding the data from the summary dictionary into the empty dataframe (using the headers)
@@ -779,11 +812,11 @@ def output_summary_means(dictionary, headers_df):
         # Outputting summary dataframe
         os.makedirs(summary_files_path, exist_ok=True)
         file_name = os.path.join(summary_files_path, f"{file_id}_{config.get('sum_overall_means')}.csv")
-        summary_data.to_csv(file_name, index=False)
+        summary_data.to_csv(output_path(file_name), index=False)
         return summary_data
 
 # Appending daily means so only one dataframe per id
-def append_daily_means(dictionary, headers_df, accumulated_dataframes):
+def append_daily_means(dictionary, headers_df, accumulated_dataframes, file_id):
 
     # Converting dictionary to a single-row dataframe
     daily_row = pd.DataFrame([dictionary], columns=headers_df.columns)
@@ -898,6 +931,87 @@ def data_dic(headers_df, collapse_level, file_path, dictionary_name):
     file_name = os.path.join(file_path, dictionary_name)
     df_labels.to_csv(file_name, index=False)
 
+# CREATING FOLDER PATHS USED BY THIS SCRIPT AND THE FOLDERS IF THEY DON'T ALREADY EXIST
+def setting_up_folders():
+    global trimmed_path, summary_files_path, partPro_path, daily_files_path
+    trimmed_path = create_path(config.get('individual_trimmed_f'))
+    summary_files_path = create_path(config.get('individual_sum_f'))
+    partPro_path = create_path(config.get('individual_partpro_f'))
+    daily_files_path = create_path(config.get('individual_daily_f'))
+
+    create_folders(trimmed_path)
+    create_folders(summary_files_path)
+    if config.get('run_collapse_results_to_daily').lower() == 'yes':
+        create_folders(daily_files_path)
+
+# TRUNCATING DATA (DEPENDING ON WHAT IS SPECIFIED IN CONFIG FILE), CREATING DUMMY DATAFRAME IF NO VALID DATA AND OUTPUTTING THE TRIMMED FILE
+def preparing_file(df, file_id, time_resolution, output_trimmed_df, part_proc_df=None):
+    global row_count, flag_valid_total
+    df = remove_data(df)
+    row_count, flag_valid_total = creating_dummy(df, file_id, time_resolution, part_proc_df)
+    df = trimmed_dataset(df, file_id, time_resolution, output_trimmed_df)
+    return df
+
+# COLLAPSING ONE FILE TO AN INDIVIDUAL SUMMARY FILE
+def collapse_to_summary(df, file_id, time_resolution):
+    global formula
+
+    # Creating empty dataframe with headers, to fill in with data later
+    summary_headers_df = creating_headers(file_id, collapse_level='summary', file_path=summary_files_path, file_name=config.get('sum_overall_means'))
+
+    # Summarizing data and inputting into dataframe
+    formula = 60 / time_resolution   # Formula used when creating data for dataframe
+    summary_dict = input_data(df, time_resolution, collapse_level='summary')
+    summary_dict = input_pwear_segment(df, summary_dict, collapse_level='summary')
+
+    if config.get('processing').lower() == 'pampro':
+        summary_dict = input_hourly_daily(df, summary_dict)
+    summary_dict = input_output_variables(df, summary_dict, time_resolution, inclusion_criteria=config.get('sum_min_hour_inclusion'))
+
+    # Impute hours
+    if config.get('impute_data').lower() == 'yes':
+        summary_dict = impute_data(df, time_resolution, summary_dict, collapse_level='summary', inclusion_criteria=config.get('sum_min_hour_inclusion'))
+
+    # Outputting summary means dataset
+    output_summary_means(summary_dict, summary_headers_df, df, file_id)
+    return summary_headers_df
+
+# COLLAPSING ONE FILE TO AN INDIVIDUAL DAILY FILE
+def collapse_to_daily(daily_df, file_id, time_resolution):
+    global formula
+
+    # Creating empty dataframe with headers, to fill in with data later
+    daily_headers_df = creating_headers(file_id, collapse_level='daily', file_path=daily_files_path, file_name=config.get('day_overall_mean'))
+
+    accumulated_dataframes = {}
+
+    # Counting how many days in file to loop through each day:
+    DAY_MAX = daily_df['day_number'].max()
+    for day_number in range(1, DAY_MAX + 1):
+        day_df = daily_df[daily_df['day_number'] == day_number].copy()
+
+        # Creating daily summarized variables
+        if not day_df.empty:
+            formula = 60 / time_resolution  # Formula used when creating data for dataframe
+            daily_summary_dict = input_data(day_df, time_resolution, collapse_level='daily')
+            daily_summary_dict = input_pwear_segment(day_df, daily_summary_dict, collapse_level='daily')
+            daily_summary_dict = input_output_variables(day_df, daily_summary_dict, time_resolution, inclusion_criteria=config.get('day_min_hour_inclusion'))
+
+            # Impute hours
+            if config.get('impute_data').lower() == 'yes':
+                daily_summary_dict = impute_data(day_df, time_resolution, daily_summary_dict, collapse_level='daily', inclusion_criteria=config.get('day_min_hour_inclusion'))
+
+            # Appendinging daily means so only one file per id
+            accumulated_dataframes = append_daily_means(daily_summary_dict, daily_headers_df, accumulated_dataframes, file_id)
+
+    # Outputting daily_means csv, one per id
+    if file_id in accumulated_dataframes and not accumulated_dataframes[file_id].empty:
+        os.makedirs(daily_files_path, exist_ok=True)
+        output_file = os.path.join(daily_files_path, f"{file_id}_{config.get('day_overall_mean')}.csv")
+        accumulated_dataframes[file_id].to_csv(output_path(output_file), index=False)
+
+    return daily_headers_df
+
 # Calling the functions
 if __name__ == '__main__':
 
@@ -911,20 +1025,19 @@ if __name__ == '__main__':
     print("Loaded config:", config)
     # Now you can use config values inside your script
    
-    # Creating folder paths user for this script
-    trimmed_path = create_path(config.get('individual_trimmed_f'))
-    summary_files_path = create_path(config.get('individual_sum_f'))
-    partPro_path = create_path(config.get('individual_partpro_f'))
-
-    # Creating folder if they don't already exist
-    create_folders(trimmed_path)
-    create_folders(summary_files_path)
+    # Creating folder paths used for this script and the folders if they don't already exist
+    setting_up_folders()
 
     # Creating filelist to loop through each file individually:
     #file_list = reading_filelist()
     task_id = os.environ.get('SLURM_ARRAY_TASK_ID')
-    file_list = reading_filelist(str(int(task_id)-1))
-    print(f"Task ID: {task_id}; file list: {file_list}")
+    use_work_queue = config.get('use_work_queue', 'No').lower() == 'yes'
+    if use_work_queue:
+        # Each collapse step pulls file IDs from its own queue until it is empty
+        print(f"Task ID: {task_id}; pulling files from the work queue")
+    else:
+        file_list = reading_filelist(str(int(task_id)-1))
+        print(f"Task ID: {task_id}; file list: {file_list}")
 
     if config.get('run_collapse_results_to_summary').lower() == 'yes':
         print_message("COLLAPSING DATA TO INDIVIDUAL SUMMARY FILES")
@@ -936,100 +1049,59 @@ if __name__ == '__main__':
         if config["count_prefixes"].lower() == '1m':
             level = 'MINUTE LEVEL'
         print_message(f"CREATING TRIMMED {level} FILES")
-        for file_id in file_list:
-            time_resolution, df = reading_part_proc(date_orig='DATETIME_ORIG')
-
-            # Truncating data (depending on what is specified in config file) and creating dataframe if no valid data:
-            df = remove_data(df)
-            row_count, flag_valid_total = creating_dummy(df, file_id, time_resolution)
-            df = trimmed_dataset(df, file_id, time_resolution, output_trimmed_df='Yes')
+        scratch.starting_staging(config, 'collapse_trimmed', task_id, [] if use_work_queue else file_list)
+        def trimming_file(file_id):
+            time_resolution, df = reading_part_proc(file_id, date_orig='DATETIME_ORIG')
+            preparing_file(df, file_id, time_resolution, output_trimmed_df='Yes')
+
+        # The outputs written so far are copied back even if the loop is stopped by an error
+        try:
+            for _ in processing_with_quarantine(config, 'collapse_trimmed', task_id, claim_files(config, 'collapse_trimmed', task_id) if use_work_queue else file_list, trimming_file):
+                pass
+        finally:
+            scratch.finishing_staging()
 
     # Collapsing results to summary level if specified in orchestra file
     if config['run_collapse_results_to_summary'].lower() == 'yes':
         print_message("COLLAPSING DATA TO INDIVIDUAL SUMMARY FILES")
 
-        for file_id in file_list:
-            time_resolution, df = reading_part_proc(date_orig='DATETIME_ORIG')
-
-            # Truncating data (depending on what is specified in config file) and creating dataframe if no valid data:
-            df = remove_data(df)
-            row_count, flag_valid_total = creating_dummy(df, file_id, time_resolution)
-            df = trimmed_dataset(df, file_id, time_resolution, output_trimmed_df='Yes')
-
-            # Creating empty dataframe with headers, to fill in with data later
-            summary_headers_df = creating_headers(file_id, collapse_level='summary', file_path=summary_files_path, file_name=config.get('sum_overall_means'))
+        summary_headers_df = None
+        scratch.starting_staging(config, 'collapse_summary', task_id, [] if use_work_queue else file_list)
+        def summarising_file(file_id):
+            time_resolution, df = reading_part_proc(file_id, date_orig='DATETIME_ORIG')
+            df = preparing_file(df, file_id, time_resolution, output_trimmed_df='Yes')
+            return collapse_to_summary(df, file_id, time_resolution)
 
-            # Summarizing data and inputting into dataframe
-            formula = 60 / time_resolution   # Formula used when creating data for dataframe
-            summary_dict = input_data(df, time_resolution, collapse_level='summary')
-            summary_dict = input_pwear_segment(df, summary_dict, collapse_level='summary')
-
-            if config.get('processing').lower() == 'pampro':
-                summary_dict = input_hourly_daily(df, summary_dict)
-            summary_dict = input_output_variables(df, summary_dict, time_resolution, inclusion_criteria=config.get('sum_min_hour_inclusion'))
-
-            # Impute hours
-            if config.get('impute_data').lower() == 'yes':
-                summary_dict = impute_data(df, time_resolution, summary_dict, collapse_level='summary', inclusion_criteria=config.get('sum_min_hour_inclusion'))
+        try:
+            for summary_headers_df in processing_with_quarantine(config, 'collapse_summary', task_id, claim_files(config, 'collapse_summary', task_id) if use_work_queue else file_list, summarising_file):
+                pass
+        finally:
+            scratch.finishing_staging()
 
-            # Outputting summary means dataset
-            summary_data = output_summary_means(summary_dict, summary_headers_df)
-
-        # Outputting data dictionary
-        data_dic(summary_headers_df, collapse_level='summary', file_path=summary_files_path, dictionary_name="Data_dictionary_summary_means.csv")
+        # Outputting data dictionary (a task pulling from the work queue may not have collapsed any files)
+        if summary_headers_df is not None:
+            data_dic(summary_headers_df, collapse_level='summary', file_path=summary_files_path, dictionary_name="Data_dictionary_summary_means.csv")
 
     # Collapsing results to daily level if specified in orchestra file
     if config.get('run_collapse_results_to_daily').lower() == 'yes':
         print_message("COLLAPSING DATA TO INDIVIDUAL DAILY FILES")
 
-        # Creating folder paths to save collapsed results daily level in
-        daily_files_path = create_path(config.get('individual_daily_f'))
-
-        # Creating folder if it doesn't already exist
-        create_folders(daily_files_path)
-
-        accumulated_dataframes = {}
+        daily_headers_df = None
 
         # Looping through each file in the filelist:
-        for file_id in file_list:
-            time_resolution, daily_df = reading_part_proc(date_orig='DATETIME_ORIG')
-
-            # Truncating data (depending on what is specified in config file) and creating dataframe if no valid data:
-            daily_df = remove_data(daily_df)
-            row_count, flag_valid_total = creating_dummy(daily_df, file_id, time_resolution)
-            daily_df = trimmed_dataset(daily_df, file_id, time_resolution, output_trimmed_df='Yes' if config.get('run_collapse_results_to_summary').lower() == 'no' else 'No')
-
-            # Creating empty dataframe with headers, to fill in with data later
-            daily_headers_df = creating_headers(file_id, collapse_level='daily', file_path=daily_files_path, file_name=config.get('day_overall_mean'))
-
-            # Counting how many days in file to loop through each day:
-            DAY_MAX = daily_df['day_number'].max()
-            for day_number in range(1, DAY_MAX + 1):
-                day_df = daily_df[daily_df['day_number'] == day_number].copy()
-
-                # Creating daily summarized variables
-                if not day_df.empty:
-                    formula = 60 / time_resolution  # Formula used when creating data for dataframe
-                    daily_summary_dict = input_data(day_df, time_resolution, collapse_level='daily')
-                    daily_summary_dict = input_pwear_segment(day_df, daily_summary_dict, collapse_level='daily')
-                    daily_summary_dict = input_output_variables(day_df, daily_summary_dict, time_resolution, inclusion_criteria=config.get('day_min_hour_inclusion'))
-
-                    # Impute hours
-                    if config.get('impute_data').lower() == 'yes':
-                        daily_summary_dict = impute_data(day_df, time_resolution, daily_summary_dict, collapse_level='daily', inclusion_criteria=config.get('day_min_hour_inclusion'))
-
-                    # Appendinging daily means so only one file per id
-                    accumulated_dataframes = append_daily_means(daily_summary_dict, daily_headers_df, accumulated_dataframes)
-
-            # Outputting daily_means csv, one per id
-            if file_id in accumulated_dataframes and not accumulated_dataframes[file_id].empty:
-                os.makedirs(daily_files_path, exist_ok=True)
-                output_file = os.path.join(daily_files_path, f"{file_id}_{config.get('day_overall_mean')}.csv")
-                accumulated_dataframes[file_id].to_csv(output_file, index=False)
-
-        # Outputting data dictionary
-        data_dic(daily_headers_df, collapse_level='daily', file_path=daily_files_path,
-                 dictionary_name="Data_dictionary_daily_means.csv")
-
-
-
+        scratch.starting_staging(config, 'collapse_daily', task_id, [] if use_work_queue else file_list)
+        def collapsing_daily_file(file_id):
+            time_resolution, daily_df = reading_part_proc(file_id, date_orig='DATETIME_ORIG')
+            daily_df = preparing_file(daily_df, file_id, time_resolution, output_trimmed_df='Yes' if config.get('run_collapse_results_to_summary').lower() == 'no' else 'No')
+            return collapse_to_daily(daily_df, file_id, time_resolution)
+
+        try:
+            for daily_headers_df in processing_with_quarantine(config, 'collapse_daily', task_id, claim_files(config, 'collapse_daily', task_id) if use_work_queue else file_list, collapsing_daily_file):
+                pass
+        finally:
+            scratch.finishing_staging()
+
+        # Outputting data dictionary (a task pulling from the work queue may not have collapsed any files)
+        if daily_headers_df is not None:
+            data_dic(daily_headers_df, collapse_level='daily', file_path=daily_files_path,
+                     dictionary_name="Data_dictionary_daily_means.csv")
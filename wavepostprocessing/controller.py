@@ -0,0 +1,300 @@
+############################################################################################################
+# This file drives the pipeline from the live state of its jobs, as an alternative to submitting the whole stage graph
+# up front with fixed --depend links (submit_pipeline). The controller keeps running until all stages have finished:
+# - a stage is submitted as soon as the stages it depends on have finished,
+# - chunk i of a per-file stage is submitted as soon as chunk i of the per-file stage before it has finished (unless the
+#   work queue is used, where chunks are not fixed),
+# - the per-file stages are sized from num_filelist.txt once filelist generation has run, instead of from an estimate,
+# - array tasks that failed are submitted again (only those tasks), up to max_retries times,
+# - a progress line is printed every time the state of a stage changes.
+# Started with: python -m wavepostprocessing.cli <directory> --controller
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import asyncio
+import itertools
+import subprocess
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from colorama import Fore
+from wavepostprocessing.config import print_message
+from wavepostprocessing.pipeline import STAGES
+from wavepostprocessing.batch_processing import submit_jobs, run_array_task
+
+# SLURM job states meaning that an array task is queued, running or has ended without success
+SLURM_ACTIVE_STATES = {'PENDING': 'pending', 'CONFIGURING': 'running', 'RUNNING': 'running', 'COMPLETING': 'running',
+                       'REQUEUED': 'pending', 'REQUEUE_HOLD': 'pending', 'RESIZING': 'running', 'SUSPENDED': 'running'}
+SLURM_FAILED_STATES = {'FAILED', 'TIMEOUT', 'OUT_OF_MEMORY', 'NODE_FAIL', 'CANCELLED', 'PREEMPTED', 'BOOT_FAIL', 'DEADLINE'}
+
+
+# --- ARRAY TASK IDS IN A SLURM JOB ID (e.g. 1234_7 or 1234_[2-5,9%4]) --- #
+def expanding_indices(elements):
+    indices = []
+    for part in elements.strip('[]').split('%')[0].split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            indices += range(int(first), int(last) + 1)
+        elif part.isdigit():
+            indices.append(int(part))
+    return indices
+
+
+# --- STATES OF THE ARRAY TASKS FROM SACCT/SQUEUE OUTPUT --- #
+def parsing_array_states(job_id, lines):
+    '''
+    :param job_id: The array job id
+    :param lines: Lines of "JobID|State" as written by sacct -P or squeue -o "%i|%T"
+    :return: Dictionary of array task id and state (pending, running, done or failed)
+    '''
+    states = {}
+    for line in lines:
+        fields = line.strip().split('|')
+        if len(fields) < 2 or not fields[0].startswith(f"{job_id}_"):
+            continue
+        # e.g. "CANCELLED by 1234"
+        slurm_state = fields[1].split()[0] if fields[1].strip() else 'PENDING'
+        if slurm_state == 'COMPLETED':
+            state = 'done'
+        elif slurm_state in SLURM_FAILED_STATES:
+            state = 'failed'
+        else:
+            state = SLURM_ACTIVE_STATES.get(slurm_state, 'running')
+        for index in expanding_indices(fields[0].split('_', 1)[1]):
+            states[index] = state
+    return states
+
+
+# --- SUBMITTING AND POLLING JOBS ON SLURM --- #
+class SlurmBackend:
+    '''
+    Submits array tasks with sbatch (through submit_jobs, without dependencies) and reads their state with sacct.
+    If sacct is not available, squeue is used instead. How a task that has left the queue ended is then not known, so it
+    is taken to have failed (and is submitted again, skipping the files it had finished).
+    '''
+    def __init__(self, directory, **submit_options):
+        self.directory = directory
+        self.submit_options = submit_options
+
+    def submit(self, stage, arrsize, indices, config, environment=None):
+        return submit_jobs(stage['module'], self.directory, arrsize=arrsize, num_cpu=stage['num_cpu'], config=config,
+                           environment=environment or None, array_indices=indices, executor="slurm", **self.submit_options)
+
+    def poll(self, job_id, indices):
+        try:
+            output = subprocess.check_output(["sacct", "-n", "-P", "-X", "-j", str(job_id), "-o", "JobID,State"], stderr=subprocess.DEVNULL)
+            states = parsing_array_states(job_id, output.decode().splitlines())
+            # Tasks only show up in sacct once they are known to the accounting database
+            return {index: states.get(index, 'pending') for index in indices}
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            output = subprocess.check_output(["squeue", "-h", "-r", "-j", str(job_id), "-o", "%i|%T"], stderr=subprocess.DEVNULL)
+            states = parsing_array_states(job_id, output.decode().splitlines())
+            for index in indices:
+                if index not in states:
+                    print(Fore.RED + f"sacct is not available, task {index} of {job_id} has left the queue without a known exit state and is taken to have failed." + Fore.RESET)
+            return {index: states.get(index, 'failed') for index in indices}
+
+    def close(self):
+        pass
+
+
+# --- RUNNING AND POLLING JOBS ON THIS MACHINE --- #
+class LocalBackend:
+    '''
+    Runs array tasks in a process pool on this machine, the same way the local executor of submit_jobs does, but without
+    waiting for them to finish. Used when no SLURM is available and for trying out the controller.
+    '''
+    def __init__(self, directory, workers=None):
+        # The stage scripts change directory, so the config path has to be absolute
+        self.directory = os.path.abspath(directory)
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.jobs = {}
+        self.job_count = itertools.count(1)
+
+    def submit(self, stage, arrsize, indices, config, environment=None):
+        job_id = f"local-{stage['name']}-{next(self.job_count)}"
+        self.jobs[job_id] = {index: self.pool.submit(run_array_task, stage['module'], self.directory, index, arrsize, job_id, environment)
+                             for index in indices}
+        return job_id
+
+    def poll(self, job_id, indices):
+        states = {}
+        for index in indices:
+            future = self.jobs[job_id][index]
+            if not future.done():
+                states[index] = 'running' if future.running() else 'pending'
+                continue
+            try:
+                _, succeeded, error = future.result()
+            except Exception as e:
+                succeeded, error = False, repr(e)
+            if not succeeded:
+                print(f"Task {index} of {job_id} failed: {error}")
+            states[index] = 'done' if succeeded else 'failed'
+        return states
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+# --- NUMBER OF FILELIST CHUNKS WRITTEN BY FILELIST GENERATION --- #
+def written_num_filelist(config, default):
+    num_filelist_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder'), 'num_filelist.txt')
+    try:
+        with open(num_filelist_path, 'r') as file:
+            return int(file.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+# --- PROGRESS OF ONE STAGE --- #
+def stage_progress(run):
+    counts = {state: 0 for state in ['waiting', 'pending', 'running', 'done', 'failed', 'cancelled']}
+    for state in run['elements'].values():
+        counts[state] += 1
+    return counts
+
+
+def stage_finished(run):
+    return run['cancelled'] or (run['arrsize'] is not None and all(state in ('done', 'failed', 'cancelled') for state in run['elements'].values()))
+
+
+def stage_succeeded(run):
+    return run['arrsize'] is not None and all(state == 'done' for state in run['elements'].values())
+
+
+def stage_failed(run):
+    return run['cancelled'] or any(state in ('failed', 'cancelled') for state in run['elements'].values())
+
+
+# --- SUBMITTING A FAILED TASK AGAIN WHILE ATTEMPTS ARE LEFT --- #
+def failing_task(run, index, max_retries, reason):
+    '''
+    :return: The new state of the task: waiting (to be submitted again) or failed once max_retries have been used
+    '''
+    if run['attempts'][index] <= max_retries:
+        print(Fore.RED + f"Task {index} of {run['stage']['name']} {reason}, submitting it again (attempt {run['attempts'][index] + 1} of {max_retries + 1})." + Fore.RESET)
+        return 'waiting'
+    return 'failed'
+
+
+# --- DRIVING THE PIPELINE --- #
+async def run_controller(config, plan, backend, poll_interval=30, max_retries=2, environment=None):
+    '''
+    Submits the stages in plan['stages'] as their inputs become ready and follows them until all have finished.
+    :param config: The loaded config
+    :param plan: The plan from plan_pipeline (stages and num_filelist are used)
+    :param backend: SlurmBackend or LocalBackend
+    :param poll_interval: Seconds between two polls of the job states
+    :param max_retries: Number of times a failed array task is submitted again
+    :param environment: Environment variables set for every job
+    :return: Dictionary with, for each stage, if it succeeded and the final state counts of its array tasks
+    '''
+    use_work_queue = config.get('use_work_queue', 'No').lower() == 'yes'
+    num_filelist = plan['num_filelist']
+
+    # Stages that are not run pass their own upstream stages on, as in submit_pipeline
+    runs = {}
+    resolved = {}
+    for stage in STAGES:
+        upstream = []
+        for name in stage['depends_on']:
+            upstream += [upstream_name for upstream_name in resolved.get(name, []) if upstream_name not in upstream]
+        if stage['name'] not in plan['stages']:
+            resolved[stage['name']] = upstream
+            continue
+        resolved[stage['name']] = [stage['name']]
+        # job_of: the job running the latest attempt of each array task
+        runs[stage['name']] = {'stage': stage, 'upstream': upstream, 'arrsize': None, 'elements': {}, 'attempts': {}, 'job_of': {}, 'cancelled': False}
+
+    last_progress = {}
+    try:
+        while not all(stage_finished(run) for run in runs.values()):
+            # Sizing the stages whose upstream stages are far enough along, and cancelling those whose upstream stage failed
+            for run in runs.values():
+                if run['arrsize'] is not None or run['cancelled']:
+                    continue
+                upstream_runs = [runs[name] for name in run['upstream']]
+                if any(stage_finished(upstream_run) and stage_failed(upstream_run) for upstream_run in upstream_runs):
+                    print(Fore.RED + f"Not running {run['stage']['name']} as an upstream stage failed." + Fore.RESET)
+                    run['cancelled'] = True
+                    continue
+                chunked_upstream = [upstream_run for upstream_run in upstream_runs if upstream_run['stage']['per_file']]
+                whole_upstream = [upstream_run for upstream_run in upstream_runs if not upstream_run['stage']['per_file']]
+                if not all(stage_succeeded(upstream_run) for upstream_run in whole_upstream) or any(upstream_run['arrsize'] is None for upstream_run in chunked_upstream):
+                    continue
+                if run['stage']['per_file']:
+                    # The filelists have been written by now, so their actual number is known
+                    if 'filelist_generation' in runs:
+                        num_filelist = written_num_filelist(config, num_filelist)
+                    run['arrsize'] = chunked_upstream[0]['arrsize'] if chunked_upstream else num_filelist
+                else:
+                    run['arrsize'] = 1
+                run['elements'] = {index: 'waiting' for index in range(1, run['arrsize'] + 1)}
+                run['attempts'] = {index: 0 for index in run['elements']}
+
+            # Submitting the array tasks whose inputs are ready
+            for run in runs.values():
+                ready = []
+                for index, state in run['elements'].items():
+                    if state != 'waiting':
+                        continue
+                    upstream_states = []
+                    for upstream_run in (runs[upstream_name] for upstream_name in run['upstream']):
+                        corresponding = run['stage']['per_file'] and upstream_run['stage']['per_file'] and not use_work_queue and upstream_run['arrsize'] == run['arrsize']
+                        if corresponding:
+                            upstream_states.append(upstream_run['elements'][index])
+                        else:
+                            upstream_states += list(upstream_run['elements'].values())
+                    if any(upstream_state in ('failed', 'cancelled') for upstream_state in upstream_states):
+                        run['elements'][index] = 'cancelled'
+                    elif all(upstream_state == 'done' for upstream_state in upstream_states):
+                        ready.append(index)
+                if not ready:
+                    continue
+
+                stage_environment = dict(environment or {})
+                if 'level' in run['stage']:
+                    stage_environment['WAVEPP_LEVEL'] = run['stage']['level']
+                if not run['job_of']:
+                    print_message(run['stage']['message'])
+                job_id = await asyncio.to_thread(backend.submit, run['stage'], run['arrsize'], ready, config, stage_environment)
+                for index in ready:
+                    run['attempts'][index] += 1
+                    if job_id is None:
+                        # A failed submission uses up an attempt, as a failed task does
+                        run['elements'][index] = failing_task(run, index, max_retries, "could not be submitted")
+                        continue
+                    run['elements'][index] = 'pending'
+                    run['job_of'][index] = job_id
+
+            # Polling the latest job of the tasks that have not finished yet
+            polls = {}
+            for run in runs.values():
+                for index, job_id in run['job_of'].items():
+                    if run['elements'][index] in ('pending', 'running'):
+                        polls.setdefault((run['stage']['name'], job_id), (run, job_id, []))[2].append(index)
+            polls = list(polls.values())
+            results = await asyncio.gather(*[asyncio.to_thread(backend.poll, job_id, indices) for _, job_id, indices in polls], return_exceptions=True)
+            for (run, job_id, indices), states in zip(polls, results):
+                if isinstance(states, Exception):
+                    print(f"Could not poll job {job_id}: {states}")
+                    continue
+                for index, state in states.items():
+                    if state == 'failed':
+                        state = failing_task(run, index, max_retries, "failed")
+                    run['elements'][index] = state
+
+            # Streaming the progress of the stages whose state changed
+            for name, run in runs.items():
+                progress = stage_progress(run)
+                if progress != last_progress.get(name) and run['arrsize'] is not None:
+                    last_progress[name] = progress
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] {name}: {progress['done']}/{run['arrsize']} done, {progress['running']} running, "
+                          f"{progress['pending']} queued, {progress['waiting']} waiting, {progress['failed']} failed, {progress['cancelled']} cancelled")
+
+            if not all(stage_finished(run) for run in runs.values()):
+                await asyncio.sleep(poll_interval)
+    finally:
+        backend.close()
+
+    return {name: dict(stage_progress(run), succeeded=stage_succeeded(run)) for name, run in runs.items()}
@@ -6,8 +6,11 @@
 ############################################################################################################
 # --- IMPORTING PACKAGES --- #
 import os
+import glob
 import pandas as pd
 from wavepostprocessing.config import load_config
+from wavepostprocessing.work_queue import reset_queues
+from wavepostprocessing.job_sizing import auto_num_filelist, size_balanced_chunks
 #from config import load_config
 from colorama import Fore
 import sys
@@ -59,11 +62,36 @@ def create_filelist():
     elif config.get('pc_type').lower() == "linux":
         os.system('ls *csv > filelist.txt')
 
-# --- REMOVING FILES THAT ARE NEVER TO BE CONSOLIDATED --- #
-def remove_files():
-    # Reading in the filelist
-    os.chdir(os.path.join(config.get('root_folder'), config.get('results_folder')))    
-    filelist_df = pd.read_csv('filelist.txt', header=None, names=['v1'])
+# --- LOOKING UP THE SIZE OF THE DATA FILE FOR EACH ID --- #
+def data_file_sizes(filelist_df):
+    sizes = {}
+    for file_id in filelist_df['filename_temp'].unique():
+        datafile_path = os.path.join(config.get('root_folder'), config.get('results_folder'), f"{config.get('count_prefixes')}_{file_id}.csv")
+        sizes[file_id] = os.path.getsize(datafile_path) if os.path.exists(datafile_path) else 0
+    return sizes
+
+# --- SPLITTING THE FILELIST INTO CHUNKS WITH ROUGHLY THE SAME AMOUNT OF DATA --- #
+def size_balanced_split(filelist_df, sizes, num_splits):
+    '''
+    Longest-processing-time bin-packing: IDs are taken largest data file first and each ID is put in the chunk holding the least data so far.
+    All rows of an ID (metadata and data file) stay in the same chunk.
+    :param filelist_df: The filelist with one row per file
+    :param sizes: Dictionary with the data file size (bytes) of each ID
+    :param num_splits: Number of chunks
+    :return: List of filelist dataframes, one per chunk
+    '''
+    chunk_of_id = size_balanced_chunks(sizes, num_splits)
+    chunk_column = filelist_df['filename_temp'].map(chunk_of_id)
+    return [filelist_df[chunk_column == i] for i in range(num_splits)]
+
+# --- SELECTING THE FILES TO BE CONSOLIDATED --- #
+def select_files(file_names):
+    '''
+    Works out which files are to be postprocessed, without writing anything. Used by remove_files and when planning a submission.
+    :param file_names: Names of the csv files in the results folder
+    :return: filelist_df (data and metadata files of the IDs to be processed), no_analysis_df (IDs with a metadata file but no data file)
+    '''
+    filelist_df = pd.DataFrame({'v1': file_names})
     filelist_df['file_type'] = filelist_df['v1']
 
     # Running the consolidation on only specific runs -  creating a temp_keep variable and replacing the value with true if the filename contains any of the specifies prefixes:
@@ -73,6 +101,8 @@ def remove_files():
 
     # Only keeping rows where temp_keep is true
     filelist_df = filelist_df[filelist_df['temp_keep']]
+    if filelist_df.empty:
+        return pd.DataFrame(columns=['filename', 'temp_keep', 'file_type', 'filename_temp', 'id']), pd.DataFrame(columns=['filename', 'temp_keep', 'file_type', 'filename_temp'])
 
     # GENERATING A FILE_TYPE VARIABLE TO INDICATE THE DIFFERENT FILES TO BE CONSOLIDATED:
     # Keeping the first underscore in file_type and splitting on the second to find file_type:
@@ -86,27 +116,17 @@ def remove_files():
     # Creating a new variable called filename_temp and replacing it with the variable filename but without .csv
     filelist_df['filename_temp'] = filelist_df['filename'].str.replace(".csv", "")
 
-    # Extracting the file type from the filename_temp (The lambda function is used because the change is row specific, axis=1 indicates to apply the function to each row)
-    filelist_df['filename_temp'] = filelist_df.apply(
-        lambda row: row['filename_temp'].replace(f"{row['file_type']}_", ""), axis=1
-    )
+    # Extracting the file type from the filename_temp
+    filelist_df['filename_temp'] = [filename_temp.replace(f"{file_type}_", "") for filename_temp, file_type in zip(filelist_df['filename_temp'], filelist_df['file_type'])]
 
     # Tagging duplicates to see which files have the metadata but no hour or minute dataset (Which have failed due to calibration) - These will be tagged as False
     filelist_df['duplicate'] = filelist_df['filename_temp'].duplicated(keep=False)
 
-    # Creating a copy of the dataset:
-    original_df = filelist_df.copy()
+    # Keeping only the files that haven't calibrated:
+    no_analysis_df = filelist_df[(filelist_df['file_type'] == "metadata") & (filelist_df['duplicate'] == False)]
+    no_analysis_df = no_analysis_df.drop(columns=['duplicate'])
 
-    # Keeping only the files that haven't calibrated and exporting as a list if there are any:
-    filelist_df = filelist_df[(filelist_df['file_type'] == "metadata") & (filelist_df['duplicate'] == False)]
-    filelist_df = filelist_df.drop(columns=['duplicate'])
-
-    if len(filelist_df) != 0:
-        os.chdir(os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder')))
-        filelist_df.to_csv("No_Analysis_Files.txt", index=False, header=True, mode='w')
-
-    # Restoring dataset and keep only files that have calibrated:
-    filelist_df = original_df.copy()
+    # Keeping only files that have calibrated:
     filelist_df = filelist_df[(filelist_df['duplicate'] == True)]
     filelist_df = filelist_df.drop(columns=['duplicate'])
 
@@ -134,16 +154,57 @@ def remove_files():
         except FileNotFoundError:
             pass
 
+    return filelist_df, no_analysis_df
+
+
+# --- REMOVING FILES THAT ARE NEVER TO BE CONSOLIDATED --- #
+def remove_files():
+    # Reading in the filelist
+    os.chdir(os.path.join(config.get('root_folder'), config.get('results_folder')))    
+    filelist_df = pd.read_csv('filelist.txt', header=None, names=['v1'])
+    filelist_df, no_analysis_df = select_files(filelist_df['v1'].tolist())
+
+    # Exporting the files that haven't calibrated as a list if there are any:
+    if len(no_analysis_df) != 0:
+        os.chdir(os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder')))
+        no_analysis_df.to_csv("No_Analysis_Files.txt", index=False, header=True, mode='w')
+
     new_files_to_proces = len(filelist_df)
     if new_files_to_proces < 1:
-        print(Fore.RED + "There are no new files to post process. \n Make sure that files processed through wave are saved in the _results folder before re-running the post processing.")
-        input("If run in PyCharm: Stop the script from running by clicking the red stop button at the right hand top corner. \n If run at batch file: Close the window and rerun when new files have been saved in _results folder." + Fore.RESET)
+        # Not waiting for input, this runs as a batch job. The filelists are still written (empty), so the per-file stages finish straight away.
+        print(Fore.RED + "There are no new files to post process. \n Make sure that files processed through wave are saved in the _results folder before re-running the post processing." + Fore.RESET)
 
     filelist_df['serial'] = filelist_df.groupby('filename_temp').ngroup() + 1
     filelist_df.sort_values(by='serial', inplace=True)
 
+    balance_by_size = config.get('balance_filelists_by_size', 'No').lower() == 'yes'
+    auto_split = str(config.get('num_filelist', 10)).lower() == 'auto'
+    if balance_by_size or auto_split:
+        sizes = data_file_sizes(filelist_df)
+    if balance_by_size:
+        # Largest files first, so the work queue also hands out the biggest files before the small ones
+        filelist_df = filelist_df.sort_values(by='filename_temp', key=lambda column: column.map(sizes), ascending=False, kind='stable')
+
+    # Writing the full filelist, used by the shared work queue, and removing claims left over from previous runs. The progress
+    # journals are kept, so a run submitted with --resume skips the files finished before; the CLI clears them otherwise.
+    output_file = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder'), 'filelist.txt')
+    filelist_df.to_csv(output_file, sep='\t', index=False)
+    reset_queues(config)
+
     #num_splits=10
-    num_splits = config.get('num_filelist', 10)
+    if auto_split:
+        # Picking the number of chunks from the amount of data to process
+        num_splits = auto_num_filelist(config, list(sizes.values()))
+    else:
+        # Never more chunks than IDs, so no array task is submitted without files
+        num_splits = max(1, min(int(config.get('num_filelist', 10)), filelist_df['filename_temp'].nunique()))
+
+    # Writing the number of chunks for the CLI and removing chunks left over from previous runs
+    filelist_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder'))
+    with open(os.path.join(filelist_path, 'num_filelist.txt'), 'w') as file:
+        file.write(f"{num_splits}\n")
+    for old_filelist in glob.glob(os.path.join(filelist_path, 'filelist[0-9]*.txt')):
+        os.remove(old_filelist)
 
     # Idea from the following for uniform distribution
     #k, m = divmod(len(df), n)
@@ -151,11 +212,15 @@ def remove_files():
     #min(i, m) ensures that the first m parts have one extra row to handle the remainder.
 
 
-    # Calculate the size of each part
-    k, m = divmod(round(len(filelist_df)/2), num_splits)
+    if balance_by_size:
+        # Balancing the amount of data per chunk rather than the number of IDs
+        filelist_dfs = size_balanced_split(filelist_df, sizes, num_splits)
+    else:
+        # Calculate the size of each part
+        k, m = divmod(round(len(filelist_df)/2), num_splits)
 
-    # Create the list of DataFrames
-    filelist_dfs = [filelist_df.iloc[i*k*2 + min(i, m)*2:(i+1)*k*2 + min(i+1, m)*2] for i in range(num_splits)]
+        # Create the list of DataFrames
+        filelist_dfs = [filelist_df.iloc[i*k*2 + min(i, m)*2:(i+1)*k*2 + min(i+1, m)*2] for i in range(num_splits)]
 
     # Now filelist_dfs is a list of DataFrames
     for i, filelist_df in enumerate(filelist_dfs):
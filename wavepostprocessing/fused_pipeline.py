@@ -0,0 +1,109 @@
+############################################################################################################
+# This file runs the generic exhaustive postprocessing and the collapse of the results for one file at a time, keeping
+# the part processed dataframe in memory instead of writing it to the individual PartPro folder and reading it back in.
+# It replaces the separate generic_exh_postprocessing and collapse_results jobs when run_fused_pipeline is set to Yes.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import sys
+from wavepostprocessing.config import load_config, print_message
+from wavepostprocessing.work_queue import claim_files
+from wavepostprocessing import scratch
+from wavepostprocessing.quarantine import processing_with_quarantine
+from wavepostprocessing.schemas import reading_back
+import wavepostprocessing.generic_exh_postprocessing as exh
+import wavepostprocessing.collapse_results as collapse
+
+
+# --- SHARING THE CONFIG WITH THE STAGE MODULES --- #
+def binding_config(loaded_config):
+    '''
+    The stage modules read the config from a module level variable, which is normally set when they are run as a script.
+    :param loaded_config: The loaded config
+    '''
+    global config
+    config = loaded_config
+    exh.config = loaded_config
+    collapse.config = loaded_config
+    collapse.setting_up_folders()
+
+
+# --- PART PROCESSING AND COLLAPSING ONE FILE --- #
+def fused_file(file_id, anomalies_df):
+    '''
+    Runs all generic exhaustive postprocessing steps and all collapse steps switched on in the config file for one file.
+    :param file_id: The file ID to process
+    :param anomalies_df: Collated anomalies (pampro) or None
+    :return: headers dataframes of the summary and daily files (None if not collapsed to that level)
+    '''
+    part_proc_df = exh.finalising_dataframe(exh.processing_files([file_id], anomalies_df)[0])
+
+    # The part processed file is only needed if anything other than this script reads it
+    if config.get('fused_write_part_proc', 'No').lower() == 'yes':
+        exh.outputting_dataframe([part_proc_df], [file_id])
+
+    # Giving the dataframe the dtypes and values it has when read back in from the part processed csv file
+    part_proc_df = reading_back(config, part_proc_df, 'part_proc')
+    time_resolution, part_proc_df = collapse.formatting_part_proc(part_proc_df, date_orig='DATETIME_ORIG')
+
+    summary_headers_df = None
+    daily_headers_df = None
+
+    # Creating the trimmed hourly/minute level file if the other collapse files are not needed
+    if config["run_create_trimmed_file"].lower() == 'yes' and config['run_collapse_results_to_summary'].lower() == 'no' and config['run_collapse_results_to_daily'].lower() == 'no':
+        collapse.preparing_file(part_proc_df.copy(), file_id, time_resolution, output_trimmed_df='Yes', part_proc_df=part_proc_df)
+
+    # Collapsing results to summary level
+    if config['run_collapse_results_to_summary'].lower() == 'yes':
+        df = collapse.preparing_file(part_proc_df.copy(), file_id, time_resolution, output_trimmed_df='Yes', part_proc_df=part_proc_df)
+        summary_headers_df = collapse.collapse_to_summary(df, file_id, time_resolution)
+
+    # Collapsing results to daily level
+    if config.get('run_collapse_results_to_daily').lower() == 'yes':
+        daily_df = collapse.preparing_file(part_proc_df.copy(), file_id, time_resolution, output_trimmed_df='Yes' if config.get('run_collapse_results_to_summary').lower() == 'no' else 'No', part_proc_df=part_proc_df)
+        daily_headers_df = collapse.collapse_to_daily(daily_df, file_id, time_resolution)
+
+    return summary_headers_df, daily_headers_df
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print("Error: No config file provided.")
+        sys.exit(1)
+
+    config_path = sys.argv[1]
+    binding_config(load_config(config_path))
+
+    print("Loaded config:", config)
+
+    task_id = os.environ.get('SLURM_ARRAY_TASK_ID')
+    if config.get('use_work_queue', 'No').lower() == 'yes':
+        # Pulling file IDs from the shared work queue until it is empty
+        files_list = claim_files(config, 'fused_pipeline', task_id)
+        print(f"Task ID: {task_id}; pulling files from the work queue")
+    else:
+        files_list = exh.reading_filelist(str(int(task_id)-1))
+        print(f"Task ID: {task_id}; files list: {files_list}")
+
+    anomalies_df = None
+    if config.get('processing').lower() == 'pampro':
+        anomalies_df = exh.anomalies()
+
+    print_message("POSTPROCESSING AND COLLAPSING ONE FILE AT A TIME")
+    summary_headers_df = None
+    daily_headers_df = None
+    scratch.starting_staging(config, 'fused_pipeline', task_id, [] if config.get('use_work_queue', 'No').lower() == 'yes' else files_list)
+    # Finishing the staging even if the loop is stopped by an error, so the outputs of the finished files are copied back
+    try:
+        for file_summary_headers_df, file_daily_headers_df in processing_with_quarantine(config, 'fused_pipeline', task_id, files_list, lambda file_id: fused_file(file_id, anomalies_df)):
+            summary_headers_df = file_summary_headers_df if file_summary_headers_df is not None else summary_headers_df
+            daily_headers_df = file_daily_headers_df if file_daily_headers_df is not None else daily_headers_df
+    finally:
+        scratch.finishing_staging()
+
+    # Outputting data dictionaries (a task may not have collapsed any files)
+    if summary_headers_df is not None:
+        collapse.data_dic(summary_headers_df, collapse_level='summary', file_path=collapse.summary_files_path, dictionary_name="Data_dictionary_summary_means.csv")
+    if daily_headers_df is not None:
+        collapse.data_dic(daily_headers_df, collapse_level='daily', file_path=collapse.daily_files_path, dictionary_name="Data_dictionary_daily_means.csv")
@@ -14,13 +14,26 @@ import pytz
 from datetime import datetime, timedelta
 from colorama import Fore
 from wavepostprocessing.config import load_config
+from wavepostprocessing.work_queue import claim_files
+from wavepostprocessing import scratch
+from wavepostprocessing.scratch import input_path
+from wavepostprocessing.io_formats import writing_intermediate
+from wavepostprocessing.schemas import reading_csv, metadata_columns
+from wavepostprocessing.telemetry import timed
+from wavepostprocessing.quarantine import processing_with_quarantine, filelist_prefix
 #from config import load_config
 import sys
 
 # READING IN FILELIST
 def reading_filelist(id=''):
     os.chdir(os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder')))
-    filelist_df = pd.read_csv('filelist' + id + '.txt', delimiter='\t')  # Reading in the filelist
+    # retry_filelist{id}.txt when resubmitting quarantined files
+    prefix = filelist_prefix()
+    if not os.path.exists(prefix + id + '.txt'):
+        # More array tasks than filelists (e.g. when num_filelist is auto): nothing to do for this task
+        print(f"No {prefix}{id}.txt found. There are no files for this task.")
+        return []
+    filelist_df = pd.read_csv(prefix + id + '.txt', delimiter='\t')  # Reading in the filelist
     filelist_df = filelist_df.drop_duplicates(subset=['filename_temp'])
     files_list = filelist_df['filename_temp'].tolist()
 
@@ -32,38 +45,35 @@ def reading_metadata(files_list):
     metadata_dfs = []
 
     for file_id in files_list:
-        metadata_file_path = os.path.join(config.get('root_folder'), config.get('results_folder'), f"metadata_{file_id}.csv")
+        metadata_file_path = input_path(os.path.join(config.get('root_folder'), config.get('results_folder'), f"metadata_{file_id}.csv"))
 
         if os.path.exists(metadata_file_path):
-            metadata_df = pd.read_csv(metadata_file_path)
+            # Only the variables kept below are read in (see schemas.py)
+            metadata_df = reading_csv(config, metadata_file_path, 'metadata', stage='generic_exh_postprocessing')
             metadata_df['file_id'] = file_id
 
-            columns_to_keep = ['file_id', 'subject_code', 'device', 'calibration_method', 'noise_cutoff_mg', 'processing_epoch', 'generic_first_timestamp', 'generic_last_timestamp', 'QC_first_battery_pct', 'QC_last_battery_pct', 'frequency']
-            if config.get('processing').lower() == 'wave':
-                extra_columns = ['start_error', 'end_error', 'QC_anomalies_total', 'QC_anomaly_A', 'QC_anomaly_B', 'QC_anomaly_C', 'QC_anomaly_D', 'QC_anomaly_E', 'QC_anomaly_F', 'QC_anomaly_G', 'processing_script']
-            if config.get('processing').lower() == "pampro":
-                extra_columns = ['file_start_error', 'file_end_error', 'days_of_data_processed', 'mf_start_error', 'mf_end_error', 'calibration_type', 'QC_axis_anomaly']
-            columns_to_keep.extend(extra_columns)
+            columns_to_keep = metadata_columns(config)
             metadata_df = metadata_df.reindex(columns=columns_to_keep)
 
             metadata_dfs.append(metadata_df)
 
         else:
-            print(f"Metadata for file ID: {file_id} not found")
-            return
+            raise FileNotFoundError(f"Metadata for file ID: {file_id} not found ({metadata_file_path})")
 
     return metadata_dfs
 
 
 # READING DATA FILE
+@timed
 def reading_datafile(files_list):
     datafiles_dfs = []
 
     for file_id in files_list:
-        datafile_path = os.path.join(config.get('root_folder'), config.get('results_folder'), f"{config.get('count_prefixes')}_{file_id}.csv")
+        datafile_path = input_path(os.path.join(config.get('root_folder'), config.get('results_folder'), f"{config.get('count_prefixes')}_{file_id}.csv"))
 
         if os.path.exists(datafile_path):
-            datafile_df = pd.read_csv(datafile_path)
+            # The variables in variables_to_drop are not read in (see schemas.py)
+            datafile_df = reading_csv(config, datafile_path, 'data', stage='generic_exh_postprocessing')
             datafile_df['file_id'] = file_id
             datafile_df.rename(columns={'id': 'database_id'}, inplace=True)
             datafile_df.columns = [col[:-6] + "plus" if col.endswith("_99999") else col for col in datafile_df.columns]
@@ -71,8 +81,7 @@ def reading_datafile(files_list):
             datafile_df = datafile_df.drop(columns=[col for col in datafile_df.columns if any(var in col for var in config.get('variables_to_drop'))])
             datafiles_dfs.append(datafile_df)
         else:
-            print(f"Data file for ID: {file_id} not found")
-            return
+            raise FileNotFoundError(f"Data file for ID: {file_id} not found ({datafile_path})")
 
     return datafiles_dfs
 
@@ -86,6 +95,7 @@ def anomalies():
         return pd.DataFrame()
 
 # MERGING METADATA FILE AND DATA FILE, THEN MERGING ON ANOMALIES FILE AND FORMATTING MERGED DATAFRAME
+@timed
 def merging_data(files_list, metadata_dfs, datafiles_dfs, anomalies_df):
     merged_dfs = []
     time_resolutions = []
@@ -195,6 +205,7 @@ def merging_data(files_list, metadata_dfs, datafiles_dfs, anomalies_df):
     return time_resolutions, merged_dfs
 
 # GENERATING INDICATOR VARIABLE TO FLAG THE START OF A FILE (FOR HOUSEKEEPING/VERIFICATION ONLY)
+@timed
 def indicator_variable(time_resolutions, merged_dfs):
     valid_dfs = []
     for time_resolution, merged_df in zip(time_resolutions, merged_dfs):
@@ -228,6 +239,7 @@ def indicator_variable(time_resolutions, merged_dfs):
     return valid_dfs
 
 # GENERATING PWEAR VARIABLES
+@timed
 def pwear_variables(valid_dfs, time_resolutions):
     formatted_dfs = []
 
@@ -307,6 +319,7 @@ def wear_log(formatted_dfs):
 
 
 # CREATING FLAG FOR MECHANICAL NOISE THAT IS BEING COUNTED AS WEAR TIME AND RUNNING CORRUPTIONS HOUSEKEEPING
+@timed
 def mechanical_noise(formatted_dfs):
 
     # Printing out message that corruptions housekeeping is run (It is run a bit later in this function, but put it here so that it only prints out the message once and not fo each file)
@@ -365,21 +378,47 @@ def mechanical_noise(formatted_dfs):
     return dataframes
 
 
+# SORTING AND ROUNDING THE DATAFRAME BEFORE IT IS OUTPUTTED
+def finalising_dataframe(dataframe):
+    dataframe.sort_values(by=['file_id', 'DATETIME'], inplace=True)
+
+    # Rounding all numeric columns to 4 decimal places
+    numeric_columns = dataframe.select_dtypes(include=['float64', 'float32']).columns
+    dataframe[numeric_columns] = dataframe[numeric_columns].round(6)
+    return dataframe
+
+
 # OUTPUTTING THE DATAFRAME TO THE INDIVIDUAL_PARTPRO_FILES FOLDER
 def outputting_dataframe(dataframes, files_list):
 
     for dataframe, file_list in zip(dataframes, files_list):
-        dataframe.sort_values(by=['file_id', 'DATETIME'], inplace=True)
-
-        # Rounding all numeric columns to 4 decimal places
-        numeric_columns = dataframe.select_dtypes(include=['float64', 'float32']).columns
-        dataframe[numeric_columns] = dataframe[numeric_columns].round(6)
+        dataframe = finalising_dataframe(dataframe)
 
         file_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'), config.get('individual_partpro_f'), config.get('time_res_folder'))
         os.makedirs(file_path, exist_ok=True)
         file_name = os.path.join(file_path, f"{file_list}_{config.get('output_file_ext')}.csv")
 
-        dataframe.to_csv(file_name, index=False)
+        # Written as csv, parquet, feather or npy, as set by intermediate_format
+        writing_intermediate(config, dataframe, file_name)
+
+
+# RUNNING ALL POSTPROCESSING STEPS ON A LIST OF FILES, KEEPING THE RESULTS IN MEMORY
+def processing_files(files_list, anomalies_df):
+    metadata_dfs = reading_metadata(files_list)
+    datafiles_dfs = reading_datafile(files_list)
+    time_resolutions, merged_dfs = merging_data(files_list, metadata_dfs, datafiles_dfs, anomalies_df)
+    valid_dfs = indicator_variable(time_resolutions, merged_dfs)
+    formatted_dfs = pwear_variables(valid_dfs, time_resolutions)
+    if config.get('use_wear_log') == 'Yes':
+        wear_log(formatted_dfs)
+    dataframes = mechanical_noise(formatted_dfs)
+    return dataframes
+
+
+# RUNNING ALL POSTPROCESSING STEPS ON A LIST OF FILES AND OUTPUTTING THE PART PROCESSED FILES
+def postprocess_files(files_list, anomalies_df):
+    dataframes = processing_files(files_list, anomalies_df)
+    outputting_dataframe(dataframes, files_list)
 
 
 if __name__ == '__main__':
@@ -395,18 +434,25 @@ if __name__ == '__main__':
     # Now you can use config values inside your script
     
     task_id = os.environ.get('SLURM_ARRAY_TASK_ID')
-    files_list = reading_filelist(str(int(task_id)-1))
-    print(f"Task ID: {task_id}; files list: {files_list}")
-    metadata_dfs = reading_metadata(files_list)
-    datafiles_dfs = reading_datafile(files_list)
+    if config.get('use_work_queue', 'No').lower() == 'yes':
+        # Pulling file IDs from the shared work queue until it is empty
+        files_list = claim_files(config, 'generic_exh_postprocessing', task_id)
+        print(f"Task ID: {task_id}; pulling files from the work queue")
+    else:
+        files_list = reading_filelist(str(int(task_id)-1))
+        print(f"Task ID: {task_id}; files list: {files_list}")
+
+    anomalies_df = None
     if config.get('processing').lower() == 'pampro':
         anomalies_df = anomalies()
-        time_resolutions, merged_dfs = merging_data(files_list, metadata_dfs, datafiles_dfs, anomalies_df)
-    if config.get('processing').lower() == 'wave':
-        time_resolutions, merged_dfs = merging_data(files_list, metadata_dfs, datafiles_dfs, None)
-    valid_dfs = indicator_variable(time_resolutions, merged_dfs)
-    formatted_dfs = pwear_variables(valid_dfs, time_resolutions)
-    if config.get('use_wear_log') == 'Yes':
-        wear_log(formatted_dfs)
-    dataframes = mechanical_noise(formatted_dfs)
-    outputting_dataframe(dataframes, files_list)
+
+    # Copying the inputs to local scratch ahead of processing, if switched on
+    scratch.starting_staging(config, 'generic_exh_postprocessing', task_id, [] if config.get('use_work_queue', 'No').lower() == 'yes' else files_list)
+
+    # Processing one file at a time
+    # The outputs written so far are copied back even if the loop is stopped by an error
+    try:
+        for _ in processing_with_quarantine(config, 'generic_exh_postprocessing', task_id, files_list, lambda file_id: postprocess_files([file_id], anomalies_df)):
+            pass
+    finally:
+        scratch.finishing_staging()
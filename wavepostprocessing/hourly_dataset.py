@@ -0,0 +1,234 @@
+############################################################################################################
+# This file keeps the appended hourly/minute level file as a Parquet dataset instead of one csv file, switched on by
+# setting hourly_output_format to parquet_dataset in the config file (needs pyarrow).
+# The dataset is a folder named after hour_output_file, next to where the csv file would be, partitioned by file ID:
+# - <file_id>.parquet: the rows of one file ID, written from its individual trimmed file,
+# - no_analysis.parquet: the rows of the IDs that have not had an analysis file produced,
+# - _common_metadata: the schema of the whole dataset (the union of the partitions) and the list of partitions.
+# Appending then only writes the partitions whose trimmed file has changed, and removes those whose trimmed file is
+# gone. The verification checks and the hourly release read the dataset with the columns they need and with the
+# housekeeping filter pushed down, instead of reading the whole csv file.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import json
+
+NO_ANALYSIS_PARTITION = 'no_analysis.parquet'
+METADATA_FILE = '_common_metadata'
+
+# Config keys that change the rows written from a trimmed file (see appending_files.appending_files)
+PARTITION_KEYS = ['remove_thresholds', 'variables_to_drop']
+
+# IDs written as text in every partition, whatever they look like in one trimmed file
+ID_COLUMNS = ['id', 'file_id', 'subject_code']
+
+_pyarrow_missing_reported = False
+
+
+# --- CHECKING IF THE HOURLY FILE IS KEPT AS A DATASET --- #
+def use_dataset(config):
+    global _pyarrow_missing_reported
+    if config.get('hourly_output_format', 'csv').lower() != 'parquet_dataset':
+        return False
+    try:
+        import pyarrow
+    except ImportError:
+        if not _pyarrow_missing_reported:
+            print("pyarrow is not installed, the hourly/minute level file is appended as a csv file instead of a Parquet dataset.")
+            _pyarrow_missing_reported = True
+        return False
+    return True
+
+
+# --- PATHS --- #
+def dataset_path(config):
+    return os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'), config.get('hour_output_file'))
+
+
+def metadata_path(config):
+    return os.path.join(dataset_path(config), METADATA_FILE)
+
+
+def partition_name(file_id):
+    return f"{file_id}.parquet"
+
+
+def file_id_of(individual_file_name):
+    # Individual trimmed files are named <file_id>_TRIMMED_<count_prefixes>.<format>
+    return os.path.splitext(individual_file_name)[0].rsplit('_TRIMMED_', 1)[0]
+
+
+# --- TYPE OF EACH COLUMN IN EVERY PARTITION --- #
+def column_type(name, dtype):
+    '''
+    :return: The Arrow type a column is written with, the same in every partition whatever its values in one trimmed file,
+             so that the schemas of the partitions can always be unified: text as string, true/false as bool, and all
+             other columns (numbers, or no values at all) as float64
+    '''
+    import pyarrow as pa
+    from wavepostprocessing.schemas import DATE_COLUMNS, CATEGORICAL_COLUMNS
+    if name in DATE_COLUMNS or name in CATEGORICAL_COLUMNS or name in ID_COLUMNS:
+        return pa.string()
+    if pa.types.is_boolean(dtype):
+        return pa.bool_()
+    if pa.types.is_integer(dtype) or pa.types.is_floating(dtype) or pa.types.is_null(dtype):
+        return pa.float64()
+    return pa.string()
+
+
+def partition_schema(table):
+    import pyarrow as pa
+    return pa.schema([(field.name, column_type(field.name, field.type)) for field in table.schema])
+
+
+# --- WRITING PARTITIONS --- #
+def source_state(config, source_path):
+    '''
+    :return: What a partition was written from: size and modification time of the trimmed file and the config keys that change the rows
+    '''
+    stat = os.stat(source_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'config': {key: config.get(key) for key in PARTITION_KEYS}}
+
+
+def partition_up_to_date(config, source_path, file_id):
+    import pyarrow.parquet as pq
+    path = os.path.join(dataset_path(config), partition_name(file_id))
+    if not os.path.exists(path):
+        return False
+    metadata = pq.read_schema(path).metadata or {}
+    written_from = json.loads(metadata.get(b'written_from', b'null'))
+    return written_from == json.loads(json.dumps(source_state(config, source_path), default=str))
+
+
+def writing_partition(config, dataframe, name, written_from=None):
+    '''
+    Writes one partition of the dataset. The partition is written next to its final name and renamed, so that readers
+    never see a half written partition.
+    :param config: The loaded config
+    :param dataframe: The rows of the partition
+    :param name: File name of the partition
+    :param written_from: source_state() of the trimmed file, stored with the partition
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    # The pandas metadata is not kept, the dtypes it records are those before the cast
+    table = table.cast(partition_schema(table))
+    if written_from is not None:
+        table = table.replace_schema_metadata({b'written_from': json.dumps(written_from, default=str).encode()})
+
+    path = os.path.join(dataset_path(config), name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(table, temporary_path, compression='zstd')
+    os.replace(temporary_path, path)
+
+
+def removing_partition(config, name):
+    path = os.path.join(dataset_path(config), name)
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+    return False
+
+
+def partition_rows(config, name):
+    import pyarrow.parquet as pq
+    path = os.path.join(dataset_path(config), name)
+    return pq.read_metadata(path).num_rows if os.path.exists(path) else 0
+
+
+def partition_names(config):
+    if not os.path.isdir(dataset_path(config)):
+        return []
+    names = sorted(name for name in os.listdir(dataset_path(config)) if name.endswith('.parquet') and name != NO_ANALYSIS_PARTITION)
+    # The rows of the IDs without analysis file come last, as in the csv file
+    if os.path.exists(os.path.join(dataset_path(config), NO_ANALYSIS_PARTITION)):
+        names.append(NO_ANALYSIS_PARTITION)
+    return names
+
+
+# --- UPDATING THE SCHEMA AND LIST OF PARTITIONS --- #
+def unifying_schemas(schemas):
+    '''
+    :return: The union of the schemas of the partitions. A true/false column is written as float64 in a trimmed file where it
+             has no values (see column_type), the column then keeps its other type and is read as null from that partition.
+    '''
+    import pyarrow as pa
+    try:
+        return pa.unify_schemas(schemas, promote_options='permissive')
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        pass
+    types = {}
+    for schema in schemas:
+        for field in schema:
+            if types.get(field.name) is None or pa.types.is_floating(types[field.name]):
+                types[field.name] = field.type
+            elif not pa.types.is_floating(field.type) and field.type != types[field.name]:
+                types[field.name] = pa.string()
+    return pa.schema(list(types.items()))
+
+
+
+def updating_metadata(config):
+    '''
+    Writes _common_metadata: the union of the schemas of all partitions (only their footers are read) and the list of
+    partitions with their size and modification time, so that the file changes whenever a partition does.
+    :return: The schema of the dataset
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    names = partition_names(config)
+    schemas = [pq.read_schema(os.path.join(dataset_path(config), name)).remove_metadata() for name in names]
+    schema = unifying_schemas(schemas) if schemas else pa.schema([])
+
+    partitions = {}
+    for name in names:
+        stat = os.stat(os.path.join(dataset_path(config), name))
+        partitions[name] = [stat.st_size, stat.st_mtime_ns]
+    schema = schema.with_metadata({b'partitions': json.dumps(partitions).encode()})
+
+    os.makedirs(dataset_path(config), exist_ok=True)
+    temporary_path = f"{metadata_path(config)}.{os.getpid()}.tmp"
+    pq.write_metadata(schema, temporary_path)
+    os.replace(temporary_path, metadata_path(config))
+    return schema
+
+
+# --- READING THE DATASET --- #
+def excluding(schema, column, values):
+    '''
+    :return: Filter keeping the rows whose value of column is not in values (rows without a value are kept, as with pandas isin),
+             or None if the column is not in the dataset or its values are not text (they then never match, as with pandas isin)
+    '''
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    if column not in schema.names or not pa.types.is_string(schema.field(column).type):
+        return None
+    return ~ds.field(column).isin([str(value) for value in values]) | ds.field(column).is_null()
+
+
+def reading_dataset(config, columns=None, exclude=None, text=()):
+    '''
+    Reads the dataset, only the columns and rows needed.
+    :param config: The loaded config
+    :param columns: Function of (config, column name) telling if a column is needed (see schemas.py), None for all columns
+    :param exclude: (column, values): rows with these values are not read (e.g. the housekeeping filenames_to_remove)
+    :param text: Columns to return as text, as when read from csv with dtype str
+    :return: dataframe
+    '''
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    from wavepostprocessing.schemas import arrow_to_pandas
+    schema = pq.read_schema(metadata_path(config))
+    partitions = json.loads(schema.metadata[b'partitions'])
+    schema = schema.remove_metadata()
+    dataset = ds.dataset([os.path.join(dataset_path(config), name) for name in partitions], schema=schema, format='parquet')
+
+    names = schema.names if columns is None else [name for name in schema.names if columns(config, name)]
+    row_filter = excluding(schema, *exclude) if exclude is not None else None
+    df = arrow_to_pandas(dataset.to_table(columns=names, filter=row_filter))
+    for column in text:
+        if column in df.columns:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
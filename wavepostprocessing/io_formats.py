@@ -0,0 +1,203 @@
+############################################################################################################
+# This file reads and writes the intermediate files (the individual part processed and trimmed files) in the format set
+# as intermediate_format in the config file: csv (default), parquet (zstd compressed), feather (Arrow IPC) or npy.
+# Parquet and feather keep the column types and the timestamps, so the files do not have to be turned into text and
+# parsed again. They need pyarrow; without it the files are written as csv.
+# npy keeps the float columns (the epoch values, most of a minute level file) as one numpy array, with a small json
+# sidecar holding the column names, types and the other columns (timestamps, IDs, counts). The array is memory-mapped
+# when read, so the float columns are views on the file instead of copies, and a worker only holds the pages it uses.
+# Readers find the file whatever format it was written in, so changing the format does not require rerunning the
+# earlier stages. Writing a file removes the copies of it in the other formats.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import csv
+import json
+from wavepostprocessing import scratch
+
+# File extension of each format
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather', 'npy': '.npy'}
+
+_pyarrow_missing_reported = False
+
+
+# --- FORMAT TO WRITE THE INTERMEDIATE FILES IN --- #
+def intermediate_format(config):
+    global _pyarrow_missing_reported
+    file_format = config.get('intermediate_format', 'csv').lower()
+    if file_format not in FORMATS:
+        raise ValueError(f"intermediate_format must be one of {', '.join(FORMATS)}, not {file_format}")
+    if file_format in ('parquet', 'feather'):
+        try:
+            import pyarrow
+        except ImportError:
+            if not _pyarrow_missing_reported:
+                print(f"pyarrow is not installed, writing the intermediate files as csv instead of {file_format}.")
+                _pyarrow_missing_reported = True
+            return 'csv'
+    return file_format
+
+
+# --- FINDING THE FILE IN WHICHEVER FORMAT IT WAS WRITTEN --- #
+def format_variants(path):
+    base = os.path.splitext(path)[0]
+    return [base + extension for extension in FORMATS.values()]
+
+
+def existing_path(path):
+    '''
+    :param path: Path of the file with any of the extensions (e.g. the .csv path)
+    :return: The most recently written of the formats that exist, or None if the file does not exist in any format
+    '''
+    existing = [variant for variant in format_variants(path) if os.path.exists(variant)]
+    return max(existing, key=os.path.getmtime, default=None)
+
+
+def resolving_path(config, path):
+    '''
+    :return: The existing file, or the path the file would be written to in the configured format
+    '''
+    return existing_path(path) or os.path.splitext(path)[0] + FORMATS[intermediate_format(config)]
+
+
+# --- READING AND WRITING --- #
+def reading_table(path, config=None, kind=None):
+    '''
+    :param path: Path of the file, read by its extension
+    :param config: The loaded config, needed with kind
+    :param kind: Kind of file (see schemas.py), csv files are then read with its schema
+    :return: dataframe
+    '''
+    # Importing here, as the manifest uses this file to find paths without needing pandas
+    import pandas as pd
+    extension = os.path.splitext(path)[1]
+    if extension == FORMATS['parquet']:
+        return pd.read_parquet(path)
+    if extension == FORMATS['feather']:
+        return pd.read_feather(path)
+    if extension == FORMATS['npy']:
+        return reading_npy(path)
+    if kind is not None:
+        from wavepostprocessing.schemas import reading_csv
+        return reading_csv(config, path, kind)
+    return pd.read_csv(path)
+
+
+def sidecar_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def removing_variant(path):
+    if os.path.exists(path):
+        os.remove(path)
+    if path.endswith(FORMATS['npy']) and os.path.exists(sidecar_path(path)):
+        os.remove(sidecar_path(path))
+
+
+# --- NPY FORMAT --- #
+def writing_npy(dataframe, path, sidecar):
+    '''
+    Writes the float columns as one array in column order (each column is then contiguous when memory-mapped) to path,
+    and the column names, types and the other columns to the sidecar.
+    '''
+    import numpy as np
+    import pandas as pd
+    block_columns = [column for column in dataframe.columns if pd.api.types.is_float_dtype(dataframe[column].dtype)]
+    block = np.empty((len(dataframe), len(block_columns)), dtype='float64', order='F')
+    for index, column in enumerate(block_columns):
+        block[:, index] = dataframe[column].to_numpy(dtype='float64')
+
+    values = {}
+    for column in dataframe.columns:
+        if column in block_columns:
+            continue
+        series = dataframe[column]
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            series = series.astype(str).where(series.notna(), None)
+        values[column] = series.astype(object).where(series.notna(), None).tolist()
+
+    description = {'rows': len(dataframe), 'columns': list(dataframe.columns), 'block': block_columns,
+                   'dtypes': {column: str(dataframe[column].dtype) for column in dataframe.columns}, 'values': values}
+    # The sidecar is written first: a reader finds the file by its array
+    with open(sidecar, 'w') as file:
+        json.dump(description, file, default=str)
+    np.save(path, block)
+
+
+def reading_npy(path):
+    '''
+    :return: dataframe whose float columns are copy-on-write views on the memory-mapped array
+    '''
+    import numpy as np
+    import pandas as pd
+    with open(sidecar_path(path), 'r') as file:
+        description = json.load(file)
+    # An empty array cannot be memory-mapped
+    block = np.load(path, mmap_mode='c' if description['rows'] > 0 else None)
+    block_index = {column: index for index, column in enumerate(description['block'])}
+
+    columns = {}
+    for column in description['columns']:
+        if column in block_index:
+            columns[column] = block[:, block_index[column]]
+        else:
+            columns[column] = np.array(description['values'][column], dtype=object)
+    df = pd.DataFrame(columns, index=pd.RangeIndex(description['rows']), copy=False)
+
+    # Columns that were not float64 or text are given back their type (these are copies)
+    for column, dtype in description['dtypes'].items():
+        if str(df[column].dtype) != dtype:
+            df[column] = df[column].where(df[column].notna(), np.nan).astype(dtype)
+    return df
+
+
+def table_columns(path):
+    '''
+    :return: The column names of a file in any of the formats, read from its header, schema or sidecar only
+    '''
+    extension = os.path.splitext(path)[1]
+    if extension == FORMATS['parquet']:
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    if extension == FORMATS['feather']:
+        import pyarrow.ipc as ipc
+        return ipc.open_file(path).schema.names
+    if extension == FORMATS['npy']:
+        with open(sidecar_path(path), 'r') as file:
+            return json.load(file)['columns']
+    with open(path, 'r', newline='') as file:
+        return next(csv.reader(file), [])
+
+
+def is_csv(path):
+    return os.path.splitext(path)[1] == FORMATS['csv']
+
+
+def writing_intermediate(config, dataframe, path):
+    '''
+    Writes the dataframe in the configured format, next to (or, while staging, on local scratch for) the given path.
+    :param config: The loaded config
+    :param dataframe: The dataframe to write
+    :param path: Path of the file with any extension, the extension of the format is used
+    :return: The path written to on the shared filesystem
+    '''
+    file_format = intermediate_format(config)
+    target = os.path.splitext(path)[0] + FORMATS[file_format]
+    if file_format == 'npy':
+        # Both files are copied back from local scratch, the sidecar first
+        sidecar = scratch.output_path(sidecar_path(target))
+    written = scratch.output_path(target)
+    if file_format == 'npy':
+        writing_npy(dataframe, written, sidecar)
+    elif file_format == 'parquet':
+        dataframe.to_parquet(written, index=False, compression='zstd')
+    elif file_format == 'feather':
+        dataframe.reset_index(drop=True).to_feather(written, compression='zstd')
+    else:
+        dataframe.to_csv(written, index=False)
+
+    # A copy in another format would be appended twice, or read instead of this one
+    for variant in format_variants(target):
+        if variant != target:
+            removing_variant(variant)
+    return target
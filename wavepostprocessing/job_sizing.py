@@ -0,0 +1,211 @@
+############################################################################################################
+# This file estimates the wall time and memory to request for each submitted array job.
+# The estimate is based on the amount of input data each array task has to process and on a calibration table of
+# throughput for each stage module. The data of each task is worked out from the file IDs planned for the submission,
+# split the way filelist_generation will split them, as the filelist{i}.txt files on disk may be from an earlier run.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import csv
+import glob
+import heapq
+import math
+
+# --- CALIBRATION TABLE --- #
+# Measured on the HPC compute nodes with 1h level data. All sizes refer to the size of the Wave/pampro data files
+# ({count_prefixes}_{id}.csv) in the results folder, which is what the filelists describe.
+# per_file: True if the stage processes one file at a time (peak memory follows the largest file), False if the stage
+#           holds the whole cohort in memory (peak memory follows the total data size).
+# seconds_startup: Interpreter start and imports.
+# seconds_per_file: Fixed cost per participant (reading metadata, regressions, writing outputs).
+# bytes_per_second: Throughput on the data itself.
+# memory_base_mb: Memory used before any data is read.
+# memory_per_byte: Peak memory per byte of input data (pandas holds several copies of each table).
+STAGE_THROUGHPUT = {
+    'wavepostprocessing.pampro_merge_metafiles': {'per_file': True, 'seconds_startup': 30, 'seconds_per_file': 0.2, 'bytes_per_second': 50e6, 'memory_base_mb': 500, 'memory_per_byte': 4},
+    'wavepostprocessing.pampro_collate_anomalies': {'per_file': False, 'seconds_startup': 30, 'seconds_per_file': 0.05, 'bytes_per_second': 50e6, 'memory_base_mb': 500, 'memory_per_byte': 1},
+    'wavepostprocessing.filelist_generation': {'per_file': False, 'seconds_startup': 30, 'seconds_per_file': 0.01, 'bytes_per_second': 1e9, 'memory_base_mb': 500, 'memory_per_byte': 0},
+    'wavepostprocessing.generic_exh_postprocessing': {'per_file': True, 'seconds_startup': 30, 'seconds_per_file': 1.5, 'bytes_per_second': 2e6, 'memory_base_mb': 600, 'memory_per_byte': 12},
+    'wavepostprocessing.collapse_results': {'per_file': True, 'seconds_startup': 40, 'seconds_per_file': 6, 'bytes_per_second': 1e6, 'memory_base_mb': 700, 'memory_per_byte': 10},
+    'wavepostprocessing.fused_pipeline': {'per_file': True, 'seconds_startup': 40, 'seconds_per_file': 7, 'bytes_per_second': 0.7e6, 'memory_base_mb': 800, 'memory_per_byte': 14},
+    'wavepostprocessing.appending_files': {'per_file': False, 'seconds_startup': 30, 'seconds_per_file': 0.05, 'bytes_per_second': 10e6, 'memory_base_mb': 600, 'memory_per_byte': 6},
+    'wavepostprocessing.verification_checks': {'per_file': False, 'seconds_startup': 40, 'seconds_per_file': 0.01, 'bytes_per_second': 20e6, 'memory_base_mb': 700, 'memory_per_byte': 5},
+    'wavepostprocessing.prepare_releases': {'per_file': False, 'seconds_startup': 30, 'seconds_per_file': 0.01, 'bytes_per_second': 10e6, 'memory_base_mb': 700, 'memory_per_byte': 8},
+}
+
+# Safety margin on the estimates and the limits of what can be requested
+SAFETY_FACTOR = 1.5
+# The wall time requested before the estimates were added; min_task_minutes in the config file lowers or raises it
+MIN_MINUTES = 40
+MAX_MINUTES = 12 * 60
+MIN_MEMORY_MB = 1000
+
+
+# --- SPLITTING FILE IDS INTO CHUNKS WITH ROUGHLY THE SAME AMOUNT OF DATA --- #
+def size_balanced_chunks(sizes, num_splits):
+    '''
+    Longest-processing-time bin-packing: IDs are taken largest data file first and each ID is put in the chunk holding the least data so far.
+    :param sizes: Dictionary with the data file size (bytes) of each ID
+    :param num_splits: Number of chunks
+    :return: Dictionary with the chunk (0 to num_splits - 1) of each ID
+    '''
+    chunks = [(0, i) for i in range(num_splits)]
+    chunk_of_id = {}
+    for file_id in sorted(sizes, key=sizes.get, reverse=True):
+        chunk_size, chunk = heapq.heappop(chunks)
+        chunk_of_id[file_id] = chunk
+        heapq.heappush(chunks, (chunk_size + sizes[file_id], chunk))
+    return chunk_of_id
+
+
+# --- SIZES OF THE DATA FILES IN EACH FILELIST CHUNK --- #
+def planned_chunk_sizes(config, file_ids, arrsize):
+    '''
+    Splits the planned file IDs over the array tasks as filelist_generation does: size balanced with balance_filelists_by_size,
+    otherwise in order, the first chunks taking one ID more when they do not divide evenly.
+    :return: List of lists of file sizes
+    '''
+    results_path = os.path.join(config.get('root_folder'), config.get('results_folder'))
+    sizes = {}
+    for file_id in file_ids:
+        data_path = os.path.join(results_path, f"{config.get('count_prefixes')}_{file_id}.csv")
+        sizes[file_id] = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+
+    chunks = [[] for _ in range(arrsize)]
+    if config.get('balance_filelists_by_size', 'No').lower() == 'yes':
+        for file_id, chunk in size_balanced_chunks(sizes, arrsize).items():
+            chunks[chunk].append(sizes[file_id])
+        return chunks
+    k, m = divmod(len(sizes), arrsize)
+    ordered = list(sizes.values())
+    return [ordered[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(arrsize)]
+
+
+def chunk_file_sizes(config, arrsize, filelist_prefix='filelist', file_ids=None):
+    '''
+    Returns a list with, for each array task, the sizes (bytes) of the data files it will process.
+    Uses the planned file IDs if given, otherwise {filelist_prefix}{i}.txt if present, otherwise spreads the data files in
+    the results folder evenly over the tasks.
+    :param config: The loaded config
+    :param arrsize: Number of array tasks
+    :param filelist_prefix: Prefix of the filelists the tasks read (retry_filelist when resubmitting quarantined files)
+    :param file_ids: File IDs planned for the submission (see planning.plan_pipeline), None if not known
+    :return: List of lists of file sizes
+    '''
+    # The retry filelists are written just before the resubmission, the planned file IDs are those of the full filelist
+    if file_ids is not None and filelist_prefix == 'filelist':
+        return planned_chunk_sizes(config, file_ids, arrsize)
+
+    results_path = os.path.join(config.get('root_folder'), config.get('results_folder'))
+    filelist_path = os.path.join(results_path, config.get('filelist_folder'))
+    data_prefix = f"{config.get('count_prefixes')}_"
+
+    chunks = []
+    for i in range(arrsize):
+        chunk_path = os.path.join(filelist_path, f'{filelist_prefix}{i}.txt')
+        if not os.path.exists(chunk_path):
+            break
+        with open(chunk_path, 'r', newline='') as file:
+            file_names = [row['filename'] for row in csv.DictReader(file, delimiter='\t') if row['filename'].startswith(data_prefix)]
+        chunks.append([os.path.getsize(os.path.join(results_path, file_name)) for file_name in file_names if os.path.exists(os.path.join(results_path, file_name))])
+
+    if len(chunks) == arrsize:
+        return chunks
+
+    # No (complete) set of filelists yet: assume the data files will be spread evenly
+    sizes = sorted((os.path.getsize(path) for path in glob.glob(os.path.join(results_path, f"{data_prefix}*.csv"))), reverse=True)
+    return [sizes[i::arrsize] for i in range(arrsize)]
+
+
+# --- ESTIMATING TIME AND MEMORY FOR A STAGE --- #
+def estimate_resources(script_name, config, arrsize, filelist_prefix='filelist', file_ids=None):
+    '''
+    Estimates the wall time and memory to request for each array task of a stage.
+    :param script_name: The module name (e.g., "wavepostprocessing.collapse_results")
+    :param config: The loaded config
+    :param arrsize: Number of array tasks
+    :param filelist_prefix: Prefix of the filelists the tasks read
+    :param file_ids: File IDs planned for the submission, None if not known
+    :return: time (as HH:MM:SS) and memory (as e.g. 4000M), or None, None if the stage is not in the calibration table
+    '''
+    throughput = STAGE_THROUGHPUT.get(script_name)
+    if throughput is None:
+        return None, None
+
+    chunks = chunk_file_sizes(config, arrsize, filelist_prefix, file_ids)
+    if not throughput['per_file']:
+        # Stages running as a single task see the whole cohort
+        chunks = [[size for chunk in chunks for size in chunk]]
+
+    seconds = 0
+    memory_bytes = 0
+    for chunk in chunks:
+        chunk_seconds = throughput['seconds_startup'] + len(chunk) * throughput['seconds_per_file'] + sum(chunk) / throughput['bytes_per_second']
+        seconds = max(seconds, chunk_seconds)
+        held_in_memory = max(chunk, default=0) if throughput['per_file'] else sum(chunk)
+        memory_bytes = max(memory_bytes, held_in_memory * throughput['memory_per_byte'])
+
+    minutes = min(MAX_MINUTES, max(config.get('min_task_minutes', MIN_MINUTES), math.ceil(seconds * SAFETY_FACTOR / 60)))
+    memory_mb = max(MIN_MEMORY_MB, math.ceil((throughput['memory_base_mb'] + memory_bytes / 1e6) * SAFETY_FACTOR))
+
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00", f"{memory_mb}M"
+
+
+# --- TIME AND MEMORY TO REQUEST, WITH USER OVERRIDES --- #
+def job_resources(script_name, config, arrsize, time=None, mem=None, filelist_prefix='filelist', file_ids=None):
+    '''
+    Returns the time and memory to request for a stage. Values given on the command line take precedence, then values
+    set for the stage in the job_resources section of the config file (e.g. {"collapse_results": {"time": "02:00:00", "mem": "8G"}}),
+    then the estimate from the calibration table.
+    :return: time and memory (either may be None, in which case nothing is requested)
+    '''
+    stage_overrides = config.get('job_resources', {}).get(script_name.split('.')[-1], {})
+    time = time or stage_overrides.get('time')
+    mem = mem or stage_overrides.get('mem')
+    if time is None or mem is None:
+        estimated_time, estimated_mem = estimate_resources(script_name, config, arrsize, filelist_prefix, file_ids)
+        time = time or estimated_time
+        mem = mem or estimated_mem
+    return time, mem
+
+
+# --- NUMBER OF FILELIST CHUNKS FROM THE DATA VOLUME --- #
+def auto_num_filelist(config, sizes):
+    '''
+    Picks the number of filelist chunks (array tasks) so that each task of the slowest per-file stage should finish
+    within target_task_minutes (config, defaults to 30 minutes).
+    :param config: The loaded config
+    :param sizes: Sizes (bytes) of the data files to be processed
+    :return: Number of chunks, between 1 and max_num_filelist (config, defaults to 100) and never more than the number of files
+    '''
+    target_seconds = config.get('target_task_minutes', 30) * 60
+    num_filelist = 1
+    for script_name in ['wavepostprocessing.generic_exh_postprocessing', 'wavepostprocessing.collapse_results']:
+        throughput = STAGE_THROUGHPUT[script_name]
+        work_seconds = len(sizes) * throughput['seconds_per_file'] + sum(sizes) / throughput['bytes_per_second']
+        seconds_per_task = max(60, target_seconds / SAFETY_FACTOR - throughput['seconds_startup'])
+        num_filelist = max(num_filelist, math.ceil(work_seconds / seconds_per_task))
+    return max(1, min(num_filelist, len(sizes), config.get('max_num_filelist', 100)))
+
+
+# --- NUMBER OF FILELIST CHUNKS TO SUBMIT --- #
+def number_of_filelists(config):
+    '''
+    Returns the number of array tasks for the per-file stages. This is num_filelist from the config, unless it is set to "auto".
+    In auto mode the number written by the last filelist generation is used, or, if the filelists are generated as part of
+    this submission, an estimate from all data files in the results folder (filelist generation may then create fewer
+    chunks, the surplus array tasks find no filelist and finish straight away).
+    :param config: The loaded config
+    :return: Number of array tasks
+    '''
+    if str(config.get('num_filelist', 10)).lower() != 'auto':
+        return int(config.get('num_filelist', 10))
+
+    results_path = os.path.join(config.get('root_folder'), config.get('results_folder'))
+    num_filelist_path = os.path.join(results_path, config.get('filelist_folder'), 'num_filelist.txt')
+    if config.get('run_filelist_generation', 'No').lower() != 'yes' and os.path.exists(num_filelist_path):
+        with open(num_filelist_path, 'r') as file:
+            return int(file.read().strip())
+
+    sizes = [os.path.getsize(path) for path in glob.glob(os.path.join(results_path, f"{config.get('count_prefixes')}_*.csv"))]
+    return auto_num_filelist(config, sizes)
@@ -0,0 +1,238 @@
+############################################################################################################
+# This file keeps a manifest of what has been processed, so that a re-run only redoes the work whose inputs changed.
+# For each stage and file ID a small JSON record is written to <log_folder>/manifest/<stage>/<file_id>.json with a
+# fingerprint: a hash of the input files plus the values of only those config keys that the stage depends on.
+# A stage skips a file ID when the fingerprint is unchanged and the outputs recorded with it are still there, so e.g.
+# changing a release threshold only rebuilds the release files and not the part processed or collapsed files.
+# Switched on with incremental_rebuild in the config file.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import json
+import hashlib
+from datetime import datetime
+from wavepostprocessing import io_formats, hourly_dataset
+
+# --- CONFIG KEYS EACH STAGE DEPENDS ON --- #
+EXHAUSTIVE_KEYS = ['processing', 'count_prefixes', 'variables_to_drop', 'timezone', 'clock_changes', 'use_wear_log',
+                   'run_corruptions_housekeeping', 'corruption_condition_file_path']
+COLLAPSE_KEYS = ['processing', 'count_prefixes', 'variables_to_drop', 'use_wear_log', 'truncate_data', 'no_of_days', 'drop_end_anom_f',
+                 'anom_var_pampro', 'anom_var_wave', 'remove_mech_noise', 'min_day_hours', 'impute_data', 'impute_hours',
+                 'sum_min_hour_inclusion', 'day_min_hour_inclusion', 'run_create_trimmed_file', 'run_collapse_results_to_summary',
+                 'run_collapse_results_to_daily']
+RELEASE_KEYS = ['processing', 'count_prefixes', 'remove_thresholds', 'impute_data', 'use_wear_log', 'anom_var_pampro', 'run_housekeeping',
+                'filenames_to_remove']
+
+STAGE_CONFIG_KEYS = {
+    'generic_exh_postprocessing': EXHAUSTIVE_KEYS,
+    'collapse_trimmed': COLLAPSE_KEYS,
+    'collapse_summary': COLLAPSE_KEYS,
+    'collapse_daily': COLLAPSE_KEYS,
+    'fused_pipeline': EXHAUSTIVE_KEYS + COLLAPSE_KEYS + ['fused_write_part_proc'],
+    'release_summary': RELEASE_KEYS + ['sum_pwear', 'sum_pwear_morning', 'sum_pwear_quad'],
+    'release_daily': RELEASE_KEYS + ['day_pwear', 'day_pwear_morning', 'day_pwear_quad'],
+    'release_hourly': RELEASE_KEYS,
+}
+
+# Hashes of files already hashed by this process, keyed by (path, size, modification time). Cohort wide inputs such as
+# the anomalies file or the wear log are part of every file's fingerprint but only need to be read once.
+_hash_cache = {}
+
+
+# --- CHECKING IF INCREMENTAL REBUILDS ARE SWITCHED ON --- #
+def incremental(config):
+    return config.get('incremental_rebuild', 'No').lower() == 'yes'
+
+
+# --- INPUT FILES OF EACH STAGE --- #
+def stage_inputs(config, stage, file_id):
+    '''
+    Returns the paths of the files a stage reads for one file ID (for the releases, file_id is the release level).
+    :param config: The loaded config
+    :param stage: Stage name as used in STAGE_CONFIG_KEYS
+    :param file_id: The file ID
+    :return: List of paths (files that do not exist are included, so that their appearance changes the fingerprint)
+    '''
+    results_path = os.path.join(config.get('root_folder'), config.get('results_folder'))
+    summary_path = os.path.join(results_path, config.get('summary_folder'))
+
+    if stage in ('generic_exh_postprocessing', 'fused_pipeline'):
+        paths = [os.path.join(results_path, f"metadata_{file_id}.csv"),
+                 os.path.join(results_path, f"{config.get('count_prefixes')}_{file_id}.csv")]
+        if config.get('processing').lower() == 'pampro':
+            paths.append(os.path.join(config.get('root_folder'), config.get('anomalies_folder'), config.get('anomalies_file')))
+        if config.get('use_wear_log') == 'Yes':
+            paths.append(os.path.join(config.get('root_folder'), config.get('wear_log_folder'), f"{config.get('wear_log')}.csv"))
+        if config.get('run_corruptions_housekeeping', 'No').lower() == 'yes':
+            paths.append(config.get('corruption_condition_file_path'))
+        return paths
+
+    if stage.startswith('collapse_'):
+        return [part_proc_path(config, file_id)]
+
+    if stage.startswith('release_'):
+        output_file = {'summary': 'sum_output_file', 'daily': 'day_output_file', 'hourly': 'hour_output_file'}[file_id]
+        paths = [os.path.join(summary_path, f"{config.get(output_file)}.csv")]
+        if file_id == 'hourly' and hourly_dataset.use_dataset(config):
+            # Lists the partitions with their size and modification time, so it changes whenever one of them does
+            paths = [hourly_dataset.metadata_path(config)]
+        if config.get('processing').lower() == 'pampro':
+            paths.append(os.path.join(config.get('root_folder'), config.get('anomalies_folder'), 'collapsed_anomalies.csv'))
+        return paths
+
+    raise ValueError(f"No inputs defined for stage {stage}")
+
+
+# --- OUTPUT FILES OF EACH STAGE --- #
+def part_proc_path(config, file_id):
+    return io_formats.resolving_path(config, os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'), config.get('individual_partpro_f'),
+                                                          config.get('time_res_folder'), f"{file_id}_{config.get('output_file_ext')}.csv"))
+
+
+def stage_outputs(config, stage, file_id):
+    '''
+    Returns the paths of the per-file outputs a stage may write for one file ID. Which of them are written depends on the
+    data (e.g. no trimmed file for a file without valid days), so only the ones that exist are recorded.
+    '''
+    summary_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'))
+    trimmed = io_formats.resolving_path(config, os.path.join(summary_path, config.get('individual_trimmed_f'), config.get('time_res_folder'), f"{file_id}_TRIMMED_{config.get('count_prefixes')}.csv"))
+    summary = os.path.join(summary_path, config.get('individual_sum_f'), config.get('time_res_folder'), f"{file_id}_{config.get('sum_overall_means')}.csv")
+    daily = os.path.join(summary_path, config.get('individual_daily_f'), config.get('time_res_folder'), f"{file_id}_{config.get('day_overall_mean')}.csv")
+
+    if stage == 'generic_exh_postprocessing':
+        return [part_proc_path(config, file_id)]
+    if stage == 'collapse_trimmed':
+        return [trimmed]
+    if stage == 'collapse_summary':
+        return [trimmed, summary]
+    if stage == 'collapse_daily':
+        return [trimmed, daily]
+    if stage == 'fused_pipeline':
+        return [part_proc_path(config, file_id), trimmed, summary, daily]
+    raise ValueError(f"No outputs defined for stage {stage}")
+
+
+# --- PATH TO THE MANIFEST RECORD OF ONE FILE ID --- #
+def record_path(config, stage, file_id):
+    return os.path.join(config.get('root_folder'), config.get('log_folder'), 'manifest', stage, f"{file_id}.json")
+
+
+# --- READING THE MANIFEST RECORD OF ONE FILE ID --- #
+def reading_record(config, stage, file_id):
+    path = record_path(config, stage, file_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except ValueError:
+        # A damaged record is treated as missing, the file ID is then processed again
+        return None
+
+
+def removing_record(config, stage, file_id):
+    path = record_path(config, stage, file_id)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# --- HASHING ONE INPUT FILE --- #
+def hashing_file(path, previous=None):
+    '''
+    Returns size, modification time and sha256 of a file. The hash is reused from the previous record (or from this process)
+    if size and modification time are unchanged, so unchanged inputs are not read again.
+    :param path: Path to the file
+    :param previous: The entry for this path in the previous manifest record, if any
+    :return: Dictionary with size, mtime_ns and sha256, or None if the file does not exist
+    '''
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        _hash_cache[key] = previous['sha256']
+    if key not in _hash_cache:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                sha.update(block)
+        _hash_cache[key] = sha.hexdigest()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': _hash_cache[key]}
+
+
+# --- FINGERPRINT OF THE INPUTS AND CONFIG OF A STAGE --- #
+def fingerprint(config, stage, input_paths, previous=None):
+    '''
+    :param config: The loaded config
+    :param stage: Stage name as used in STAGE_CONFIG_KEYS
+    :param input_paths: Paths of the input files
+    :param previous: The previous manifest record, if any (used to avoid rehashing unchanged files)
+    :return: fingerprint (sha256 hex string), dictionary of input file hashes
+    '''
+    previous_inputs = (previous or {}).get('inputs', {})
+    inputs = {path: hashing_file(path, previous_inputs.get(path)) for path in input_paths}
+    stage_config = {key: config.get(key) for key in STAGE_CONFIG_KEYS[stage]}
+    content = json.dumps({'inputs': {path: (entry or {}).get('sha256') for path, entry in inputs.items()}, 'config': stage_config}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest(), inputs
+
+
+# --- CHECKING IF A FILE ID CAN BE SKIPPED --- #
+def up_to_date(config, stage, file_id, input_paths=None):
+    '''
+    A file ID is up to date if its fingerprint matches the manifest record and the outputs in the record (at least one) still exist.
+    :return: True if the stage can skip this file ID
+    '''
+    previous = reading_record(config, stage, file_id)
+    if previous is None:
+        return False
+    if input_paths is None:
+        input_paths = stage_inputs(config, stage, file_id)
+    current, _ = fingerprint(config, stage, input_paths, previous)
+    outputs = previous.get('outputs', [])
+    return current == previous.get('fingerprint') and len(outputs) > 0 and all(os.path.exists(path) for path in outputs)
+
+
+# --- RECORDING A PROCESSED FILE ID --- #
+def recording(config, stage, file_id, output_paths, input_paths=None):
+    '''
+    Writes the manifest record for a file ID once the stage has finished it. The record is written to a temporary file
+    and renamed, so a task that is killed part way never leaves a half written record.
+    :param config: The loaded config
+    :param stage: Stage name as used in STAGE_CONFIG_KEYS
+    :param file_id: The file ID (or release level)
+    :param output_paths: Output files of the stage; only those that exist are recorded
+    :param input_paths: Paths of the input files, defaults to stage_inputs()
+    '''
+    if input_paths is None:
+        input_paths = stage_inputs(config, stage, file_id)
+    current, inputs = fingerprint(config, stage, input_paths, reading_record(config, stage, file_id))
+    record = {
+        'stage': stage,
+        'file_id': file_id,
+        'fingerprint': current,
+        'inputs': inputs,
+        'outputs': [path for path in output_paths if os.path.exists(path)],
+        'completed': datetime.now().isoformat(timespec='seconds'),
+    }
+    path = record_path(config, stage, file_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as file:
+        json.dump(record, file, indent=1)
+    os.replace(temporary_path, path)
+
+
+# --- SKIPPING AND RECORDING FILE IDS IN THE PER-FILE STAGES --- #
+def skip_file(config, stage, file_id):
+    '''
+    :return: True if incremental rebuilds are switched on and the file ID is unchanged since the stage last processed it
+    '''
+    if incremental(config) and up_to_date(config, stage, file_id):
+        print(f"{file_id} is unchanged since {stage} last processed it, skipping.")
+        return True
+    return False
+
+
+def record_file(config, stage, file_id):
+    if incremental(config):
+        recording(config, stage, file_id, output_paths=stage_outputs(config, stage, file_id))
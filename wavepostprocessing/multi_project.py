@@ -0,0 +1,169 @@
+############################################################################################################
+# This file submits the pipeline for several projects (config directories) together. The projects are planned one by
+# one, and then each stage is submitted once as an array job holding the tasks of all projects that run that stage, so
+# small projects share the queue wait and the job start up instead of each submitting their own chain of jobs.
+# The outputs of each project stay in that project's own folders.
+#
+# For every stage a mapping file (<mapping_folder>/<stage>.json) lists what each task of the shared array job runs:
+# the stage module, the config directory and the task id within that project. Each task is started as
+#     python -m wavepostprocessing.multi_project <mapping_file> <task_id> <task_count>
+# which looks up its entry and runs the stage module for that project, as submit_wavejobs.sh would.
+# Submitted with: python -m wavepostprocessing.cli multi <directory> <directory> ...
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import sys
+import json
+import runpy
+from datetime import datetime
+from wavepostprocessing.config import load_config, print_message
+from wavepostprocessing.pipeline import STAGES
+from wavepostprocessing.planning import plan_pipeline
+from wavepostprocessing.batch_processing import submit_jobs
+from wavepostprocessing.job_sizing import job_resources
+
+
+# --- COMPARING TIME AND MEMORY REQUESTS --- #
+def time_seconds(time):
+    parts = [int(part) for part in time.replace('-', ':').split(':')]
+    if '-' in time:
+        # days-hours:minutes:seconds
+        parts = [parts[0] * 24 + parts[1]] + parts[2:]
+    while len(parts) < 3:
+        parts = [0] + parts
+    hours, minutes, seconds = parts[-3:]
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def memory_mb(mem):
+    units = {'K': 1 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+    mem = str(mem).upper()
+    if mem[-1] in units:
+        return float(mem[:-1]) * units[mem[-1]]
+    return float(mem)
+
+
+# --- PLANNING ALL PROJECTS --- #
+def planning_projects(directories):
+    '''
+    :param directories: Config directories of the projects
+    :return: List of (directory, config, plan) for the projects with any work to do
+    '''
+    projects = []
+    for directory in directories:
+        config = load_config(directory)
+        plan = plan_pipeline(config)
+        name = config.get('project', directory)
+        if plan['file_ids'] is not None:
+            print_message(f"{name}: {len(plan['file_ids'])} files to process in {plan['num_filelist']} chunks.")
+        if not plan['stages']:
+            print_message(f"{name}: nothing to submit.")
+            continue
+        projects.append((os.path.abspath(directory), config, plan))
+    return projects
+
+
+# --- PACKING THE TASKS OF ALL PROJECTS INTO ONE ARRAY JOB PER STAGE --- #
+def packing_tasks(projects, stage):
+    '''
+    :return: List of mapping entries, one per task of the shared array job
+    '''
+    entries = []
+    for directory, config, plan in projects:
+        if stage['name'] not in plan['stages']:
+            continue
+        arrsize = plan['num_filelist'] if stage['per_file'] else 1
+        environment = {'WAVEPP_LEVEL': stage['level']} if 'level' in stage else {}
+        for task_id in range(1, arrsize + 1):
+            entries.append({'module': stage['module'], 'directory': directory, 'task_id': task_id, 'task_count': arrsize, 'environment': environment})
+    return entries
+
+
+def shared_resources(projects, stage, time=None, mem=None):
+    '''
+    The shared array job requests what the most demanding project needs for this stage.
+    :return: time and memory (either may be None)
+    '''
+    times = []
+    mems = []
+    for directory, config, plan in projects:
+        if stage['name'] not in plan['stages']:
+            continue
+        project_time, project_mem = job_resources(stage['module'], config, plan['num_filelist'] if stage['per_file'] else 1, time=time, mem=mem, file_ids=plan['file_ids'])
+        if project_time:
+            times.append(project_time)
+        if project_mem:
+            mems.append(project_mem)
+    return max(times, key=time_seconds, default=None), max(mems, key=memory_mb, default=None)
+
+
+# --- SUBMITTING ALL PROJECTS --- #
+def submit_projects(directories, mapping_folder=None, time=None, mem=None, **submit_options):
+    '''
+    Plans all projects and submits each stage once for all of them, with an afterok dependency on the shared jobs of its
+    upstream stages (stages no project runs pass their own upstream jobs on, as in submit_pipeline).
+    :param directories: Config directories of the projects
+    :param mapping_folder: Folder for the mapping files, on a filesystem the compute nodes can read. Defaults to wavepp_multi/<date_time> in the current directory
+    :param time: Wall time per array task, overrides the estimates
+    :param mem: Memory per array task, overrides the estimates
+    :param submit_options: Passed on to submit_jobs (budgacc, executor, workers)
+    :return: Dictionary with the job id of each submitted stage
+    '''
+    projects = planning_projects(directories)
+    if not projects:
+        return {}
+
+    mapping_folder = os.path.abspath(mapping_folder or os.path.join('wavepp_multi', datetime.now().strftime('%Y%m%d_%H%M%S')))
+    os.makedirs(mapping_folder, exist_ok=True)
+
+    job_ids = {}
+    submitted = {}
+    for stage in STAGES:
+        upstream = []
+        for name in stage['depends_on']:
+            upstream += [jid for jid in job_ids.get(name, []) if jid not in upstream]
+
+        entries = packing_tasks(projects, stage)
+        if not entries:
+            job_ids[stage['name']] = upstream
+            continue
+
+        if None in upstream:
+            print(f"Not submitting {stage['name']} as an upstream stage failed.")
+            job_ids[stage['name']] = [None]
+            continue
+
+        mapping_file = os.path.join(mapping_folder, f"{stage['name']}.json")
+        with open(mapping_file, 'w') as file:
+            json.dump(entries, file, indent=1)
+
+        print_message(f"{stage['message']} ({len(entries)} tasks for {len({entry['directory'] for entry in entries})} projects)")
+        stage_time, stage_mem = shared_resources(projects, stage, time=time, mem=mem)
+        jid = submit_jobs('wavepostprocessing.multi_project', mapping_file, arrsize=len(entries), num_cpu=stage['num_cpu'], jid=upstream or None,
+                          time=stage_time, mem=stage_mem, dependency='afterok', **submit_options)
+        submitted[stage['name']] = jid
+        job_ids[stage['name']] = [jid]
+
+    return submitted
+
+
+# --- RUNNING ONE TASK OF A SHARED ARRAY JOB --- #
+def dispatching_task(mapping_file, task_id):
+    with open(mapping_file, 'r') as file:
+        entry = json.load(file)[int(task_id) - 1]
+
+    print(f"Task {task_id} of {mapping_file}: {entry['module']} for {entry['directory']}, task {entry['task_id']} of {entry['task_count']}")
+    os.environ.update(entry['environment'])
+    os.environ['SLURM_ARRAY_TASK_ID'] = str(entry['task_id'])
+    os.environ['SLURM_ARRAY_TASK_COUNT'] = str(entry['task_count'])
+    sys.argv = [entry['module'], entry['directory'], str(entry['task_id']), str(entry['task_count'])]
+    runpy.run_module(entry['module'], run_name='__main__', alter_sys=True)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 3:
+        print("Error: No mapping file and task id provided.")
+        sys.exit(1)
+
+    dispatching_task(sys.argv[1], sys.argv[2])
@@ -0,0 +1,104 @@
+############################################################################################################
+# This file describes the postprocessing pipeline as a graph of stages and submits it.
+# Stages that do not depend on each other (e.g. the summary, daily and hourly appends, or the verification checks and
+# the release files) are submitted as separate jobs sharing the same upstream dependency, instead of one linear chain.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+from wavepostprocessing.config import print_message
+from wavepostprocessing.batch_processing import submit_jobs
+
+# --- STAGE GRAPH --- #
+# name: Name of the stage, used in depends_on
+# module: Module run by the job
+# run_keys: The stage runs if any of these config keys is set to Yes
+# skip_keys: The stage does not run if any of these config keys is set to Yes (e.g. when a fused stage does its work)
+# processing: Only run for output from this processing (wave or pampro), if given
+# per_file: True if the stage runs as an array job over the filelist chunks, False if it runs as a single task
+# needs_files: The stage has nothing to do if there are no file IDs to process (used when planning the submission)
+# level: Restricts the module to one level (summary, daily or hourly) through the WAVEPP_LEVEL environment variable
+# depends_on: Stages that have to finish successfully first. If an upstream stage is not run, the stage depends on that stage's upstream instead
+STAGES = [
+    {'name': 'merge_metafiles', 'module': 'wavepostprocessing.pampro_merge_metafiles', 'message': "Merging Metafiles",
+     'run_keys': ['run_pampro_merge_metafiles'], 'processing': 'pampro', 'per_file': False, 'num_cpu': 1, 'depends_on': []},
+    {'name': 'collate_anomalies', 'module': 'wavepostprocessing.pampro_collate_anomalies', 'message': "Collating Anomalies",
+     'run_keys': ['run_pampro_collate_anomalies'], 'processing': 'pampro', 'per_file': False, 'num_cpu': 1, 'depends_on': ['merge_metafiles']},
+    {'name': 'filelist_generation', 'module': 'wavepostprocessing.filelist_generation', 'message': "Creating Filelist",
+     'run_keys': ['run_filelist_generation'], 'needs_files': True, 'per_file': False, 'num_cpu': 1, 'depends_on': ['collate_anomalies']},
+    {'name': 'exhaustive', 'module': 'wavepostprocessing.generic_exh_postprocessing', 'message': "Running Generic Exhaustive Postprocessing",
+     'run_keys': ['run_generic_exh_postprocessing'], 'skip_keys': ['run_fused_pipeline'], 'needs_files': True, 'per_file': True, 'num_cpu': 1, 'depends_on': ['filelist_generation']},
+    {'name': 'collapse', 'module': 'wavepostprocessing.collapse_results', 'message': "Collapsing Results",
+     'run_keys': ['run_collapse_results_to_summary', 'run_collapse_results_to_daily', 'run_create_trimmed_file'], 'skip_keys': ['run_fused_pipeline'], 'needs_files': True, 'per_file': True, 'num_cpu': 1, 'depends_on': ['exhaustive']},
+    {'name': 'fused', 'module': 'wavepostprocessing.fused_pipeline', 'message': "Running Postprocessing and Collapsing Results Per File",
+     'run_keys': ['run_fused_pipeline'], 'needs_files': True, 'per_file': True, 'num_cpu': 1, 'depends_on': ['filelist_generation']},
+    {'name': 'append_summary', 'module': 'wavepostprocessing.appending_files', 'message': "Appending Summary Files", 'level': 'summary',
+     'run_keys': ['run_append_summary_files'], 'per_file': False, 'num_cpu': 1, 'depends_on': ['collapse', 'fused']},
+    {'name': 'append_daily', 'module': 'wavepostprocessing.appending_files', 'message': "Appending Daily Files", 'level': 'daily',
+     'run_keys': ['run_append_daily_files'], 'per_file': False, 'num_cpu': 1, 'depends_on': ['collapse', 'fused']},
+    {'name': 'append_hourly', 'module': 'wavepostprocessing.appending_files', 'message': "Appending Hourly/Minute Level Files", 'level': 'hourly',
+     'run_keys': ['run_append_hourly_files', 'run_append_minute_level_files'], 'per_file': False, 'num_cpu': 1, 'depends_on': ['collapse', 'fused']},
+    {'name': 'verification', 'module': 'wavepostprocessing.verification_checks', 'message': "Running Verification Checks",
+     'run_keys': ['run_verification_checks'], 'per_file': False, 'num_cpu': 1, 'depends_on': ['append_summary', 'append_daily', 'append_hourly']},
+    {'name': 'release_summary', 'module': 'wavepostprocessing.prepare_releases', 'message': "Preparing Summary Release File", 'level': 'summary',
+     'run_keys': ['run_prepare_summary_release'], 'per_file': False, 'num_cpu': 3, 'depends_on': ['append_summary']},
+    {'name': 'release_daily', 'module': 'wavepostprocessing.prepare_releases', 'message': "Preparing Daily Release File", 'level': 'daily',
+     'run_keys': ['run_prepare_daily_release'], 'per_file': False, 'num_cpu': 3, 'depends_on': ['append_daily']},
+    {'name': 'release_hourly', 'module': 'wavepostprocessing.prepare_releases', 'message': "Preparing Hourly/Minute Level Release File", 'level': 'hourly',
+     'run_keys': ['run_prepare_hourly_release', 'run_prepare_minute_level_release'], 'per_file': False, 'num_cpu': 3, 'depends_on': ['append_hourly']},
+]
+
+
+# --- CHECKING IF A STAGE IS SWITCHED ON IN THE CONFIG FILE --- #
+def stage_enabled(stage, config):
+    if 'processing' in stage and config.get('processing').lower() != stage['processing']:
+        return False
+    if any(config.get(key, 'No').lower() == 'yes' for key in stage.get('skip_keys', [])):
+        return False
+    return any(config.get(key, 'No').lower() == 'yes' for key in stage['run_keys'])
+
+
+# --- SUBMITTING ALL STAGES OF THE GRAPH --- #
+def submit_pipeline(config, directory, num_filelist, pipeline_chunks=False, stages=None, environment=None, **submit_options):
+    '''
+    Submits every enabled stage, in graph order, with an afterok dependency on the jobs of its upstream stages.
+    A stage whose upstream job could not be submitted (or failed, with the local executor) is not submitted.
+    :param config: The loaded config
+    :param directory: Directory containing config.json
+    :param num_filelist: Number of array tasks for the per-file stages
+    :param pipeline_chunks: Let chunk i of the collapse start as soon as chunk i of the exhaustive postprocessing is done (aftercorr)
+    :param stages: Names of the stages to submit (if enabled in the config), defaults to all stages
+    :param environment: Environment variables set for every job (e.g. WAVEPP_FILELIST_PREFIX when resubmitting quarantined files)
+    :param submit_options: Passed on to submit_jobs (budgacc, executor, workers, time, mem)
+    :return: Dictionary with the job ids of each stage
+    '''
+    job_ids = {}
+    submitted = {}
+    for stage in STAGES:
+        # Jobs this stage has to wait for. Stages that are not run pass their own upstream jobs on.
+        upstream = []
+        for name in stage['depends_on']:
+            upstream += [jid for jid in job_ids.get(name, []) if jid not in upstream]
+
+        if not stage_enabled(stage, config) or (stages is not None and stage['name'] not in stages):
+            job_ids[stage['name']] = upstream
+            continue
+
+        if None in upstream:
+            print(f"Not submitting {stage['name']} as an upstream stage failed.")
+            job_ids[stage['name']] = [None]
+            continue
+
+        # Chunk i of the collapse only needs chunk i of the exhaustive postprocessing (not possible with the work queue, where chunks are not fixed)
+        dependency = 'afterok'
+        if stage['name'] == 'collapse' and pipeline_chunks and upstream == [submitted.get('exhaustive')] and config.get('use_work_queue', 'No').lower() != 'yes':
+            dependency = 'aftercorr'
+
+        print_message(stage['message'])
+        stage_environment = dict(environment or {})
+        if 'level' in stage:
+            stage_environment['WAVEPP_LEVEL'] = stage['level']
+        jid = submit_jobs(stage['module'], directory, arrsize=num_filelist if stage['per_file'] else 1, num_cpu=stage['num_cpu'], jid=upstream or None,
+                          config=config, dependency=dependency, environment=stage_environment or None, **submit_options)
+        submitted[stage['name']] = jid
+        job_ids[stage['name']] = [jid]
+
+    return submitted
@@ -0,0 +1,109 @@
+############################################################################################################
+# This file works out, before anything is submitted, which file IDs are to be processed, how many filelist chunks are
+# needed and which stages have any work to do. Stages without work (e.g. everything after filelist generation when
+# there are no new files) are then not submitted at all, instead of being queued behind a job that has nothing to do.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import re
+from wavepostprocessing.pipeline import STAGES, stage_enabled
+from wavepostprocessing.job_sizing import auto_num_filelist, number_of_filelists
+from wavepostprocessing.work_queue import reading_queue
+
+
+# --- FILES IN THE RESULTS FOLDER WHEN FILELIST GENERATION RUNS --- #
+def expected_results_files(config):
+    '''
+    Lists the csv files in the results folder, as filelist_generation lists them. If the pampro metafiles are still to be
+    merged, the metadata_{id}.csv files that merging will create are included.
+    :param config: The loaded config
+    :return: List of file names
+    '''
+    results_path = os.path.join(config.get('root_folder'), config.get('results_folder'))
+    file_names = sorted(name for name in os.listdir(results_path) if name.endswith('csv'))
+
+    merge_stage = next(stage for stage in STAGES if stage['name'] == 'merge_metafiles')
+    if stage_enabled(merge_stage, config):
+        # Same rule as pampro_merge_metafiles.list_files: meta files other than metadata_*, named <type>meta_<id>.csv
+        for name in file_names:
+            if 'meta' in name and not name.startswith('metadata'):
+                file_id = re.split(r'(?<=meta)', name, maxsplit=1)[1].lstrip('_').replace('.csv', '')
+                if f"metadata_{file_id}.csv" not in file_names:
+                    file_names.append(f"metadata_{file_id}.csv")
+    return file_names
+
+
+# --- FILE IDS TO BE PROCESSED BY THE PER-FILE STAGES --- #
+def planned_file_ids(config):
+    '''
+    :param config: The loaded config
+    :return: List of file IDs, or None if they cannot be known before submission
+    '''
+    if config.get('run_filelist_generation', 'No').lower() == 'yes':
+        # Importing here, as filelist_generation needs pandas and keeps the config in a module variable
+        import wavepostprocessing.filelist_generation as filelist_generation
+        filelist_generation.config = config
+        filelist_df, _ = filelist_generation.select_files(expected_results_files(config))
+        return list(dict.fromkeys(filelist_df['filename_temp']))
+
+    # Filelists from an earlier filelist generation
+    try:
+        return reading_queue(config)
+    except FileNotFoundError:
+        return None
+
+
+# --- NUMBER OF CHUNKS FOR THE PLANNED FILE IDS --- #
+def planned_num_filelist(config, file_ids):
+    '''
+    The number of chunks filelist_generation will write for these file IDs: num_filelist from the config (or the estimate
+    when it is "auto"), but never more chunks than file IDs. Without filelist generation, the existing chunks are used.
+    '''
+    if config.get('run_filelist_generation', 'No').lower() != 'yes' or file_ids is None:
+        return number_of_filelists(config)
+
+    if str(config.get('num_filelist', 10)).lower() == 'auto':
+        results_path = os.path.join(config.get('root_folder'), config.get('results_folder'))
+        data_files = [os.path.join(results_path, f"{config.get('count_prefixes')}_{file_id}.csv") for file_id in file_ids]
+        return auto_num_filelist(config, [os.path.getsize(path) if os.path.exists(path) else 0 for path in data_files])
+    return max(1, min(int(config.get('num_filelist', 10)), len(file_ids)))
+
+
+# --- PLANNING THE SUBMISSION --- #
+def plan_pipeline(config):
+    '''
+    Decides which of the enabled stages have work to do:
+    - stages that need files (filelist generation and the per-file stages) have no work if there are no file IDs to process,
+    - a stage has no work if all the enabled stages it depends on have no work.
+    Stages that are not enabled pass the state of their own upstream stages on, as in submit_pipeline.
+    :param config: The loaded config
+    :return: Dictionary with file_ids (None if not known), num_filelist, stages (names of the stages to submit) and skipped (names of enabled stages without work)
+    '''
+    file_ids = planned_file_ids(config)
+    num_filelist = planned_num_filelist(config, file_ids)
+
+    # 'run': has work, 'skip': enabled but no work, 'none': not enabled and nothing enabled upstream
+    state = {}
+    for stage in STAGES:
+        upstream = [state[name] for name in stage['depends_on']]
+        if 'run' in upstream:
+            upstream_state = 'run'
+        elif 'skip' in upstream:
+            upstream_state = 'skip'
+        else:
+            upstream_state = 'none'
+
+        if not stage_enabled(stage, config):
+            state[stage['name']] = upstream_state
+        elif stage.get('needs_files') and file_ids is not None and len(file_ids) == 0:
+            state[stage['name']] = 'skip'
+        else:
+            state[stage['name']] = 'skip' if upstream_state == 'skip' else 'run'
+
+    enabled = [stage['name'] for stage in STAGES if stage_enabled(stage, config)]
+    return {
+        'file_ids': file_ids,
+        'num_filelist': num_filelist,
+        'stages': [name for name in enabled if state[name] == 'run'],
+        'skipped': [name for name in enabled if state[name] == 'skip'],
+    }
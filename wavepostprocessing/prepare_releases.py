@@ -6,15 +6,16 @@
 ############################################################################################################
 # IMPORTING PACKAGES #
 import os
-
-from numpy.ma.core import angle
-
 import pandas as pd
 from colorama import Fore
 from datetime import date, datetime
 from wavepostprocessing.Housekeeping import filenames_to_remove
 import numpy as np
 from wavepostprocessing.config import load_config, print_message
+from wavepostprocessing import manifest
+from wavepostprocessing.telemetry import timed
+from wavepostprocessing.schemas import reading_csv
+from wavepostprocessing import hourly_dataset
 #from config import load_config, print_message
 import sys
 
@@ -22,6 +23,7 @@ import sys
 # --- IMPORTING AND FORMATTING SUMMARY RESULTS FILE --- #
 #########################################################
 
+@timed
 def formatting_file(import_file_name, release_level, pwear, pwear_morning, pwear_quad, print_message, output_filename):
     # Make release directories if not already present
     try:
@@ -30,10 +32,17 @@ def formatting_file(import_file_name, release_level, pwear, pwear_morning, pwear
         pass
 
     file_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'), import_file_name)
-    if os.path.exists(file_path):
+    read_dataset = release_level == 'hourly' and hourly_dataset.use_dataset(config)
+    if read_dataset:
+        file_path = hourly_dataset.metadata_path(config)
+    if os.path.exists(file_path) and read_dataset:
+        # The hourly/minute level file kept as a Parquet dataset, the files removed by housekeeping are not read in
+        exclude = ('id', config.get('filenames_to_remove')) if config.get('run_housekeeping').lower() == 'yes' else None
+        df = hourly_dataset.reading_dataset(config, exclude=exclude, text=['subject_code'])
+    elif os.path.exists(file_path):
         #change from early Jan to the current version
         #df = pd.read_csv(file_path)
-        df = pd.read_csv(file_path, dtype={'subject_code': str})        
+        df = reading_csv(config, file_path, release_level, text=['subject_code'])
     else:
         print(f"The file {file_path} does not exist. The release on {release_level} level could not be prepared.")
         df = pd.DataFrame()
@@ -357,6 +366,26 @@ def formatting_file(import_file_name, release_level, pwear, pwear_morning, pwear
     return df
 
 
+# --- PATHS OF THE RELEASE FILE AND DATA DICTIONARY WRITTEN FOR ONE RELEASE LEVEL --- #
+def release_outputs(output_filename):
+    release_path = os.path.join(config.get('root_folder'), config.get('releases_folder'), config.get('pc_date'))
+    return [os.path.join(release_path, f"{output_filename}_FINAL_{date.today().strftime('%d%b%Y')}.csv"),
+            os.path.join(release_path, f'Data_Dict_{output_filename}.csv')]
+
+
+# --- CHECKING IF THE RELEASE FILE FOR ONE LEVEL HAS TO BE PREPARED AGAIN --- #
+def release_unchanged(release_level):
+    '''
+    With incremental_rebuild switched on, a release is only prepared again if the appended file it is made from or the
+    config keys it depends on (e.g. the pwear thresholds of that level) have changed.
+    '''
+    if manifest.incremental(config) and manifest.up_to_date(config, f'release_{release_level}', release_level):
+        record = manifest.reading_record(config, f'release_{release_level}', release_level)
+        print(f"The {release_level} release is unchanged since it was prepared on {record['completed']} ({', '.join(record['outputs'])}), skipping.")
+        return True
+    return False
+
+
 ####################################
 # --- CREATING DATA DICTIONARY --- #
 ####################################
@@ -666,25 +695,32 @@ if __name__ == '__main__':
     # Now you can use config values inside your script
     config["pc_date"] = datetime.utcnow().isoformat()
 
+    # When submitted as one branch of the stage graph, only the level given in WAVEPP_LEVEL is prepared
+    level = os.environ.get('WAVEPP_LEVEL')
+
     # Preparing summary release file
-    if config.get('run_prepare_summary_release').lower() == 'yes':
+    if config.get('run_prepare_summary_release').lower() == 'yes' and level in (None, 'summary') and not release_unchanged('summary'):
         print_message("PREPARING A SUMMARY RELEASE FILE")
 
         summary_df = formatting_file(import_file_name=f"{config.get('sum_output_file')}.csv", release_level='summary',
                                      pwear=config.get('sum_pwear'), pwear_morning=config.get('sum_pwear_morning'), pwear_quad=config.get('sum_pwear_quad'), print_message='files/IDs',
                                      output_filename=config.get('sum_output_file'))
         data_dictionary(df=summary_df, filename=config.get('sum_output_file'), release_level='summary', pwear=config.get('sum_pwear'), pwear_quad=config.get('sum_pwear_quad'), append_level='summary')
+        if manifest.incremental(config):
+            manifest.recording(config, 'release_summary', 'summary', output_paths=release_outputs(config.get('sum_output_file')))
 
     # Preparing daily release file
-    if config.get('run_prepare_daily_release').lower() == 'yes':
+    if config.get('run_prepare_daily_release').lower() == 'yes' and level in (None, 'daily') and not release_unchanged('daily'):
         print_message("PREPARING A DAILY RELEASE FILE")
         daily_df = formatting_file(import_file_name=f"{config.get('day_output_file')}.csv", release_level='daily',
                                    pwear=config.get('day_pwear'), pwear_morning=config.get('day_pwear_morning'), pwear_quad=config.get('day_pwear_quad'), print_message='rows of data',
                                    output_filename=config.get('day_output_file'))
         data_dictionary(df=daily_df, filename=config.get('day_output_file'), release_level='daily', pwear=config.get('day_pwear'), pwear_quad=config.get('day_pwear_quad'), append_level='daily')
+        if manifest.incremental(config):
+            manifest.recording(config, 'release_daily', 'daily', output_paths=release_outputs(config.get('day_output_file')))
 
     # Preparing hourly release file
-    if config.get('run_prepare_hourly_release').lower() == 'yes' or config.get('run_prepare_minute_level_release').lower() == 'yes':
+    if (config.get('run_prepare_hourly_release').lower() == 'yes' or config.get('run_prepare_minute_level_release').lower() == 'yes') and level in (None, 'hourly') and not release_unchanged('hourly'):
         if config.get('count_prefixes').lower() == '1h':
              print_message("PREPARING A HOURLY RELEASE FILE")
         if config.get('count_prefixes').lower() == '1m':
@@ -694,5 +730,7 @@ if __name__ == '__main__':
         hourly_df = formatting_file(import_file_name=f"{config.get('hour_output_file')}.csv", release_level='hourly',
                                     pwear=None, pwear_morning=None, pwear_quad=None, print_message='rows of data', output_filename=config.get('hour_output_file'))
         data_dictionary(df=hourly_df, filename=config.get('hour_output_file'), release_level='hourly', pwear=None, pwear_quad=None, append_level='hourly')
+        if manifest.incremental(config):
+            manifest.recording(config, 'release_hourly', 'hourly', output_paths=release_outputs(config.get('hour_output_file')))
 
 
@@ -0,0 +1,180 @@
+############################################################################################################
+# This file keeps a quarantine list of files that failed in one of the per-file stages. A file that raises an error is
+# written to <log_folder>/quarantine/ together with the error, and the task carries on with the rest of its chunk.
+# The quarantined files can be processed again with: python -m wavepostprocessing.cli resubmit <directory>
+# which writes retry filelists and submits a small array job for just those files.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import csv
+import glob
+import json
+import shutil
+import traceback
+from datetime import datetime
+from colorama import Fore
+from wavepostprocessing import checkpoint, manifest, scratch, io_formats
+
+# Prefix of the filelists written for a resubmission. The per-file stages read WAVEPP_FILELIST_PREFIX to pick them up.
+RETRY_PREFIX = 'retry_filelist'
+
+# Per-file stages reading the outputs of another per-file stage
+UPSTREAM_STAGES = {'collapse_trimmed': 'generic_exh_postprocessing', 'collapse_summary': 'generic_exh_postprocessing', 'collapse_daily': 'generic_exh_postprocessing'}
+
+
+# --- PATH TO THE QUARANTINE FOLDER --- #
+def quarantine_folder(config):
+    return os.path.join(config.get('root_folder'), config.get('log_folder'), 'quarantine')
+
+
+# --- PREFIX OF THE FILELISTS THIS TASK READS --- #
+def filelist_prefix():
+    return os.environ.get('WAVEPP_FILELIST_PREFIX', 'filelist')
+
+
+# --- ADDING A FAILED FILE TO THE QUARANTINE LIST --- #
+def quarantine_file(config, stage, file_id, error):
+    '''
+    Records a file that raised an error, so the task can continue with its other files.
+    :param config: The loaded config
+    :param stage: Stage name (e.g. 'generic_exh_postprocessing', 'collapse_summary')
+    :param file_id: The file ID that failed
+    :param error: The exception raised
+    '''
+    print(Fore.RED + f"{stage} failed for {file_id}: {type(error).__name__}: {error}. The file has been quarantined, continuing with the next file." + Fore.RESET)
+    job_id = os.environ.get('SLURM_ARRAY_JOB_ID', os.environ.get('SLURM_JOB_ID', 'interactive'))
+    task_id = os.environ.get('SLURM_ARRAY_TASK_ID', 0)
+    record = {
+        'stage': stage,
+        'file_id': file_id,
+        'error': type(error).__name__,
+        'message': str(error),
+        'traceback': ''.join(traceback.format_exception(type(error), error, error.__traceback__)),
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'job_id': job_id,
+        'task_id': task_id,
+    }
+    os.makedirs(quarantine_folder(config), exist_ok=True)
+    with open(os.path.join(quarantine_folder(config), f"{job_id}_task{task_id}_{os.getpid()}.jsonl"), 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+
+# --- REMOVING THE OUTPUTS OF A FAILED FILE --- #
+def invalidating_outputs(config, stage, file_id):
+    '''
+    Removes the outputs of a file ID that failed, and those of the stages built from them, together with their manifest
+    records. Otherwise the outputs of an earlier run would be collapsed or appended as if they were up to date.
+    '''
+    scratch.discarding_file()
+    stages = [stage] + [downstream for downstream, upstream in UPSTREAM_STAGES.items() if upstream == stage]
+    for invalidated in stages:
+        outputs = manifest.stage_outputs(config, invalidated, file_id)
+        if invalidated == 'collapse_daily' and config.get('run_collapse_results_to_summary', 'No').lower() == 'yes':
+            # The trimmed file was then written by collapse_summary
+            outputs = outputs[1:]
+        for path in outputs:
+            for variant in io_formats.format_variants(path):
+                io_formats.removing_variant(variant)
+        manifest.removing_record(config, invalidated, file_id)
+
+
+def quarantined_ids(config, stage):
+    return {record['file_id'] for record in reading_quarantine(config) if record['stage'] == stage}
+
+
+# --- PROCESSING FILE IDS ONE AT A TIME, QUARANTINING THOSE THAT FAIL --- #
+def processing_with_quarantine(config, stage, task_id, file_ids, step):
+    '''
+    Runs a per-file stage over its file IDs. File IDs finished by an earlier run of the task or unchanged since the stage
+    last processed them are skipped, and a file ID that raises an error is quarantined and its outputs are removed. The
+    collapse stages skip the file IDs quarantined in the postprocessing.
+    :param config: The loaded config
+    :param stage: Stage name (e.g. 'generic_exh_postprocessing', 'collapse_summary')
+    :param task_id: Array task id
+    :param file_ids: List of file IDs, or the work queue
+    :param step: Function processing one file ID
+    :return: Generator of what step returned, for each file ID processed
+    '''
+    upstream = UPSTREAM_STAGES.get(stage)
+    quarantined_upstream = quarantined_ids(config, upstream) if upstream else set()
+    for file_id in checkpoint.remaining(config, stage, file_ids):
+        # The outputs of a file quarantined upstream have been removed, there is nothing to process
+        if file_id in quarantined_upstream and not os.path.exists(manifest.part_proc_path(config, file_id)):
+            print(f"{file_id} was quarantined in {upstream}, skipping.")
+            continue
+        if manifest.skip_file(config, stage, file_id):
+            continue
+        try:
+            result = step(file_id)
+        except Exception as error:
+            # One bad file should not stop the rest of the chunk
+            quarantine_file(config, stage, file_id, error)
+            invalidating_outputs(config, stage, file_id)
+            continue
+        scratch.finishing_file(config, stage, task_id, file_id)
+        yield result
+
+
+# --- READING THE QUARANTINE LIST --- #
+def quarantine_files(config):
+    return sorted(glob.glob(os.path.join(quarantine_folder(config), '*.jsonl')))
+
+
+def reading_quarantine(config):
+    records = []
+    for path in quarantine_files(config):
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+# --- WRITING FILELISTS FOR THE QUARANTINED FILES --- #
+def writing_retry_filelists(config, max_tasks=10):
+    '''
+    Writes retry_filelist.txt (all quarantined file IDs, for the work queue) and retry_filelist{i}.txt (one chunk per array
+    task) in the filelist folder, in the same format as the filelists written by filelist_generation. The quarantine list
+    is kept until the retry has been submitted (see archiving_quarantine).
+    :param config: The loaded config
+    :param max_tasks: Largest number of array tasks to split the files over
+    :return: Number of retry filelists written (0 if nothing is quarantined)
+    '''
+    file_ids = []
+    for record in reading_quarantine(config):
+        if record['file_id'] not in file_ids:
+            file_ids.append(record['file_id'])
+    if not file_ids:
+        return 0
+
+    filelist_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder'))
+    for path in glob.glob(os.path.join(filelist_path, f"{RETRY_PREFIX}*.txt")):
+        os.remove(path)
+
+    num_tasks = min(max_tasks, len(file_ids))
+    chunks = [file_ids[i::num_tasks] for i in range(num_tasks)]
+    for name, chunk in [(RETRY_PREFIX, file_ids)] + [(f"{RETRY_PREFIX}{i}", chunk) for i, chunk in enumerate(chunks)]:
+        with open(os.path.join(filelist_path, f"{name}.txt"), 'w', newline='') as file:
+            writer = csv.writer(file, delimiter='\t')
+            writer.writerow(['filename', 'temp_keep', 'file_type', 'filename_temp', 'id'])
+            for file_id in chunk:
+                for file_type in [config.get('count_prefixes'), 'metadata']:
+                    writer.writerow([f"{file_type}_{file_id}.csv", True, file_type, file_id, file_id.split('_')[0]])
+
+    return num_tasks
+
+
+# --- MOVING THE RESUBMITTED RECORDS OUT OF THE QUARANTINE LIST --- #
+def archiving_quarantine(config, paths):
+    '''
+    Moves the quarantine records that have been resubmitted to a dated subfolder, so files that fail again show up on their own.
+    :param config: The loaded config
+    :param paths: The record files read for the resubmission (records written since, by the retry jobs, are kept)
+    '''
+    retried_folder = os.path.join(quarantine_folder(config), f"retried_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(retried_folder, exist_ok=True)
+    for path in paths:
+        if os.path.exists(path):
+            shutil.move(path, retried_folder)
@@ -0,0 +1,141 @@
+############################################################################################################
+# This file processes one file ID again in this process, without filelists or SLURM jobs: merging its pampro metafiles,
+# the generic exhaustive postprocessing and collapse (as fused_pipeline does), and replacing its rows in the appended
+# summary, daily and hourly/minute level output files. Used to redo one participant after e.g. a change to the
+# housekeeping or corruption conditions, with: python -m wavepostprocessing.cli run-one <directory> <file_id>
+# The release files are not changed, they have to be prepared again to include the new rows. The hourly/minute level
+# file is only rewritten in part if it is kept as a Parquet dataset (hourly_output_format), a csv file is rewritten in full.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import time
+from wavepostprocessing.config import load_config, print_message
+from wavepostprocessing import manifest, hourly_dataset
+from wavepostprocessing.io_formats import format_variants, sidecar_path
+import wavepostprocessing.fused_pipeline as fused
+import wavepostprocessing.pampro_merge_metafiles as merge_metafiles
+import wavepostprocessing.appending_files as appending
+
+
+# --- MERGING THE PAMPRO METAFILES OF ONE FILE ID --- #
+def merging_metafiles(file_id):
+    merge_metafiles.config = config
+    groups = [(group_id, group) for group_id, group in merge_metafiles.list_files() if group_id == file_id]
+    # merge_meta skips IDs that already have a metadata file, the one from the previous run is set aside so it is merged again
+    metadata_path = os.path.join(config.get('root_folder'), config.get('results_folder'), f"metadata_{file_id}.csv")
+    set_aside = setting_aside([metadata_path])
+    try:
+        merge_metafiles.merge_meta(groups, ['analysis_meta', 'file_meta', 'qc_meta'])
+    except Exception:
+        putting_back(set_aside)
+        raise
+    if os.path.exists(metadata_path):
+        removing_set_aside(set_aside)
+    else:
+        # A metafile is missing, keeping the metadata file of the previous run
+        putting_back(set_aside)
+
+
+# --- SETTING FILES OF THE PREVIOUS RUN ASIDE UNTIL THE NEW ONES ARE WRITTEN --- #
+def setting_aside(paths):
+    '''
+    Renames files of the previous run (in whichever format they were written), so they can be put back if processing fails.
+    :return: List of the paths that were set aside
+    '''
+    set_aside = existing_variants(paths)
+    for path in set_aside:
+        os.replace(path, f"{path}.previous")
+    return set_aside
+
+
+def existing_variants(paths):
+    return [variant for path in paths for variant in dict.fromkeys(format_variants(path) + [sidecar_path(path)]) if os.path.exists(variant)]
+
+
+def putting_back(set_aside):
+    for path in set_aside:
+        os.replace(f"{path}.previous", path)
+
+
+def removing_set_aside(set_aside):
+    for path in set_aside:
+        os.remove(f"{path}.previous")
+
+
+def individual_files(file_id):
+    # The trimmed, summary and daily files; a file that no longer has valid data must not keep the old ones
+    return manifest.stage_outputs(config, 'fused_pipeline', file_id)[1:]
+
+
+# --- APPENDED OUTPUT FILES SWITCHED ON IN THE CONFIG FILE --- #
+def appended_levels(config, file_id):
+    '''
+    :return: List of (append level, individual folder, individual file name of the file ID, appended output file)
+    '''
+    levels = []
+    if config.get('run_append_summary_files', 'No').lower() == 'yes':
+        levels.append(('summary', config.get('individual_sum_f'), f"{file_id}_{config.get('sum_overall_means')}.csv", config.get('sum_output_file')))
+    if config.get('run_append_daily_files', 'No').lower() == 'yes':
+        levels.append(('daily', config.get('individual_daily_f'), f"{file_id}_{config.get('day_overall_mean')}.csv", config.get('day_output_file')))
+    if config.get('run_append_hourly_files', 'No').lower() == 'yes' or config.get('run_append_minute_level_files', 'No').lower() == 'yes':
+        levels.append(('hourly', config.get('individual_trimmed_f'), f"{file_id}_TRIMMED_{config.get('count_prefixes')}.csv", config.get('hour_output_file')))
+    return levels
+
+
+# --- REPLACING THE ROWS OF THE FILE ID IN THE APPENDED OUTPUT FILES --- #
+def patching_outputs(file_id):
+    '''
+    :return: Dictionary with the number of rows removed and added for each appended output file that was changed
+    '''
+    appending.config = config
+    patched = {}
+    for append_level, folder, individual_file_name, output_file in appended_levels(config, file_id):
+        if append_level == 'hourly' and not hourly_dataset.use_dataset(config):
+            print(f"{output_file} is a csv file, it is read and written again in full to replace the rows of {file_id}. "
+                  "Set hourly_output_format to parquet_dataset to only rewrite the rows of this file ID.")
+        patched[output_file] = appending.patching_output(file_id, folder, individual_file_name, output_file, append_level)
+    return patched
+
+
+# --- PROCESSING ONE FILE ID --- #
+def run_one(directory, file_id, patch=True):
+    '''
+    :param directory: Directory containing config.json
+    :param file_id: The file ID to process again
+    :param patch: Replace the rows of the file ID in the appended output files; off when they are appended in full afterwards
+    :return: Dictionary with the number of rows removed and added for each appended output file
+    '''
+    global config
+    config = load_config(directory)
+    started = time.perf_counter()
+
+    if config.get('processing').lower() == 'pampro' and config.get('run_pampro_merge_metafiles', 'No').lower() == 'yes':
+        print_message(f"MERGING METAFILES OF {file_id}")
+        merging_metafiles(file_id)
+
+    print_message(f"POSTPROCESSING AND COLLAPSING {file_id}")
+    fused.binding_config(config)
+    anomalies_df = fused.exh.anomalies() if config.get('processing').lower() == 'pampro' else None
+    # The files of the previous run are only removed once the new ones have been written
+    set_aside = setting_aside(individual_files(file_id))
+    try:
+        fused.fused_file(file_id, anomalies_df)
+    except Exception:
+        # Removing what was written before the error
+        for path in existing_variants(individual_files(file_id)):
+            os.remove(path)
+        putting_back(set_aside)
+        raise
+    removing_set_aside(set_aside)
+    manifest.record_file(config, 'fused_pipeline', file_id)
+    if not patch:
+        print_message(f"{file_id} processed in {time.perf_counter() - started:.1f} s.")
+        return {}
+
+    print_message(f"REPLACING THE ROWS OF {file_id} IN THE APPENDED FILES")
+    patched = patching_outputs(file_id)
+    for output_file, (removed, added) in patched.items():
+        print(f"{output_file}: {removed} rows removed, {added} rows added")
+
+    print_message(f"{file_id} processed in {time.perf_counter() - started:.1f} s. Prepare the release files again to include the new rows.")
+    return patched
@@ -0,0 +1,195 @@
+############################################################################################################
+# This file holds the schema of each kind of csv file the package reads (metadata, 1h/1m data, part processed,
+# summary, daily and hourly/minute level files):
+# - the columns holding dates, times or IDs that must be kept as text, whatever they look like,
+# - the columns each stage uses, so that the others are not parsed at all,
+# - with compact_dtypes switched on in the config file, the ENMO/HPFVM threshold columns are read as float32 and the
+#   text repeated on every row (device, calibration method) as categoricals. This halves the memory of the threshold
+#   columns, but the means calculated from them can differ in the last digits, so it is off by default.
+# The files are parsed with the pyarrow csv reader if pyarrow is installed, otherwise (or if pyarrow cannot parse the
+# file) with the pandas csv reader.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import io
+import csv
+import re
+import numpy as np
+import pandas as pd
+
+# --- COLUMNS KEPT AS TEXT --- #
+# Dates and times are parsed by the stages themselves, with their own formats
+DATE_COLUMNS = ['timestamp', 'DATETIME', 'DATETIME_ORIG', 'DATETIME_COPY', 'DATE', 'TIME', 'generic_first_timestamp', 'generic_last_timestamp',
+                'first_file_timepoint', 'last_file_timepoint', 'startdate', 'enddate']
+
+# --- COLUMNS READ COMPACTLY WITH COMPACT_DTYPES --- #
+# ENMO/HPFVM threshold columns, e.g. ENMO_30plus and enmo_30plus, or ENMO_30_99999 in the data files
+THRESHOLD_COLUMN = re.compile(r'^(enmo|hpfvm)_\d+(plus|_\d+)$', re.IGNORECASE)
+# Text repeated on every row of a file
+CATEGORICAL_COLUMNS = ['device', 'calibration_method', 'calibration_type', 'processing_script']
+
+# Strings read as missing, the same as the pandas csv reader
+NULL_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN',
+               'None', 'n/a', 'nan', 'null']
+
+
+# --- COLUMNS EACH STAGE USES --- #
+def metadata_columns(config):
+    '''
+    :return: The metadata variables kept by generic_exh_postprocessing
+    '''
+    columns = ['file_id', 'subject_code', 'device', 'calibration_method', 'noise_cutoff_mg', 'processing_epoch', 'generic_first_timestamp', 'generic_last_timestamp',
+               'QC_first_battery_pct', 'QC_last_battery_pct', 'frequency']
+    if config.get('processing').lower() == 'wave':
+        columns.extend(['start_error', 'end_error', 'QC_anomalies_total', 'QC_anomaly_A', 'QC_anomaly_B', 'QC_anomaly_C', 'QC_anomaly_D', 'QC_anomaly_E',
+                        'QC_anomaly_F', 'QC_anomaly_G', 'processing_script'])
+    if config.get('processing').lower() == 'pampro':
+        columns.extend(['file_start_error', 'file_end_error', 'days_of_data_processed', 'mf_start_error', 'mf_end_error', 'calibration_type', 'QC_axis_anomaly'])
+    return columns
+
+
+def data_column_used(config, column):
+    # The variables in variables_to_drop are dropped after the columns have been renamed, see reading_datafile
+    renamed = column[:-6] + "plus" if column.endswith("_99999") else column
+    if renamed.lower().startswith("pitch") or renamed.lower().startswith("roll"):
+        renamed = renamed.replace("-", "")
+    return not any(var in renamed for var in config.get('variables_to_drop'))
+
+
+HOURLY_VERIFICATION_COLUMNS = ['id', 'file_id', 'subject_code', 'device', 'timestamp', 'DATETIME_ORIG', 'Pwear', 'dayofweek', 'hourofday', 'minuteofhour',
+                               'QC_anomalies_total', 'FLAG_MECH_NOISE']
+
+
+def hourly_verification_column_used(config, column):
+    return column in HOURLY_VERIFICATION_COLUMNS or column.upper().startswith(('ENMO_', 'PITCH_', 'ROLL_'))
+
+
+# --- SCHEMA OF EACH KIND OF FILE --- #
+# text: columns read as text. categorical/float32: columns read compactly with compact_dtypes.
+# columns: for each stage, a function of (config, column name) telling if the stage uses the column. Stages not listed read all columns.
+SCHEMAS = {
+    'metadata': {'text': DATE_COLUMNS, 'categorical': [], 'float32': False,
+                 'columns': {'generic_exh_postprocessing': lambda config, column: column in metadata_columns(config)}},
+    'data': {'text': DATE_COLUMNS, 'categorical': [], 'float32': True,
+             'columns': {'generic_exh_postprocessing': data_column_used}},
+    'part_proc': {'text': DATE_COLUMNS, 'categorical': CATEGORICAL_COLUMNS, 'float32': True, 'columns': {}},
+    'summary': {'text': DATE_COLUMNS, 'categorical': CATEGORICAL_COLUMNS, 'float32': True, 'columns': {}},
+    'daily': {'text': DATE_COLUMNS, 'categorical': CATEGORICAL_COLUMNS, 'float32': True, 'columns': {}},
+    'hourly': {'text': DATE_COLUMNS, 'categorical': CATEGORICAL_COLUMNS, 'float32': True,
+               'columns': {'verification_checks': hourly_verification_column_used}},
+}
+
+
+def compact_dtypes(config):
+    return config.get('compact_dtypes', 'No').lower() == 'yes'
+
+
+def header_columns(path):
+    with open(path, 'r', newline='') as file:
+        return next(csv.reader(file), [])
+
+
+# --- READING A CSV FILE WITH ITS SCHEMA --- #
+def reading_with_pyarrow(path, usecols, dtypes):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    arrow_types = {str: pa.string(), 'float32': pa.float32(), 'category': pa.dictionary(pa.int32(), pa.string())}
+    column_types = {column: arrow_types[dtype] for column, dtype in dtypes.items()}
+
+    def reading(column_types):
+        convert_options = pa_csv.ConvertOptions(column_types=column_types, include_columns=usecols, null_values=NULL_VALUES, strings_can_be_null=True)
+        # The csv text itself (see reading_back) is read from memory, once for each attempt
+        return pa_csv.read_csv(io.BytesIO(path) if isinstance(path, bytes) else path, convert_options=convert_options)
+
+    table = reading(column_types)
+    # pyarrow turns anything that looks like a date or time into one. Such columns not in the schema are read again as text.
+    temporal = [field.name for field in table.schema if pa.types.is_temporal(field.type)]
+    if temporal:
+        table = reading(dict(column_types, **{column: pa.string() for column in temporal}))
+    # pyarrow reads whole numbers too large for int64 (e.g. 20 digit IDs) as float, losing digits; pandas keeps them exactly
+    if any(pa.types.is_floating(field.type) and field.name not in column_types and too_large(table.column(field.name)) for field in table.schema):
+        raise ValueError("whole numbers too large to be read exactly")
+    return arrow_to_pandas(table)
+
+
+def too_large(column):
+    import pyarrow.compute as pc
+    largest = pc.max(pc.abs(column)).as_py()
+    return largest is not None and largest >= 2 ** 63
+
+
+def arrow_to_pandas(table):
+    '''
+    Turns an Arrow table into a dataframe as the pandas csv reader would return it.
+    '''
+    import pyarrow as pa
+    # Columns without any values are read as float, as pandas does
+    for index, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(index, field.name, table.column(index).cast(pa.float64()))
+
+    df = table.to_pandas()
+    # Missing text is NaN rather than None
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].where(df[column].notna(), np.nan)
+    return df
+
+
+def reading_csv(config, path, kind, stage=None, text=()):
+    '''
+    Reads a csv file with the schema of its kind.
+    :param config: The loaded config
+    :param path: Path to the csv file, or the csv text as bytes
+    :param kind: Kind of file, a key of SCHEMAS
+    :param stage: Stage reading the file; only the columns this stage uses are read
+    :param text: Further columns to read as text (e.g. subject_code, to keep leading zeros)
+    :return: dataframe
+    '''
+    schema = SCHEMAS[kind]
+    header = next(csv.reader(io.StringIO(path.decode())), []) if isinstance(path, bytes) else header_columns(path)
+    column_used = schema['columns'].get(stage)
+    usecols = header if column_used is None else [column for column in header if column_used(config, column)]
+
+    dtypes = {column: str for column in usecols if column in schema['text'] or column in text}
+    if compact_dtypes(config):
+        dtypes.update({column: 'category' for column in usecols if column in schema['categorical'] and column not in dtypes})
+        if schema['float32']:
+            dtypes.update({column: 'float32' for column in usecols if THRESHOLD_COLUMN.match(column) and column not in dtypes})
+
+    try:
+        return reading_with_pyarrow(path, usecols, dtypes)
+    except ImportError:
+        pass
+    except (ValueError, NotImplementedError) as error:
+        print(f"Could not read {'the csv text' if isinstance(path, bytes) else path} with pyarrow ({error}), reading it with pandas instead.")
+    return pd.read_csv(io.BytesIO(path) if isinstance(path, bytes) else path, usecols=None if column_used is None else usecols, dtype=dtypes or None)
+
+
+# --- GIVING A DATAFRAME THE FORM IT HAS WHEN READ BACK FROM A CSV FILE --- #
+def reading_back(config, df, kind):
+    '''
+    Returns the dataframe as reading_csv would return it after it has been written with to_csv, without writing it to
+    disk. Numbers are written and read back exactly, so only the other columns (dates and times, text, true/false with
+    missing values) go through csv text in memory; the numbers only get the compact dtypes of the schema.
+    :param config: The loaded config
+    :param df: The dataframe, as it would be written with to_csv(index=False)
+    :param kind: Kind of file, a key of SCHEMAS
+    :return: dataframe
+    '''
+    df = df.reset_index(drop=True)
+    schema = SCHEMAS[kind]
+    # float32 values are written with fewer digits than float64 ones, so they do not read back exactly
+    numeric = [column for column in df.columns if df[column].dtype in (np.float64, np.int64, np.bool_)
+               and column not in schema['text'] and column not in schema['categorical']]
+    others = [column for column in df.columns if column not in numeric]
+
+    read_back = df[numeric].copy()
+    if compact_dtypes(config) and schema['float32']:
+        for column in numeric:
+            if THRESHOLD_COLUMN.match(column):
+                read_back[column] = read_back[column].astype('float32')
+    if others:
+        text_df = reading_csv(config, df[others].to_csv(index=False).encode(), kind)
+        for column in others:
+            read_back[column] = text_df[column]
+    return read_back[list(df.columns)]
@@ -0,0 +1,234 @@
+############################################################################################################
+# This file stages the input and output files of the per-file stages on node-local scratch ($TMPDIR, or the folder
+# given as local_scratch_folder in the config file), instead of reading and writing every small csv file on the shared
+# project filesystem. Switched on with use_local_scratch in the config file.
+# - Inputs: a background thread copies the input files of the task's file IDs to scratch, a few file IDs ahead of the
+#   one being processed. A file that has not been copied (yet) is read from the shared filesystem.
+# - Outputs: written to scratch, and copied to the shared filesystem by a background thread as soon as the file ID is
+#   finished. Only then is the file ID recorded in the manifest and the progress journal, so a task that is killed
+#   never leaves a file ID marked as finished without its outputs. Anything else written while staging is copied
+#   back when the staging is finished.
+# Without local scratch, or with the work queue (where the file IDs are not known in advance), the stages read and
+# write the shared filesystem directly, as before.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import queue
+import shutil
+import threading
+from wavepostprocessing import manifest, checkpoint, io_formats
+
+# Number of file IDs whose inputs are copied ahead of the one being processed
+PREFETCH_AHEAD = 4
+
+# Staging of the loop currently running in this process, None when reading and writing directly
+_staging = None
+
+
+# --- FOLDER ON NODE-LOCAL SCRATCH --- #
+def local_scratch_folder(config):
+    '''
+    :return: The local scratch folder, or None if there is none that can be written to
+    '''
+    folder = config.get('local_scratch_folder') or os.environ.get('TMPDIR')
+    if not folder or not os.path.isdir(folder) or not os.access(folder, os.W_OK):
+        return None
+    return folder
+
+
+def use_local_scratch(config):
+    return config.get('use_local_scratch', 'No').lower() == 'yes' and config.get('use_work_queue', 'No').lower() != 'yes'
+
+
+# --- INPUT FILES OF ONE FILE ID --- #
+def input_files(config, stage, file_id):
+    results_path = os.path.join(config.get('root_folder'), config.get('results_folder'))
+    if stage in ('generic_exh_postprocessing', 'fused_pipeline'):
+        return [os.path.join(results_path, f"metadata_{file_id}.csv"), os.path.join(results_path, f"{config.get('count_prefixes')}_{file_id}.csv")]
+    part_proc_path = manifest.part_proc_path(config, file_id)
+    if part_proc_path.endswith(io_formats.FORMATS['npy']):
+        # The sidecar is copied first, so it is there once the array is
+        return [io_formats.sidecar_path(part_proc_path), part_proc_path]
+    return [part_proc_path]
+
+
+class Staging:
+    '''
+    Copies of the input and output files of one loop over file IDs, kept in a folder on local scratch.
+    '''
+    def __init__(self, config, stage, task_id, file_ids, folder):
+        self.config = config
+        self.stage = stage
+        self.task_id = task_id
+        self.folder = folder
+        self.inputs = {}
+        self.inputs_of_file = {}
+        for index, file_id in enumerate(file_ids):
+            self.inputs_of_file[file_id] = input_files(config, stage, file_id)
+            for path in self.inputs_of_file[file_id]:
+                self.inputs[path] = {'index': index, 'copied': threading.Event(), 'local': None}
+        self.outputs = []
+        self.consumed_index = -1
+        self.progress = threading.Condition()
+        self.write_back_queue = queue.Queue()
+        self.errors = []
+
+        self.prefetcher = threading.Thread(target=self.prefetching, args=(list(self.inputs),), daemon=True)
+        self.writer = threading.Thread(target=self.writing_back, daemon=True)
+        self.prefetcher.start()
+        self.writer.start()
+
+    def local_path(self, path):
+        return os.path.join(self.folder, os.path.abspath(path).lstrip(os.sep))
+
+    # Copying the inputs, never more than PREFETCH_AHEAD file IDs ahead of the one being processed
+    def prefetching(self, paths):
+        for path in paths:
+            entry = self.inputs[path]
+            with self.progress:
+                self.progress.wait_for(lambda: entry['index'] <= self.consumed_index + PREFETCH_AHEAD)
+                # File IDs the loop has already gone past (e.g. skipped as unchanged) are not copied
+                passed = entry['index'] < self.consumed_index
+            if passed:
+                entry['copied'].set()
+                continue
+            try:
+                if os.path.exists(path):
+                    local = self.local_path(path)
+                    os.makedirs(os.path.dirname(local), exist_ok=True)
+                    shutil.copyfile(path, local)
+                    entry['local'] = local
+            except OSError as error:
+                # The file is then read from the shared filesystem
+                print(f"Could not copy {path} to local scratch: {error}")
+            entry['copied'].set()
+
+    # Copying finished outputs back, and only then recording the file ID as finished
+    def writing_back(self):
+        while True:
+            item = self.write_back_queue.get()
+            if item is None:
+                break
+            file_id, outputs = item
+            try:
+                for local, path in outputs:
+                    if os.path.exists(local):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        shutil.copyfile(local, f"{path}.tmp")
+                        os.replace(f"{path}.tmp", path)
+                        os.remove(local)
+                if file_id is not None:
+                    manifest.record_file(self.config, self.stage, file_id)
+                    checkpoint.mark_completed(self.config, self.stage, self.task_id, file_id)
+            except OSError as error:
+                self.errors.append(error)
+                print(f"Could not copy the outputs of {file_id} back from local scratch: {error}")
+
+    def reading(self, path):
+        entry = self.inputs.get(path)
+        if entry is None:
+            return path
+        with self.progress:
+            self.consumed_index = max(self.consumed_index, entry['index'])
+            self.progress.notify_all()
+        entry['copied'].wait()
+        return entry['local'] or path
+
+    def writing(self, path):
+        local = self.local_path(path)
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        self.outputs.append((local, path))
+        return local
+
+    def finishing_file(self, file_id):
+        outputs, self.outputs = self.outputs, []
+        self.write_back_queue.put((file_id, outputs))
+        for path in self.inputs_of_file.get(file_id, []):
+            if self.inputs[path]['local'] and os.path.exists(self.inputs[path]['local']):
+                os.remove(self.inputs[path]['local'])
+
+    def discarding_file(self):
+        for local, _ in self.outputs:
+            if os.path.exists(local):
+                os.remove(local)
+        self.outputs = []
+
+    def finishing(self):
+        # Stopping the prefetcher, then copying the remaining outputs back
+        with self.progress:
+            self.consumed_index = len(self.inputs_of_file)
+            self.progress.notify_all()
+        self.prefetcher.join()
+        self.write_back_queue.put((None, self.outputs))
+        self.write_back_queue.put(None)
+        self.writer.join()
+        shutil.rmtree(self.folder, ignore_errors=True)
+        if self.errors:
+            raise OSError(f"{len(self.errors)} outputs could not be copied back from local scratch, see the messages above")
+
+
+# --- STARTING AND FINISHING THE STAGING OF ONE LOOP --- #
+def starting_staging(config, stage, task_id, file_ids):
+    '''
+    Starts copying the inputs of the file IDs to local scratch, if use_local_scratch is set and there is local scratch.
+    :param config: The loaded config
+    :param stage: Stage name (e.g. 'generic_exh_postprocessing', 'collapse_summary')
+    :param task_id: Array task id
+    :param file_ids: File IDs the loop will process, in order
+    '''
+    global _staging
+    if not use_local_scratch(config):
+        return
+    scratch = local_scratch_folder(config)
+    if scratch is None:
+        print("No local scratch found, reading and writing the shared filesystem directly.")
+        return
+    # File IDs finished by an earlier run of this task are skipped by the loop, so they are not copied
+    completed = checkpoint.completed_files(config, stage)
+    file_ids = [file_id for file_id in file_ids if file_id not in completed]
+    folder = os.path.join(scratch, f"wavepp_{stage}_{task_id}_{os.getpid()}")
+    os.makedirs(folder, exist_ok=True)
+    print(f"Staging the files of {stage} on local scratch in {folder}")
+    _staging = Staging(config, stage, task_id, file_ids, folder)
+
+
+def finishing_staging():
+    global _staging
+    if _staging is not None:
+        staging, _staging = _staging, None
+        staging.finishing()
+
+
+# --- PATHS USED BY THE STAGES --- #
+def input_path(path):
+    '''
+    :return: The local copy of an input file if it has been staged, otherwise the path itself
+    '''
+    return _staging.reading(path) if _staging is not None else path
+
+
+def output_path(path):
+    '''
+    :return: Where to write an output file: on local scratch while staging (it is copied back later), otherwise the path itself
+    '''
+    return _staging.writing(path) if _staging is not None else path
+
+
+def finishing_file(config, stage, task_id, file_id):
+    '''
+    Records a file ID as finished in the manifest and the progress journal. While staging this is done once its outputs
+    have been copied back.
+    '''
+    if _staging is not None:
+        _staging.finishing_file(file_id)
+    else:
+        manifest.record_file(config, stage, file_id)
+        checkpoint.mark_completed(config, stage, task_id, file_id)
+
+
+def discarding_file():
+    '''
+    Drops what a file ID that failed has written to local scratch, so it is not copied back with the next file ID.
+    '''
+    if _staging is not None:
+        _staging.discarding_file()
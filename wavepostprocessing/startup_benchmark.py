@@ -0,0 +1,78 @@
+############################################################################################################
+# This file measures how long it takes to import each stage module in a fresh interpreter, which is what every array
+# task pays before it starts on its files. Run it with: python -m wavepostprocessing.cli benchmark-startup
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import sys
+import statistics
+import subprocess
+from wavepostprocessing.pipeline import STAGES
+
+# Code run in the fresh interpreter: times the import and prints the elapsed seconds
+IMPORT_TIMER = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+# --- TIMING THE IMPORT OF ONE MODULE --- #
+def import_time(module, repeats=5):
+    '''
+    Imports the module in a new python process, repeats times.
+    :param module: The module name (e.g., "wavepostprocessing.collapse_results")
+    :param repeats: Number of fresh processes to time
+    :return: Median import time in seconds, or None if the module could not be imported
+    '''
+    timings = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, '-c', IMPORT_TIMER.format(module=module)], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"Importing {module} failed.")
+            return None
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+# --- SLOWEST PACKAGES IMPORTED BY ONE MODULE --- #
+def slowest_imports(module, top=3):
+    '''
+    Runs the import with python -X importtime and returns the packages imported directly by the module that take the
+    longest (cumulative) time.
+    :return: List of (package, seconds)
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], capture_output=True, text=True)
+    packages = []
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:       123 |       4567 |   pandas"; each level of nesting adds two spaces
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        self_us, cumulative_us, package = line[len('import time:'):].split('|')
+        if not cumulative_us.strip().isdigit() or len(package) - len(package.lstrip()) != 3:
+            continue
+        packages.append((package.strip(), int(cumulative_us) / 1e6))
+    return sorted(packages, key=lambda package: package[1], reverse=True)[:top]
+
+
+# --- REPORTING THE IMPORT TIME OF EVERY STAGE MODULE --- #
+def benchmark_startup(repeats=5):
+    '''
+    Prints the median import time of each stage module and the packages that make up most of it.
+    :param repeats: Number of fresh processes to time per module
+    :return: Dictionary of module name and median import time in seconds
+    '''
+    modules = []
+    for stage in STAGES:
+        if stage['module'] not in modules:
+            modules.append(stage['module'])
+
+    results = {}
+    print(f"{'Module':<50}{'Import (s)':>12}   Slowest imports")
+    for module in modules:
+        results[module] = import_time(module, repeats)
+        if results[module] is None:
+            print(f"{module:<50}{'failed':>12}")
+            continue
+        slowest = ', '.join(f"{package} {seconds:.2f}s" for package, seconds in slowest_imports(module))
+        print(f"{module:<50}{results[module]:>12.3f}   {slowest}")
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_startup(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,143 @@
+############################################################################################################
+# This file records how long the main processing steps take. Functions decorated with @timed write one JSON line per
+# call (a span) to <log_folder>/telemetry/, with the stage, function, file ID, number of rows and elapsed seconds.
+# Each process writes its own file, so array tasks running at the same time never write to the same file.
+# The spans are summarised with: python -m wavepostprocessing.cli profile <directory>
+# Switched on by setting record_telemetry to Yes in the config file.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import glob
+import json
+import time
+import functools
+
+
+# --- PATH TO THE TELEMETRY FOLDER AND TO THE SPAN FILE OF THIS PROCESS --- #
+def telemetry_folder(config):
+    return os.path.join(config.get('root_folder'), config.get('log_folder'), 'telemetry')
+
+
+def span_file(config):
+    job_id = os.environ.get('SLURM_ARRAY_JOB_ID', os.environ.get('SLURM_JOB_ID', 'interactive'))
+    task_id = os.environ.get('SLURM_ARRAY_TASK_ID', 0)
+    return os.path.join(telemetry_folder(config), f"{job_id}_task{task_id}_{os.getpid()}.jsonl")
+
+
+# --- DATAFRAMES PASSED TO OR RETURNED BY A FUNCTION --- #
+def _dataframes(values):
+    for value in values:
+        if hasattr(value, 'columns'):
+            yield value
+        elif isinstance(value, (list, tuple)):
+            yield from _dataframes(value)
+
+
+# --- FILE ID AND NUMBER OF ROWS OF A CALL --- #
+def describing_call(args, result):
+    '''
+    Works out which file a call processed and how many rows it handled, from the arguments and the returned value.
+    The steps take either a list of file IDs or dataframes with a file_id column; cohort level steps have no file ID.
+    :return: file_id (or None), rows (or None)
+    '''
+    file_id = None
+    for arg in args:
+        # The per-file stages call the steps with a list holding the one file ID being processed
+        if isinstance(arg, list) and len(arg) == 1 and isinstance(arg[0], str):
+            file_id = arg[0]
+            break
+    if file_id is None:
+        for dataframe in _dataframes(args):
+            if 'file_id' in dataframe.columns and len(dataframe) > 0:
+                file_id = str(dataframe['file_id'].iloc[0])
+                break
+
+    # Rows returned, or rows passed in for steps that do not return a dataframe
+    dataframes = list(_dataframes([result])) or list(_dataframes(args))
+    rows = sum(len(dataframe) for dataframe in dataframes) if dataframes else None
+    return file_id, rows
+
+
+# --- DECORATOR TIMING A PROCESSING STEP --- #
+def timed(function):
+    '''
+    Writes a span for every call of the decorated function. The config is taken from the module the function is defined
+    in, which is where the stage scripts keep it.
+    '''
+    stage = os.path.splitext(os.path.basename(function.__code__.co_filename))[0]
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+
+        config = function.__globals__.get('config')
+        if config and config.get('record_telemetry', 'No').lower() == 'yes':
+            file_id, rows = describing_call(list(args) + list(kwargs.values()), result)
+            span = {'stage': stage, 'function': function.__name__, 'file_id': file_id, 'rows': rows, 'elapsed': round(elapsed, 4),
+                    'start': round(start, 3), 'job_id': os.environ.get('SLURM_ARRAY_JOB_ID'), 'task_id': os.environ.get('SLURM_ARRAY_TASK_ID')}
+            try:
+                os.makedirs(telemetry_folder(config), exist_ok=True)
+                with open(span_file(config), 'a') as file:
+                    file.write(json.dumps(span) + '\n')
+            except OSError as error:
+                # Telemetry must never stop the processing
+                print(f"Could not write telemetry: {error}")
+        return result
+
+    return wrapper
+
+
+# --- READING ALL SPANS --- #
+def reading_spans(config):
+    spans = []
+    for path in sorted(glob.glob(os.path.join(telemetry_folder(config), '*.jsonl'))):
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    # Last line of a task that was killed while writing
+                    continue
+    return spans
+
+
+# --- SUMMARISING THE SPANS --- #
+def profile_report(config, top=10):
+    '''
+    Prints the time spent per stage and function, and the files that took the longest over all steps.
+    :param config: The loaded config
+    :param top: Number of slowest files to list
+    :return: Dictionary with the per function totals and the slowest files
+    '''
+    spans = reading_spans(config)
+    if not spans:
+        print(f"No telemetry found in {telemetry_folder(config)}. Set record_telemetry to Yes in the config file to record it.")
+        return {'functions': {}, 'slowest_files': []}
+
+    functions = {}
+    files = {}
+    for span in spans:
+        summary = functions.setdefault((span['stage'], span['function']), {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0})
+        summary['calls'] += 1
+        summary['seconds'] += span['elapsed']
+        summary['max_seconds'] = max(summary['max_seconds'], span['elapsed'])
+        summary['rows'] += span.get('rows') or 0
+        if span.get('file_id'):
+            files[span['file_id']] = files.get(span['file_id'], 0.0) + span['elapsed']
+
+    total = sum(summary['seconds'] for summary in functions.values())
+    print(f"{'Stage':<30}{'Function':<26}{'Calls':>8}{'Total (s)':>12}{'Share':>8}{'Mean (s)':>10}{'Max (s)':>10}{'Rows/s':>12}")
+    for (stage, function), summary in sorted(functions.items(), key=lambda item: item[1]['seconds'], reverse=True):
+        rows_per_second = summary['rows'] / summary['seconds'] if summary['seconds'] > 0 and summary['rows'] else 0
+        print(f"{stage:<30}{function:<26}{summary['calls']:>8}{summary['seconds']:>12.1f}{summary['seconds'] / total if total else 0:>8.1%}"
+              f"{summary['seconds'] / summary['calls']:>10.2f}{summary['max_seconds']:>10.2f}{rows_per_second:>12.0f}")
+
+    slowest_files = sorted(files.items(), key=lambda item: item[1], reverse=True)[:top]
+    print(f"\nSlowest {len(slowest_files)} files:")
+    for file_id, seconds in slowest_files:
+        print(f"{file_id:<40}{seconds:>10.1f} s")
+
+    return {'functions': functions, 'slowest_files': slowest_files}
@@ -7,15 +7,14 @@
 # 1.1 Edited to output verification checks in word document rather than in excel work book as in version 1.0
 ############################################################################################################
 # IMPORTING PACKAGES #
-import docx
 #import config
 import os
 import pandas as pd
-from docx.shared import RGBColor
 import operator
-from docx.enum.section import WD_ORIENTATION, WD_SECTION
 from wavepostprocessing.Housekeeping import filenames_to_remove
 from wavepostprocessing.config import load_config, print_message
+from wavepostprocessing.schemas import reading_csv, SCHEMAS
+from wavepostprocessing import hourly_dataset
 #from Housekeeping import filenames_to_remove
 #from config import load_config, print_message
 import sys
@@ -27,6 +26,8 @@ def create_verif_log(log_header):
     This function creates a verification log as a docx format.
     :return: verif_log: Returning a verification log, where verification checks of the SUMMARY_MEANS and part_processed hourly files will be outputted
     """
+    # python-docx is imported here rather than at the top, so importing this module (e.g. for dataframe()) stays cheap
+    import docx
     verif_log = docx.Document()
     verif_log.add_heading(f"{log_header} - {config.get('pc_date')}")
     return verif_log
@@ -61,6 +62,7 @@ def add_text(log, text_to_log, x, y, z):
     :param x, y, z: Specifies the color that the text will be printed in. Black text= (0,0,0), red text = (255,0,0), green text = (0,155,0)
     :return: None
     """
+    from docx.shared import RGBColor
     # Adding to the verification log
     paragraph = log.add_paragraph()
     run = paragraph.add_run(f"{text_to_log}")
@@ -76,6 +78,7 @@ def add_description_text(log, description, x, y, z):
     :param x, y, z: Specifies the color that the text will be printed in. Black text= (0,0,0), red text = (255,0,0), green text = (0,155,0)
     :return: None
     """
+    from docx.shared import RGBColor
     # Adding to the verification log
     paragraph = log.add_paragraph()
     run = paragraph.add_run(f"{description}")
@@ -89,6 +92,7 @@ def add_text_no_error(log, text_no_error):
     :param text_no_error: The explanatory text that are being printed to the log.
     :return: None
     """
+    from docx.shared import RGBColor
     # Adding to the verification log
     paragraph = log.add_paragraph()
     run = paragraph.add_run(f"{text_no_error}")
@@ -103,6 +107,7 @@ def landscape(log):
     :param log: The document that is being changed.
     :return:
     """
+    from docx.enum.section import WD_ORIENTATION, WD_SECTION
     new_section = log.add_section(WD_SECTION.NEW_PAGE)
     new_section.orientation = WD_ORIENTATION.LANDSCAPE
     new_section.page_width, new_section.page_height = new_section.page_height, new_section.page_width
@@ -113,21 +118,31 @@ def portrait(log):
     :param log: The document that is being changed
     :return:
     """
+    from docx.enum.section import WD_ORIENTATION, WD_SECTION
     new_section = log.add_section(WD_SECTION.NEW_PAGE)
     new_section.orientation = WD_ORIENTATION.PORTRAIT
     new_section.page_width, new_section.page_height = new_section.page_height, new_section.page_width
 
 # --- CHECKING IF DATASET EXISTS AND THEN READING IT IN --- #
-def dataframe(file_name, variable):
+def dataframe(file_name, variable, kind):
     """
     Importing dataset as dataframe and creating a flag if the dataset doesn't exist.
     :param file_name: The dataset to import.
+    :param kind: summary or hourly. Only the variables checked below are read in (see schemas.py).
     :return: df. The dataset as dataframe if it exists.
     :return: file_exists. Flag to indicate if the dataset exists.
     """
+    # The hourly/minute level file kept as a Parquet dataset is read with the housekeeping filter pushed down (see hourly_dataset.py)
+    if kind == 'hourly' and hourly_dataset.use_dataset(config):
+        if not os.path.exists(hourly_dataset.metadata_path(config)):
+            return None, False
+        exclude = (variable, filenames_to_remove) if config.get('run_housekeeping').lower() == 'yes' else None
+        df = hourly_dataset.reading_dataset(config, columns=SCHEMAS['hourly']['columns']['verification_checks'], exclude=exclude, text=['subject_code'])
+        return df, True
+
     dataframe_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('summary_folder'), f'{file_name}.csv')
     if os.path.exists(dataframe_path):
-        df = pd.read_csv(dataframe_path, dtype={'subject_code': str})
+        df = reading_csv(config, dataframe_path, kind, stage='verification_checks', text=['subject_code'])
         file_exists = True
         if config.get('run_housekeeping').lower() == 'yes':
             df = df[(~df[variable].isin(filenames_to_remove))]
@@ -957,7 +972,7 @@ if __name__ == '__main__':
     # --- SECTION 1: VERIFICATION OF OUTPUT SUMMARY OVERALL MEANS --- #
     # Creating verification log and importing summary dataframe
     verif_log = create_verif_log("VERIFICATION LOG")
-    summary_df, summary_file_exists = dataframe(file_name=config.get('sum_output_file'), variable='id')
+    summary_df, summary_file_exists = dataframe(file_name=config.get('sum_output_file'), variable='id', kind='summary')
 
     # If dataframe exists, print out files processed, devices used and summary of start dates
     if summary_file_exists:
@@ -1198,7 +1213,7 @@ if __name__ == '__main__':
 
     # --- SECTION 2: VERIFICATION OF HOURLY FILE(S) --- #
     # Importing hourly dataframe
-    hourly_df, hourly_file_exists = dataframe(file_name=config.get('hour_output_file'), variable='file_id')
+    hourly_df, hourly_file_exists = dataframe(file_name=config.get('hour_output_file'), variable='file_id', kind='hourly')
     add_header(log_header="VERIFICATION OF HOURLY FILES")
 
     # If dataframe exists, tag duplicates and print to log if there are any
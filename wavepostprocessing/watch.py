@@ -0,0 +1,202 @@
+############################################################################################################
+# This file watches the results folder for new output from Wave/pampro and processes each new file ID as soon as all of
+# its files are there, all the way to the appended summary, daily and hourly/minute level files (as run-one does).
+# A file ID is picked up when it has both a metadata and a data file, by the same rules as filelist_generation, and its
+# files have not changed size for settle_seconds, so files that are still being copied in are left alone.
+# File IDs with a metadata file but no data file are left to the next filelist generation, as the data file may
+# still be on its way.
+# The file IDs processed are listed in <log_folder>/watch/processed.txt. When the watch is started for the first time,
+# the file IDs already in the results folder are taken to have been processed by the normal pipeline.
+# The rows of a file ID can only be replaced in appended output files that exist. If one has not been written yet (e.g.
+# with --process-existing on a new project), the file IDs ready are processed and then all individual files appended in full.
+# Started with: python -m wavepostprocessing.cli watch <directory>
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import re
+import time
+from colorama import Fore
+from wavepostprocessing.config import load_config, print_message
+from wavepostprocessing.planning import expected_results_files
+from wavepostprocessing.quarantine import quarantine_file
+from wavepostprocessing.run_one import run_one, appended_levels
+import wavepostprocessing.appending_files as appending
+
+
+# --- PATH TO THE LIST OF PROCESSED FILE IDS --- #
+def processed_path(config):
+    return os.path.join(config.get('root_folder'), config.get('log_folder'), 'watch', 'processed.txt')
+
+
+def reading_processed(config):
+    '''
+    :return: Set of file IDs processed so far, or None if the watch has not been run before
+    '''
+    if not os.path.exists(processed_path(config)):
+        return None
+    with open(processed_path(config), 'r') as file:
+        return {line[:-1] for line in file if line.endswith('\n')}
+
+
+def marking_processed(config, file_ids):
+    os.makedirs(os.path.dirname(processed_path(config)), exist_ok=True)
+    with open(processed_path(config), 'a') as file:
+        file.write(''.join(f"{file_id}\n" for file_id in file_ids))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+# --- FILE IDS WITH BOTH A METADATA AND A DATA FILE --- #
+def complete_file_ids(config):
+    # Importing here, as filelist_generation keeps the config in a module variable
+    import wavepostprocessing.filelist_generation as filelist_generation
+    # The watch keeps its own list of processed file IDs, so the appended summary file does not have to be read on every poll
+    filelist_generation.config = dict(config, only_new_files='No')
+    filelist_df, _ = filelist_generation.select_files(expected_results_files(config))
+    return list(dict.fromkeys(filelist_df['filename_temp']))
+
+
+# --- SIZE AND MODIFICATION TIME OF THE FILES OF EACH FILE ID --- #
+def file_states(config):
+    results_path = os.path.join(config.get('root_folder'), config.get('results_folder'))
+    states = {}
+    with os.scandir(results_path) as entries:
+        for entry in entries:
+            if entry.name.endswith('.csv') and entry.is_file():
+                stat = entry.stat()
+                states[entry.name] = (stat.st_size, stat.st_mtime)
+    return states
+
+
+def file_id_of(name):
+    '''
+    :return: The file ID of a file in the results folder, named <file_type>_<file_id>.csv as in filelist_generation, or
+             <type>meta_<file_id>.csv for the pampro metafiles as in pampro_merge_metafiles; None for other files
+    '''
+    stem = name[:-len('.csv')]
+    if 'meta' in name and not name.startswith('metadata'):
+        return re.split(r'(?<=meta)', stem, maxsplit=1)[1].lstrip('_')
+    if '_' not in stem:
+        return None
+    return stem.split('_', 1)[1]
+
+
+def id_signatures(states):
+    '''
+    :return: For each file ID, the names, sizes and modification times of its data file, metadata file and, for pampro, the
+             metafiles the metadata file is merged from
+    '''
+    signatures = {}
+    for name, state in sorted(states.items()):
+        signatures.setdefault(file_id_of(name), []).append((name, state))
+    return {file_id: tuple(signature) for file_id, signature in signatures.items()}
+
+
+# --- CHECKING THAT THE APPENDED OUTPUT FILES HAVE BEEN WRITTEN --- #
+def outputs_appended(config):
+    appending.config = config
+    return all(appending.output_exists(output_file, append_level) for append_level, _, _, output_file in appended_levels(config, None))
+
+
+def appending_in_full(directory, config, file_ids):
+    '''
+    Processes the file IDs without replacing their rows, then appends all individual files in full.
+    :return: List of the file IDs processed, the others have been quarantined
+    '''
+    print_message("The appended output files have not been written yet, appending all individual files in full")
+    done = []
+    for file_id in file_ids:
+        try:
+            run_one(directory, file_id, patch=False)
+        except Exception as error:
+            quarantine_file(config, 'watch', file_id, error)
+            continue
+        done.append(file_id)
+    if not done:
+        return done
+
+    appending.config = config
+    # create_filelist changes the working directory
+    working_directory = os.getcwd()
+    try:
+        appending.appending_outputs()
+    except Exception as error:
+        for file_id in done:
+            quarantine_file(config, 'watch', file_id, error)
+        return []
+    finally:
+        os.chdir(working_directory)
+    return done
+
+
+# --- WATCHING THE RESULTS FOLDER --- #
+def watch(directory, poll_interval=60, settle_seconds=60, process_existing=False, once=False):
+    '''
+    :param directory: Directory containing config.json
+    :param poll_interval: Seconds between two looks at the results folder
+    :param settle_seconds: Seconds the files of a file ID must have been left unchanged before it is processed
+    :param process_existing: On the first start, also process the file IDs already in the results folder
+    :param once: Look at the results folder once and stop, e.g. when run from cron
+    :return: Number of file IDs processed
+    '''
+    config = load_config(directory)
+    processed = reading_processed(config)
+    if processed is None:
+        processed = set()
+        if not process_existing:
+            processed = set(complete_file_ids(config))
+            marking_processed(config, sorted(processed))
+            print_message(f"Watch started for the first time, {len(processed)} file IDs already in the results folder are taken as processed.")
+
+    failed = set()
+    last_signatures = {}
+    processed_count = 0
+    print_message(f"Watching {os.path.join(config.get('root_folder'), config.get('results_folder'))} for new files")
+    while True:
+        states = file_states(config)
+        now = time.time()
+        new_ids = [file_id for file_id in complete_file_ids(config) if file_id not in processed and file_id not in failed]
+
+        ready_ids = []
+        signatures = {}
+        signatures_of_ids = id_signatures(states)
+        for file_id in new_ids:
+            signature = signatures_of_ids.get(file_id, ())
+            signatures[file_id] = signature
+            newest = max((state[1] for _, state in signature), default=now)
+            if now - newest >= settle_seconds and (once or last_signatures.get(file_id) == signature):
+                ready_ids.append(file_id)
+        last_signatures = signatures
+
+        if new_ids:
+            print(f"{len(new_ids)} new file IDs, {len(ready_ids)} ready to process")
+        if ready_ids and not outputs_appended(config):
+            done = appending_in_full(directory, config, ready_ids)
+            failed.update(set(ready_ids) - set(done))
+            marking_processed(config, done)
+            processed.update(done)
+            processed_count += len(done)
+            ready_ids = []
+        for file_id in ready_ids:
+            try:
+                run_one(directory, file_id)
+            except Exception as error:
+                # Kept in the quarantine list, so it can be resubmitted. It is tried again when the watch is restarted.
+                quarantine_file(config, 'watch', file_id, error)
+                failed.add(file_id)
+                continue
+            marking_processed(config, [file_id])
+            processed.add(file_id)
+            processed_count += 1
+
+        if once:
+            break
+        try:
+            time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print_message("Watch stopped.")
+            break
+
+    if failed:
+        print(Fore.RED + f"{len(failed)} file IDs failed and have been quarantined." + Fore.RESET)
+    return processed_count
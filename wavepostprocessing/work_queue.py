@@ -0,0 +1,189 @@
+############################################################################################################
+# This file implements a shared work queue on the filesystem. Instead of working through a fixed filelist{i}.txt
+# slice, each array task pulls file IDs from the full filelist until no unclaimed IDs are left.
+# An ID is claimed by atomically creating a claim file (O_CREAT | O_EXCL) in the filelist folder, so two tasks can never
+# process the same ID. Claims are kept per array job, so resubmitting a stage starts with an empty set of claims.
+# A claim file holds its owner (job, task, host and process), and "done" once the owner has moved on from the ID. While
+# a task is running, it touches a heartbeat file every minute. Once the queue is drained, a task keeps looking at the
+# claims that are not done and not finished in the progress journal, until each is done or its owner has not touched
+# its heartbeat for CLAIM_LEASE_SECONDS, i.e. the task died part way, and the claim is taken over. So an ID left by a
+# task that died is processed even if the other tasks drained the queue before its lease expired.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import csv
+import time
+import shutil
+import socket
+import threading
+from wavepostprocessing.checkpoint import completed_files
+
+# A claim whose owner has not touched its heartbeat for this long was left by a task that is no longer running
+CLAIM_LEASE_SECONDS = 600
+HEARTBEAT_SECONDS = 60
+# Seconds between two looks at the claims still open once the queue is drained
+CLAIM_POLL_SECONDS = 30
+OWNERS_FOLDER = '.owners'
+
+
+# --- PATH TO THE CLAIMS FOLDER --- #
+def claims_folder(config):
+    return os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder'), 'claims')
+
+
+# --- READING ALL FILE IDS FROM THE FULL FILELIST --- #
+def reading_queue(config):
+    '''
+    Reads the full filelist written by filelist_generation and returns the unique file IDs in the order they are listed.
+    :param config: The loaded config
+    :return: files_list
+    '''
+    # retry_filelist.txt when resubmitting quarantined files
+    filelist_name = f"{os.environ.get('WAVEPP_FILELIST_PREFIX', 'filelist')}.txt"
+    filelist_path = os.path.join(config.get('root_folder'), config.get('results_folder'), config.get('filelist_folder'), filelist_name)
+    with open(filelist_path, 'r', newline='') as file:
+        # dict keeps the first occurrence of each ID, in order
+        files_list = dict.fromkeys(row['filename_temp'] for row in csv.DictReader(file, delimiter='\t'))
+    return list(files_list)
+
+
+# --- OWNER OF A CLAIM AND ITS HEARTBEAT --- #
+def owner_name(task_id):
+    job_id = os.environ.get('SLURM_ARRAY_JOB_ID', os.environ.get('SLURM_JOB_ID', 'interactive'))
+    return f"{job_id}_task{task_id}_{socket.gethostname()}_{os.getpid()}"
+
+
+def heartbeat_path(folder, owner):
+    return os.path.join(folder, OWNERS_FOLDER, owner)
+
+
+def touching_heartbeat(folder, owner):
+    path = heartbeat_path(folder, owner)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a'):
+        os.utime(path)
+
+
+def keeping_heartbeat(folder, owner, stopped):
+    # Runs in a thread, so that the heartbeat is kept while a long file is being processed
+    while not stopped.wait(HEARTBEAT_SECONDS):
+        touching_heartbeat(folder, owner)
+
+
+def owner_alive(folder, owner):
+    try:
+        return time.time() - os.path.getmtime(heartbeat_path(folder, owner)) < CLAIM_LEASE_SECONDS
+    except FileNotFoundError:
+        return False
+
+
+# --- READING AND WRITING CLAIM FILES --- #
+def reading_claim(path):
+    '''
+    :return: Owner of the claim and whether the owner has moved on from the ID; owner is None if there is no claim
+    '''
+    try:
+        with open(path, 'r') as claim_file:
+            lines = claim_file.read().splitlines()
+    except FileNotFoundError:
+        return None, False
+    # A claim file is empty for a moment after it is created
+    return (lines[0] if lines else ''), 'done' in lines[1:]
+
+
+def writing_claim(path, owner):
+    temp_path = f"{path}.{owner}.tmp"
+    with open(temp_path, 'w') as claim_file:
+        claim_file.write(f"{owner}\n")
+    os.replace(temp_path, path)
+
+
+def marking_done(path):
+    with open(path, 'a') as claim_file:
+        claim_file.write("done\n")
+
+
+def taking_over(folder, file_id, owner):
+    '''
+    Takes over the claim of a task that died. Only one task can create the take-over file for a given dead owner, so the
+    claim is taken over once; if the new owner dies as well, the claim can be taken over again.
+    :return: True if this task now owns the claim
+    '''
+    claim_path = os.path.join(folder, file_id)
+    dead_owner, done = reading_claim(claim_path)
+    if not dead_owner or done or dead_owner == owner or owner_alive(folder, dead_owner):
+        return False
+    try:
+        os.close(os.open(os.path.join(folder, f"{file_id}@{dead_owner}"), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    writing_claim(claim_path, owner)
+    return True
+
+
+def open_claims(config, queue_name, folder, files_list, owner):
+    '''
+    :return: The IDs claimed by other tasks that are neither done nor finished in the progress journal
+    '''
+    completed = completed_files(config, queue_name)
+    open_ids = []
+    for file_id in files_list:
+        claim_owner, done = reading_claim(os.path.join(folder, file_id))
+        if claim_owner is not None and claim_owner != owner and not done and file_id not in completed:
+            open_ids.append(file_id)
+    return open_ids
+
+
+# --- CLAIMING FILE IDS UNTIL THE QUEUE IS EMPTY --- #
+def claim_files(config, queue_name, task_id=None):
+    '''
+    Generator yielding the file IDs this task has claimed. Each ID is yielded to exactly one task per array job, unless
+    the task it was yielded to died before moving on from it. An ID is marked done when the next one is asked for, so
+    an ID whose processing raised out of the loop is left for the other tasks to take over.
+    :param config: The loaded config
+    :param queue_name: Name of the queue, one per processing step (e.g. 'generic_exh_postprocessing', 'collapse_summary')
+    :param task_id: Array task id, written into the claim file with the job, host and process
+    :return: Generator of file IDs
+    '''
+    job_id = os.environ.get('SLURM_ARRAY_JOB_ID', os.environ.get('SLURM_JOB_ID', 'interactive'))
+    folder = os.path.join(claims_folder(config), f"{queue_name}_{job_id}")
+    os.makedirs(folder, exist_ok=True)
+    owner = owner_name(task_id)
+    touching_heartbeat(folder, owner)
+    stopped = threading.Event()
+    threading.Thread(target=keeping_heartbeat, args=(folder, owner, stopped), daemon=True).start()
+
+    try:
+        files_list = reading_queue(config)
+        for file_id in files_list:
+            claim_path = os.path.join(folder, file_id)
+            try:
+                fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, 'w') as claim_file:
+                claim_file.write(f"{owner}\n")
+            yield file_id
+            marking_done(claim_path)
+
+        # The queue is drained, waiting for the IDs other tasks are still processing and taking over those of tasks that died
+        open_ids = open_claims(config, queue_name, folder, files_list, owner)
+        if open_ids:
+            print(f"Waiting for {len(open_ids)} file IDs claimed by other tasks to be finished or left by a task that is no longer running.")
+        while open_ids:
+            for file_id in open_ids:
+                if not taking_over(folder, file_id, owner):
+                    continue
+                print(f"Taking over {file_id} from a task that is no longer running.")
+                yield file_id
+                marking_done(os.path.join(folder, file_id))
+            open_ids = open_claims(config, queue_name, folder, files_list, owner)
+            if open_ids:
+                time.sleep(CLAIM_POLL_SECONDS)
+    finally:
+        stopped.set()
+
+
+# --- REMOVING CLAIMS FROM PREVIOUS RUNS --- #
+def reset_queues(config):
+    shutil.rmtree(claims_folder(config), ignore_errors=True)
@@ -0,0 +1,258 @@
+############################################################################################################
+# This file runs a long-lived worker that processes batches of file IDs without starting a new Python process for each
+# of them. The worker imports the stage modules and loads the config once, and then runs the postprocessing and
+# collapse of each file (as fused_pipeline does) for every batch put in its queue folder.
+# Batches are added with: python -m wavepostprocessing.cli enqueue <directory> <file_id> ...
+# and workers are started on an allocated node with: python -m wavepostprocessing.cli worker <directory>
+#
+# The queue is a folder on the shared filesystem (<log_folder>/worker_queue/) holding one text file per batch, with one
+# file ID per line. A worker claims a batch by renaming it from incoming/ to working/, which only one worker can do, so
+# several workers (on one or more nodes) can take batches from the same queue. Finished batches are moved to done/.
+# While a worker processes a batch, it touches the batch file every minute. A batch in working/ that has not been
+# touched for BATCH_LEASE_SECONDS was left by a worker that died (on any node), and is returned to incoming/ by whichever
+# worker finds the queue empty next. Batches of workers that died on the same node are returned straight away.
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import time
+import socket
+import threading
+import itertools
+from datetime import datetime
+from colorama import Fore
+from wavepostprocessing.config import load_config, print_message
+from wavepostprocessing import manifest
+from wavepostprocessing.quarantine import quarantine_file, invalidating_outputs
+import wavepostprocessing.fused_pipeline as fused
+import wavepostprocessing.collapse_results as collapse
+
+# Name of the file that tells the workers to stop once the queue is empty
+STOP_FILE = 'STOP'
+
+# A batch in working/ that has not been touched for this long was left by a worker that is no longer running
+BATCH_LEASE_SECONDS = 600
+HEARTBEAT_SECONDS = 60
+
+_batch_count = itertools.count(1)
+
+
+# --- PATHS TO THE QUEUE FOLDERS --- #
+def queue_folder(config, name=''):
+    return os.path.join(config.get('root_folder'), config.get('log_folder'), 'worker_queue', name)
+
+
+def setting_up_queue(config):
+    for name in ['incoming', 'working', 'done']:
+        os.makedirs(queue_folder(config, name), exist_ok=True)
+
+
+# --- ADDING A BATCH OF FILE IDS TO THE QUEUE --- #
+def enqueue_files(config, file_ids, batch_size=20):
+    '''
+    Writes the file IDs to the queue in batches. Each batch is written to a temporary file first and then renamed, so a
+    worker never picks up a batch that is only partly written. A stop file left from an earlier session is removed.
+    :param config: The loaded config
+    :param file_ids: List of file IDs
+    :param batch_size: Number of file IDs per batch
+    :return: Number of batches written
+    '''
+    setting_up_queue(config)
+    if os.path.exists(queue_folder(config, STOP_FILE)):
+        os.remove(queue_folder(config, STOP_FILE))
+    batches = [file_ids[i:i + batch_size] for i in range(0, len(file_ids), batch_size)]
+    for batch in batches:
+        name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{next(_batch_count)}.txt"
+        temp_path = queue_folder(config, f".{name}")
+        with open(temp_path, 'w') as file:
+            file.write(''.join(f"{file_id}\n" for file_id in batch))
+        os.replace(temp_path, os.path.join(queue_folder(config, 'incoming'), name))
+    return len(batches)
+
+
+def stopping_workers(config):
+    setting_up_queue(config)
+    open(queue_folder(config, STOP_FILE), 'w').close()
+
+
+# --- CLAIMING THE NEXT BATCH --- #
+def claiming_batch(config):
+    '''
+    :return: Path of the claimed batch in working/, or None if the queue is empty
+    '''
+    owner = f"{socket.gethostname()}_{os.getpid()}"
+    for name in sorted(os.listdir(queue_folder(config, 'incoming'))):
+        incoming_path = os.path.join(queue_folder(config, 'incoming'), name)
+        claimed_path = os.path.join(queue_folder(config, 'working'), f"{name}@{owner}")
+        try:
+            # Touched before it is moved, so the lease starts with the claim (renaming keeps the modification time)
+            os.utime(incoming_path)
+            os.rename(incoming_path, claimed_path)
+        except FileNotFoundError:
+            # Claimed by another worker
+            continue
+        return claimed_path
+    return None
+
+
+# --- KEEPING THE LEASE ON A CLAIMED BATCH --- #
+def keeping_lease(batch_path, stopped):
+    # Runs in a thread, so that the lease is kept while a long batch is being processed
+    while not stopped.wait(HEARTBEAT_SECONDS):
+        try:
+            os.utime(batch_path)
+        except FileNotFoundError:
+            # Returned to the queue by another worker
+            return
+
+
+def owner_dead(name):
+    '''
+    :return: True if the batch was claimed by a worker on this node that is no longer running
+    '''
+    owner = name.rpartition('@')[2]
+    host, _, pid = owner.rpartition('_')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+# --- RETURNING BATCHES OF WORKERS THAT DIED --- #
+def releasing_stale_batches(config):
+    '''
+    Returns to the queue the batches whose lease has expired, or whose worker on this node is no longer running.
+    :return: Number of batches returned
+    '''
+    released = 0
+    for name in os.listdir(queue_folder(config, 'working')):
+        working_path = os.path.join(queue_folder(config, 'working'), name)
+        try:
+            expired = time.time() - os.path.getmtime(working_path) >= BATCH_LEASE_SECONDS
+        except FileNotFoundError:
+            continue
+        if not expired and not owner_dead(name):
+            continue
+        batch_name = name.rpartition('@')[0]
+        try:
+            os.rename(working_path, os.path.join(queue_folder(config, 'incoming'), batch_name))
+        except FileNotFoundError:
+            # Finished, or returned by another worker
+            continue
+        print(f"Returning batch {batch_name} of a worker that is no longer running to the queue.")
+        released += 1
+    return released
+
+
+# --- KEEPING THE SLOW IMPORTS AND THE ANOMALIES IN MEMORY --- #
+def warming_up():
+    # statsmodels is only imported by collapse_results when the regressions run, so the first batch would pay for it
+    if config.get('impute_data', 'No').lower() == 'yes' or config.get('run_collapse_results_to_summary', 'No').lower() == 'yes':
+        import statsmodels.api
+
+
+def loading_anomalies(loaded, loaded_mtime):
+    '''
+    Reads the collated anomalies (pampro) again only if the file changed since it was last read.
+    :return: anomalies_df and the modification time it was read at
+    '''
+    if config.get('processing').lower() != 'pampro':
+        return None, None
+    anomaly_file_path = os.path.join(config.get('root_folder'), config.get('anomalies_folder'), config.get('anomalies_file'))
+    mtime = os.path.getmtime(anomaly_file_path) if os.path.exists(anomaly_file_path) else None
+    if loaded is not None and mtime == loaded_mtime:
+        return loaded, loaded_mtime
+    return fused.exh.anomalies(), mtime
+
+
+# --- PROCESSING ONE BATCH --- #
+def processing_batch(batch_path, anomalies_df):
+    '''
+    Runs the fused postprocessing and collapse for every file ID in the batch and writes the data dictionaries.
+    :return: Number of files processed and number of files quarantined
+    '''
+    with open(batch_path, 'r') as file:
+        file_ids = [line.strip() for line in file if line.strip()]
+
+    processed = 0
+    failed = 0
+    summary_headers_df = None
+    daily_headers_df = None
+    for file_id in file_ids:
+        if manifest.skip_file(config, 'fused_pipeline', file_id):
+            continue
+        try:
+            file_summary_headers_df, file_daily_headers_df = fused.fused_file(file_id, anomalies_df)
+        except Exception as error:
+            quarantine_file(config, 'fused_pipeline', file_id, error)
+            invalidating_outputs(config, 'fused_pipeline', file_id)
+            failed += 1
+            continue
+        summary_headers_df = file_summary_headers_df if file_summary_headers_df is not None else summary_headers_df
+        daily_headers_df = file_daily_headers_df if file_daily_headers_df is not None else daily_headers_df
+        manifest.record_file(config, 'fused_pipeline', file_id)
+        processed += 1
+
+    if summary_headers_df is not None:
+        collapse.data_dic(summary_headers_df, collapse_level='summary', file_path=collapse.summary_files_path, dictionary_name="Data_dictionary_summary_means.csv")
+    if daily_headers_df is not None:
+        collapse.data_dic(daily_headers_df, collapse_level='daily', file_path=collapse.daily_files_path, dictionary_name="Data_dictionary_daily_means.csv")
+    return processed, failed
+
+
+# --- RUNNING THE WORKER --- #
+def run_worker(directory, poll_interval=2, idle_timeout=600):
+    '''
+    Takes batches from the queue until a stop file is written and the queue is empty, or no batch arrived for idle_timeout seconds.
+    :param directory: Directory containing config.json
+    :param poll_interval: Seconds to wait before looking at an empty queue again
+    :param idle_timeout: Seconds without any batch after which the worker stops (0 to keep running until stopped)
+    :return: Number of batches processed
+    '''
+    global config
+    config = load_config(directory)
+    fused.binding_config(config)
+    setting_up_queue(config)
+    releasing_stale_batches(config)
+    warming_up()
+    print_message(f"Worker {socket.gethostname()}_{os.getpid()} waiting for batches in {queue_folder(config, 'incoming')}")
+
+    anomalies_df, anomalies_mtime = None, None
+    batches = 0
+    idle_since = time.time()
+    while True:
+        batch_path = claiming_batch(config)
+        if batch_path is None:
+            if releasing_stale_batches(config):
+                continue
+            if os.path.exists(queue_folder(config, STOP_FILE)):
+                print_message("Stop file found and the queue is empty, stopping the worker.")
+                break
+            if idle_timeout and time.time() - idle_since > idle_timeout:
+                print_message(f"No batches for {idle_timeout} seconds, stopping the worker.")
+                break
+            time.sleep(poll_interval)
+            continue
+
+        started = time.perf_counter()
+        anomalies_df, anomalies_mtime = loading_anomalies(anomalies_df, anomalies_mtime)
+        stopped = threading.Event()
+        threading.Thread(target=keeping_lease, args=(batch_path, stopped), daemon=True).start()
+        try:
+            processed, failed = processing_batch(batch_path, anomalies_df)
+        finally:
+            stopped.set()
+        try:
+            os.replace(batch_path, os.path.join(queue_folder(config, 'done'), os.path.basename(batch_path)))
+        except FileNotFoundError:
+            # The lease expired and the batch was returned to the queue; its finished files are skipped by the manifest
+            print(f"Batch {os.path.basename(batch_path)} was returned to the queue while it was being processed.")
+        print((Fore.RED if failed else Fore.GREEN) + f"Batch {os.path.basename(batch_path)}: {processed} files processed, {failed} quarantined in {time.perf_counter() - started:.1f} s" + Fore.RESET)
+        batches += 1
+        idle_since = time.time()
+
+    return batches